@@ -13,7 +13,6 @@
 import os
 import csv
 import logging
-from datetime import datetime
 from pathlib import PurePath, PureWindowsPath
 
 import sys
@@ -22,6 +21,10 @@ import person
 import message
 import attachment
 import signal_message
+import signal_db
+import row_schema
+import timestamps
+import timings
 import config
 
 ATTACHMENTS_FILENAME = "message_attachments.csv"
@@ -77,58 +80,11 @@ class SignalAttachment(attachment.Attachment):
         link += "]]" + "\n"
         return link
 
-def parse_attachments_header(row, field_map):
-    """
-    Parse the header row of the `message_attachments.csv` file and map it to
-    the fields defined in `AttachmentsFields`.
-    
-    Populates the `field_map` with tuples of field names and the corresponding 
-    indices in the CSV row.
-    
-    Parameters:
-    - row: The header row from the CSV file.
-    - field_map: A list to store the mapping of field names to their indices.
-
-    Returns:
-    - None
-    """
-
-    global AttachmentsFields
-
-    count = 0
-    for col in row:
-        for field in AttachmentsFields:
-            if col == field:
-                field_map.append( [field, count] )
-        count += 1
-def field_index(field_label, field_map):
-    """
-    Find the index of a specific field in the `field_map` based on its label.
-
-    Parameters:
-    - field_label: Label of the field to find e.g., ATTACHMENT_CONTENT_TYPE
-    - field_map: List mapping field names to their indices in the CSV row.
-
-    Returns:
-    - The index of the field if found, otherwise -1.
-    """
-
-    result = -1
-
-    for field in field_map:
-        if field[0] == field_label:
-            result = field[1]
-            break
-
-    return result
-
-def optional_field_value(row, field_map, field_labels):
+def optional_field_value(record, field_labels):
     for field_label in field_labels:
-        index = field_index(field_label, field_map)
-        if index != -1 and index < len(row):
-            value = row[index].strip()
-            if value:
-                return value
+        value = getattr(record, field_label).strip()
+        if value:
+            return value
     return ""
 
 def filename_from_path(value):
@@ -160,7 +116,7 @@ def extension_from_content_type(content_type):
 def signal_default_filename(sent_at, order_in_message, content_type):
     try:
         timestamp_ms = int(float(sent_at))
-        timestamp = datetime.fromtimestamp(timestamp_ms / 1000)
+        timestamp = timestamps.local_datetime(timestamp_ms)
         timestamp_text = timestamp.strftime("%Y-%m-%d-%H-%M-%S") + f"-{timestamp_ms % 1000:03d}"
     except Exception:
         timestamp_text = "unknown"
@@ -182,80 +138,172 @@ def preserve_exact_filename(the_attachment, filename, content_type, the_config):
     the_attachment.filename = filename
     the_attachment.custom_filename = filename
 
-def has_duplicate_attachment(the_message, candidate):
-    candidate_key = (
-        candidate.id,
-        candidate.filename,
-        candidate.type,
-        candidate.size,
-        candidate.height,
-        candidate.width,
+def attachment_key(the_attachment):
+    """
+    Get the values that identify an attachment so duplicate rows for the same
+    message can be spotted.
+
+    Parameters:
+    - the_attachment: The Attachment to get the key for.
+
+    Returns:
+    - Tuple of the attachment's id, filename, type, size, height and width.
+    """
+
+    return (
+        the_attachment.id,
+        the_attachment.filename,
+        the_attachment.type,
+        the_attachment.size,
+        the_attachment.height,
+        the_attachment.width,
     )
-    for existing in the_message.attachments:
-        existing_key = (
-            existing.id,
-            existing.filename,
-            existing.type,
-            existing.size,
-            existing.height,
-            existing.width,
-        )
-        if existing_key == candidate_key:
-            return True
-    return False
-
-def store_attachments_info(messages, the_config, field_map, row):
+
+def store_attachments_info(messages_by_id, attachment_keys, the_config, record, warn_missing=True):
     """
     Store the attachment information from a row in the `message_attachments.csv`
     file into the configuration object.
 
     Parameters:
-    - messages: List of Messages to which attachments will be added to.
+    - messages_by_id: Dictionary of the Messages attachments will be added to,
+      keyed by message id.
+    - attachment_keys: Dictionary of the `attachment_key` values already added
+      to each message, keyed by message id.
     - the_config: Configuration object with source folder and other settings.
-    - field_map: List mapping field names to their indices in the CSV row.
-    - row: List representing a row from the `message_attachments.csv` file.
+    - record: Record representing a row from the `message_attachments.csv` file.
+    - warn_missing: Log a warning if the attachment's message isn't loaded.
 
     Returns:
     - None
     """
-    the_attachment = SignalAttachment()
 
-    id = row[field_index(ATTACHMENT_MESSAGE_ID, field_map)]
+    id = record.messageId
+
+    the_message = messages_by_id.get(id)
+
+    # skip the rest of the row if it's not for one of the loaded messages
+    if the_message is None:
+        timings.count(timings.COUNTER_ATTACHMENTS_WITHOUT_MESSAGE)
+        if warn_missing and id not in MISSING_MESSAGE_IDS_WARNED:
+            MISSING_MESSAGE_IDS_WARNED.add(id)
+            logging.warning(f"No message found with id {id} for attachment.")
+        return
 
-    the_message = next((m for m in messages if m.id == id), None)
+    the_attachment = SignalAttachment()
 
     # Handle empty strings in numeric fields by defaulting to 0
-    size_str = row[field_index(ATTACHMENT_SIZE, field_map)]
+    size_str = record.size
     size = int(float(size_str)) if size_str and size_str.strip() else 0
     
-    height_str = row[field_index(ATTACHMENT_HEIGHT, field_map)]
+    height_str = record.height
     height = int(float(height_str)) if height_str and height_str.strip() else 0
     
-    width_str = row[field_index(ATTACHMENT_WIDTH, field_map)]
+    width_str = record.width
     width = int(float(width_str)) if width_str and width_str.strip() else 0
     
-    content_type = row[field_index(ATTACHMENT_CONTENT_TYPE, field_map)]
-    filename = optional_field_value(row, field_map, ATTACHMENT_FILE_NAME_CANDIDATES)
+    content_type = record.contentType
+    filename = optional_field_value(record, ATTACHMENT_FILE_NAME_CANDIDATES)
     if not filename:
-        sent_at = optional_field_value(row, field_map, [ATTACHMENT_SENT_AT])
-        order_in_message = optional_field_value(row, field_map, [ATTACHMENT_ORDER_IN_MESSAGE])
+        sent_at = optional_field_value(record, [ATTACHMENT_SENT_AT])
+        order_in_message = optional_field_value(record, [ATTACHMENT_ORDER_IN_MESSAGE])
         filename = signal_default_filename(sent_at, order_in_message, content_type)
 
-    the_attachment.type = content_type
+    the_attachment.type = signal_message.intern_string(content_type)
     the_attachment.size = size
     preserve_exact_filename(the_attachment, filename, content_type, the_config)
     the_attachment.height = height
     the_attachment.width = width
 
-    if the_message is not None:
-        if not has_duplicate_attachment(the_message, the_attachment):
-            the_message.attachments.append(the_attachment)
+    keys = attachment_keys.setdefault(id, set())
+    key = attachment_key(the_attachment)
+    if key not in keys:
+        keys.add(key)
+        the_message.add_attachment(the_attachment)
+
+def read_attachments(the_config):
+    """
+    Read the rows of the Signal `message_attachments` table, either from the
+    `message_attachments.csv` export or from the decrypted SQLite database.
+
+    Parameters:
+    - the_config: Configuration object, `signal_db` is the path to the
+      database or empty to use the CSV file in the source folder.
+
+    Returns:
+    - Generator yielding the header row followed by each row as a list.
+
+    Notes:
+    - With `--cache`, once `the_config.signal_cache` is known to match the
+      source files the rows come from the cache instead.
+    """
+
+    db_path = getattr(the_config, "signal_db", "")
+    the_cache = getattr(the_config, "signal_cache", None)
+
+    if the_cache is not None and the_cache.fresh:
+        yield from the_cache.attachments()
+    elif db_path:
+        yield from signal_db.read_table(
+            db_path, signal_db.ATTACHMENTS_TABLE, AttachmentsFields,
+            order_by=ATTACHMENT_ORDER_IN_MESSAGE)
     else:
-        if id not in MISSING_MESSAGE_IDS_WARNED:
-            MISSING_MESSAGE_IDS_WARNED.add(id)
-            logging.warning(f"No message found with id {id} for attachment.")
+        filename = os.path.join(the_config.source_folder, ATTACHMENTS_FILENAME)
+
+        with open(filename, newline='') as attachments_file:
+            yield from csv.reader(attachments_file)
+
+def source_path(the_config):
+    """
+    Get the file the attachment rows are read from, the database with `--db`.
+    """
+
+    db_path = getattr(the_config, "signal_db", "")
+    if db_path:
+        return db_path
+
+    return os.path.join(the_config.source_folder, ATTACHMENTS_FILENAME)
+
+def cache_attachments(the_cache, the_config):
+    """
+    Add the attachment rows to the `--cache` while it's being built.
+
+    Parameters:
+    - the_cache: The `parse_cache.ParseCache` being built.
+    - the_config: Configuration object containing source folder and other settings.
+
+    Returns:
+    - Number of attachment rows added.
+
+    Notes:
+    - Only the `AttachmentsFields` are kept, with the first non-empty file
+      name column as `fileName`, so the cached rows parse the same.
+    """
+
+    count = 0
+
+    try:
+        rows = read_attachments(the_config)
+        header = next(rows, None)
+        if header is None:
+            return 0
+
+        schema = row_schema.compile_header(header, AttachmentsFields, "AttachmentRow")
+        for row in rows:
+            record = schema.record(row)
+            the_cache.add_attachment([
+                record.messageId, record.conversationId, record.contentType,
+                record.sentAt, record.orderInMessage, record.height,
+                record.width, record.size,
+                optional_field_value(record, ATTACHMENT_FILE_NAME_CANDIDATES),
+            ])
+            count += 1
+
+    except Exception as e:
+        logging.error(f"cache_attachments failed: {e}")
+
+    return count
 
-def parse_attachments_file(messages, the_config):
+def parse_attachments_file(messages, the_config, warn_missing=True):
     """
     Parse the Signal SQLite `message_attachments.csv` file to extract attachment
     metadata and store it in the configuration object.
@@ -263,32 +311,130 @@ def parse_attachments_file(messages, the_config):
     Parameters:
     - messages: List of Messages to which attachments will be added to.
     - the_config: Configuration object containing source folder and other settings.
+    - warn_missing: Log a warning for attachments whose message isn't loaded.
 
     Returns:
     - None
     """
 
-    field_map = []
+    schema = None
 
     global AttachmentsFields
-  
-    try:
-        filename = os.path.join(the_config.source_folder, ATTACHMENTS_FILENAME)
-        
-        with open(filename, newline='') as attachments_file:
 
-            attachments_reader = csv.reader(attachments_file)
+    # index the messages once so each attachment row is a dictionary lookup,
+    # keeping the first message if an id appears more than once
+    messages_by_id = {}
+    for the_message in messages:
+        messages_by_id.setdefault(the_message.id, the_message)
+
+    attachment_keys = {}
+  
+    with timings.stage("attachments") as stage:
+        try:
             count = 0
-            for row in attachments_reader:
+            for row in read_attachments(the_config):
                 if count == 0:
-                    parse_attachments_header(row, field_map)
+                    schema = row_schema.compile_header(row, AttachmentsFields, "AttachmentRow")
                 else:
+                    stage.rows += 1
                     try:
-                        store_attachments_info(messages, the_config, field_map, row)
+                        store_attachments_info(messages_by_id, attachment_keys, the_config, schema.record(row), warn_missing)
                     except Exception as e:
                         logging.error(f"store_attachments_info failed: {e}")
                 count += 1
 
-    except Exception as e:
-        logging.error(f"parse_attachments_file failed: {e}")
-        return
+        except Exception as e:
+            logging.error(f"parse_attachments_file failed: {e}")
+            return
+
+def index_attachments(the_config):
+    """
+    Read the attachment rows once and index them by message id, used by
+    `--stream` to join the attachments to one window of messages at a time.
+
+    Parameters:
+    - the_config: Configuration object containing source folder and other settings.
+
+    Returns:
+    - Dictionary of lists of Records, keyed by `messageId`, in the order of
+      the rows.
+    """
+
+    index = {}
+
+    with timings.stage("attachments") as stage:
+        try:
+            rows = read_attachments(the_config)
+            header = next(rows, None)
+            if header is None:
+                return index
+
+            schema = row_schema.compile_header(header, AttachmentsFields, "AttachmentRow")
+
+            for row in rows:
+                stage.rows += 1
+                record = schema.record(row)
+                index.setdefault(record.messageId, []).append(record)
+
+        except Exception as e:
+            logging.error(f"index_attachments failed: {e}")
+
+    return index
+
+def join_attachments(messages, index, matched_ids, the_config):
+    """
+    Add the attachments from `index_attachments` to some of the messages.
+
+    Parameters:
+    - messages: List of Messages to which attachments will be added to.
+    - index: The `index_attachments` dictionary.
+    - matched_ids: Set of the message ids that had attachments joined, the
+      ids of `messages` are added to it.
+    - the_config: Configuration object containing source folder and other settings.
+
+    Returns:
+    - None
+    """
+
+    messages_by_id = {}
+    for the_message in messages:
+        messages_by_id.setdefault(the_message.id, the_message)
+
+    attachment_keys = {}
+
+    for id in messages_by_id:
+        records = index.get(id)
+        if not records:
+            continue
+
+        matched_ids.add(id)
+
+        for record in records:
+            try:
+                store_attachments_info(messages_by_id, attachment_keys, the_config, record)
+            except Exception as e:
+                logging.error(f"store_attachments_info failed: {e}")
+
+def report_unmatched_attachments(index, matched_ids, warn_missing=True):
+    """
+    Count, and warn about, the attachments from `index_attachments` whose
+    message was never joined, like `store_attachments_info` does for each row.
+
+    Parameters:
+    - index: The `index_attachments` dictionary.
+    - matched_ids: The message ids passed to `join_attachments`.
+    - warn_missing: Log a warning for each message id.
+
+    Returns:
+    - None
+    """
+
+    for id, records in index.items():
+        if id in matched_ids:
+            continue
+
+        timings.count(timings.COUNTER_ATTACHMENTS_WITHOUT_MESSAGE, len(records))
+
+        if warn_missing and id not in MISSING_MESSAGE_IDS_WARNED:
+            MISSING_MESSAGE_IDS_WARNED.add(id)
+            logging.warning(f"No message found with id {id} for attachment.")
@@ -0,0 +1,669 @@
+# -----------------------------------------------------------------------------
+#
+# Benchmarks for the slow parts of `signal_sqlite_md.py`, run against
+# synthetic data so nobody's real messages are needed.
+#
+# Usage:
+#
+#   python3 benchmark.py urls -n 200000
+#   python3 benchmark.py memory -n 1000000
+#   python3 benchmark.py ingest -n 10000 100000 1000000
+#   python3 benchmark.py markdown-links -n 50000
+#   python3 benchmark.py state-journal -n 5000
+#
+# Like `signal_sqlite_md.py`, run it from this folder with the `hal` and
+# `message_md` repos next to this one. `markdown-links` and `state-journal`
+# need the Python 3.12 or later that `signal_ui_automation.py` does.
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import csv
+import gc
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+import signal_sqlite_md
+import signal_message
+import synthetic_export
+import row_schema
+import conversations
+import attachments
+import person
+import message
+import message_md
+import config
+import markdown
+
+def time_it(function, values):
+    """
+    Time calling `function` on each of the values.
+
+    Returns:
+    - Tuple of the elapsed seconds and the list of results.
+    """
+
+    start = time.perf_counter()
+    results = [function(value) for value in values]
+    return time.perf_counter() - start, results
+
+class BenchmarkResolver:
+    """
+    Stands in for `resolver.IdentityResolver` with a made up set of people
+    and groups, so no `Config` is needed.
+    """
+
+    def __init__(self, people, groups):
+        self.me = self.new_person("me")
+        self.people = {}
+        self.people_by_service_id = {}
+        for index in range(people):
+            the_person = self.new_person(f"person-{index}")
+            self.people[f"conversation-{index}"] = the_person
+            self.people_by_service_id[f"service-{index}"] = the_person
+        self.groups = {f"group-{index}": f"group-{index}" for index in range(groups)}
+
+    @staticmethod
+    def new_person(slug):
+        the_person = person.Person()
+        the_person.slug = slug
+        return the_person
+
+    def get_person_by_service_id(self, id):
+        return self.people_by_service_id.get(id, False)
+
+    def get_person_by_conversation_id(self, id):
+        return self.people[id]
+
+    def get_group_slug_by_conversation_id(self, id):
+        return self.groups.get(id, "")
+
+def synthetic_message_rows(count, people=200, groups=20, seed=1):
+    """
+    Generate rows of the Signal `messages` table as the `csv` module would
+    read them, so every value is its own string like in a real export.
+
+    Parameters:
+    - count: Number of rows.
+    - people: Number of 1:1 conversations.
+    - groups: Number of group conversations.
+    - seed: Seed so the same rows are generated every time.
+
+    Returns:
+    - Generator yielding the header row followed by each row as a list.
+    """
+
+    rng = random.Random(seed)
+    bodies = synthetic_export.synthetic_bodies(1000, seed=seed)
+    sent_at = 1600000000000
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    yield list(signal_sqlite_md.SignalFields)
+
+    for rowid in range(1, count + 1):
+        sent_at += rng.randint(1000, 600000)
+
+        if rng.random() < 0.3:
+            conversation_id = f"group-{rng.randrange(groups)}"
+        else:
+            conversation_id = f"conversation-{rng.randrange(people)}"
+
+        type = rng.choice([signal_sqlite_md.SIGNAL_INCOMING, signal_sqlite_md.SIGNAL_OUTGOING])
+        service_id = f"service-{rng.randrange(people)}" if type == signal_sqlite_md.SIGNAL_INCOMING else ""
+
+        data = {"id": f"message-{rowid}", "sent_at": sent_at}
+        if rng.random() < 0.1:
+            data["reactions"] = [{
+                "emoji": rng.choice(synthetic_export.EMOJI),
+                "fromId": f"conversation-{rng.randrange(people)}",
+                "targetTimestamp": sent_at,
+                "timestamp": sent_at + 1000,
+            }]
+
+        writer.writerow([
+            rowid, f"message-{rowid}", json.dumps(data, ensure_ascii=False), sent_at,
+            conversation_id, "", 0, type, rng.choice(bodies), service_id,
+        ])
+
+        # read the row back so the values are new strings
+        yield next(csv.reader([buffer.getvalue()]))
+        buffer.seek(0)
+        buffer.truncate()
+
+class PlainSignalMessage(message.Message):
+    """
+    `SignalMessage` before `source_service_id` was set in `__init__`, used as
+    the "before" of the memory benchmark.
+    """
+
+    source_service_id = ""
+
+def load_synthetic_messages(count, new_message, intern_string, compact=False):
+    """
+    Parse `count` synthetic rows into Messages the way `load_messages` does.
+
+    Parameters:
+    - count: Number of rows.
+    - new_message: Function that creates an empty Message.
+    - intern_string: Used in place of `signal_message.intern_string`.
+    - compact: Keep each Message as a `signal_message.CompactMessage`.
+
+    Returns:
+    - List of the Messages.
+    """
+
+    original = signal_message.intern_string
+    signal_message.intern_string = intern_string
+
+    try:
+        rows = synthetic_message_rows(count)
+        schema = row_schema.compile_header(next(rows), signal_sqlite_md.SignalFields, "SignalRow")
+        the_resolver = BenchmarkResolver(200, 20)
+
+        messages = []
+        for row in rows:
+            the_message = new_message()
+            if not signal_sqlite_md.parse_row(schema.record(row), the_message, the_resolver):
+                continue
+            messages.append(the_message)
+
+            # every tenth message has an attachment, with a copy of the
+            # content type like a row of `message_attachments.csv` would have
+            rowid = int(row[0])
+            if rowid % 10 == 0:
+                content_type = synthetic_export.CONTENT_TYPES[rowid % len(synthetic_export.CONTENT_TYPES)]
+                the_attachment = signal_sqlite_md.attachments.SignalAttachment()
+                the_attachment.type = signal_message.intern_string(content_type[:1] + content_type[1:])
+                the_message.attachments.append(the_attachment)
+
+            if compact:
+                messages[-1] = signal_message.CompactMessage(the_message)
+    finally:
+        signal_message.intern_string = original
+
+    return messages
+
+def measure_messages(count, new_message, intern_string, compact=False):
+    """
+    Measure the memory kept by the Messages parsed from `count` rows.
+
+    Returns:
+    - Tuple of the number of Messages and the bytes allocated for them.
+    """
+
+    # the shared `to_slugs` are part of what the compact messages keep
+    signal_message.SLUG_TUPLES.clear()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    messages = load_synthetic_messages(count, new_message, intern_string, compact)
+
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    return len(messages), used
+
+def benchmark_memory(args):
+    """
+    Compare the memory used per message by the plain `Message` with a copy of
+    every string, `SignalMessage` with interned strings, and the
+    `CompactMessage` that `--markdown-workers` and `--stream` keep until the
+    messages are written.
+    """
+
+    for count in args.counts:
+        kept, before = measure_messages(count, PlainSignalMessage, lambda value: value)
+        kept, interned = measure_messages(count, signal_message.SignalMessage, signal_message.intern_string)
+        kept, compact = measure_messages(count, signal_message.SignalMessage, signal_message.intern_string, compact=True)
+
+        print(f"{count} rows, {kept} messages")
+        print(f"  copied strings:   {before / kept:8.0f} bytes/message  {before / 2**20:8.1f} MiB")
+        print(f"  interned strings: {interned / kept:8.0f} bytes/message  {interned / 2**20:8.1f} MiB")
+        print(f"  compact messages: {compact / kept:8.0f} bytes/message  {compact / 2**20:8.1f} MiB")
+
+def peak_rss():
+    """
+    Get the peak resident set size of this process so far, in MiB, or None
+    where the `resource` module isn't available.
+    """
+
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # kilobytes on Linux, bytes on macOS
+    if sys.platform == "darwin":
+        peak /= 1024
+
+    return peak / 1024
+
+def timed_stage(results, name, rows, function, *args):
+    """
+    Run one stage of the ingestion and record its time and the peak RSS.
+
+    Parameters:
+    - results: List the `(name, rows, seconds, peak_rss)` tuple is added to.
+    - name: Name of the stage.
+    - rows: Number of rows the stage reads.
+    - function: The stage.
+    - args: Passed to `function`.
+
+    Returns:
+    - What `function` returns.
+    """
+
+    start = time.perf_counter()
+    result = function(*args)
+    results.append((name, rows, time.perf_counter() - start, peak_rss()))
+
+    return result
+
+def setup_config(export, output_folder, config_template):
+    """
+    Run `message_md.setup` on a synthetic export like `signal_sqlite_md.py`
+    would.
+
+    Parameters:
+    - export: What `synthetic_export.generate_export` returned.
+    - output_folder: Where the Markdown would go.
+    - config_template: Folder with the rest of the `message_md` config files,
+      copied next to the generated `people.json` and `groups.json`.
+
+    Returns:
+    - The Config object, or None if the setup failed.
+    """
+
+    config_folder = export["config_folder"]
+
+    if config_template and os.path.isdir(config_template):
+        for name in os.listdir(config_template):
+            source = os.path.join(config_template, name)
+            if name in (synthetic_export.PEOPLE_FILENAME, synthetic_export.GROUPS_FILENAME):
+                continue
+            if os.path.isfile(source):
+                shutil.copy(source, config_folder)
+
+    os.makedirs(output_folder, exist_ok=True)
+
+    sys.argv = [
+        "signal_sqlite_md.py",
+        "-c", config_folder,
+        "-s", export["source_folder"],
+        "-f", synthetic_export.MESSAGES_FILENAME,
+        "-o", output_folder,
+        "-m", export["me"],
+    ]
+
+    the_config = config.Config()
+    if not message_md.setup(the_config, markdown.YAML_SERVICE_SIGNAL):
+        return None
+
+    the_config.signal_db = ""
+    the_config.signal_workers = 0
+    the_config.signal_watermark = None
+    the_config.reversed = False
+
+    return the_config
+
+def ingest(count, folder, config_template):
+    """
+    Generate a synthetic export of `count` messages and time reading it.
+
+    Returns:
+    - List of `(name, rows, seconds, peak_rss)` tuples, one per stage.
+    """
+
+    results = []
+
+    export_folder = os.path.join(folder, str(count))
+    export = timed_stage(results, "generate", count, synthetic_export.generate_export, export_folder, count)
+
+    the_config = setup_config(export, os.path.join(export_folder, "output"), config_template)
+    if the_config is None:
+        raise RuntimeError("message_md.setup failed, check the config in " + export["config_folder"])
+
+    timed_stage(results, "conversations", export["conversations"], conversations.parse_conversations_file, the_config)
+
+    # `load_messages` ends by joining the attachments, hold that back so it's
+    # timed as its own stage
+    held_back = []
+    parse_attachments_file = attachments.parse_attachments_file
+    attachments.parse_attachments_file = lambda *args, **kwargs: held_back.append((args, kwargs))
+
+    messages = []
+    filename = os.path.join(export["source_folder"], synthetic_export.MESSAGES_FILENAME)
+    try:
+        timed_stage(results, "messages", export["messages"], signal_sqlite_md.load_messages, filename, messages, [], the_config)
+    finally:
+        attachments.parse_attachments_file = parse_attachments_file
+
+    for args, kwargs in held_back:
+        timed_stage(results, "attachments", export["attachments"], lambda: parse_attachments_file(*args, **kwargs))
+
+    return results
+
+def print_stages(count, results):
+    """
+    Print the stages of one `ingest` run as a table.
+    """
+
+    print(f"{count} messages")
+    print(f"  {'stage':<14} {'rows':>10} {'seconds':>9} {'rows/s':>12} {'peak RSS':>12}")
+
+    for name, rows, seconds, rss in results:
+        rate = rows / seconds if seconds else 0
+        rss = f"{rss:8.1f} MiB" if rss is not None else "         n/a"
+        print(f"  {name:<14} {rows:>10} {seconds:>9.3f} {rate:>12,.0f} {rss:>12}")
+
+def benchmark_ingest(args):
+    """
+    Time `parse_conversations_file`, `load_messages` and
+    `parse_attachments_file` on synthetic exports of each size.
+
+    Notes:
+    - Each size after the first runs in its own process so its peak RSS
+      isn't hidden by a bigger one before it.
+    """
+
+    for index, count in enumerate(args.counts):
+        if index == 0:
+            print_stages(count, ingest(count, args.folder, args.config_template))
+            continue
+
+        sys.stdout.flush()
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), "ingest", "-n", str(count),
+            "--folder", args.folder, "--config-template", args.config_template,
+        ], check=True)
+
+def benchmark_urls(args):
+    """
+    Compare stripping the query strings from links with the "http" check and
+    the URL cache against running the regex and `urlsplit` on every body.
+    """
+
+    bodies = synthetic_export.synthetic_bodies(args.count, args.link_share, args.links)
+
+    uncached = signal_sqlite_md.strip_url_query_params.__wrapped__
+
+    def strip_every_body(text):
+        if not text:
+            return text
+        return signal_sqlite_md.URL_RE.sub(lambda match: uncached(match.group(0)), text)
+
+    signal_sqlite_md.strip_url_query_params.cache_clear()
+
+    before, expected = time_it(strip_every_body, bodies)
+    after, results = time_it(signal_sqlite_md.strip_shared_url_query_params, bodies)
+
+    if results != expected:
+        raise AssertionError("strip_shared_url_query_params gave a different result")
+
+    print(f"{len(bodies)} bodies, {args.link_share:.0%} with one of {args.links} links")
+    print(f"  regex on every body: {before:8.3f}s  {len(bodies) / before:12,.0f} bodies/s")
+    print(f"  precheck + cache:    {after:8.3f}s  {len(bodies) / after:12,.0f} bodies/s")
+    print(f"  {signal_sqlite_md.strip_url_query_params.cache_info()}")
+
+def synthetic_vault(folder, count, slugs, link_share, seed=1):
+    """
+    Write a synthetic Markdown output folder for `markdown-links`.
+
+    Parameters:
+    - folder: Output folder, replaced if it exists.
+    - count: Number of Markdown files, spread over the slugs and one folder
+      per month.
+    - slugs: Number of people and groups, a quarter of them groups.
+    - link_share: Fraction of the files with `![[untitled_N.jpg]]` links.
+
+    Returns:
+    - List of the `MediaRecord` dictionaries for the linked media, like the
+      `downloads` of `signal_ui_state.json`.
+    """
+
+    random.seed(seed)
+    shutil.rmtree(folder, ignore_errors=True)
+
+    roots = []
+    for index in range(slugs):
+        if index % 4 == 3:
+            roots.append((f"group-{index}", os.path.join(folder, "People", "groups", f"group-{index}")))
+        else:
+            roots.append((f"person-{index}", os.path.join(folder, "People", f"person-{index}")))
+
+    downloads = []
+    media_counts = {slug: 0 for slug, _ in roots}
+
+    for index in range(count):
+        slug, root = roots[index % slugs]
+        month_folder = os.path.join(root, f"2024-{index % 12 + 1:02}")
+        os.makedirs(month_folder, exist_ok=True)
+
+        lines = [f"# {slug} {index}", "", "Some text without any links."]
+        if random.random() < link_share:
+            media_counts[slug] += 1
+            number = media_counts[slug]
+            lines.append(f"![[untitled_{number}.jpg]]")
+            downloads.append({
+                "slug": slug,
+                "label": slug,
+                "media_kind": "image",
+                "source_label": f"untitled_{number}.jpg",
+                "saved_filename": f"{slug}-{number}.jpg",
+                "saved_path": os.path.join(root, "media", f"{slug}-{number}.jpg"),
+                "markdown_target": f"media/{slug}-{number}.jpg",
+            })
+
+        with open(os.path.join(month_folder, f"{slug}-{index}.md"), "w", encoding="utf-8") as markdown_file:
+            markdown_file.write("\n".join(lines) + "\n")
+
+    return downloads
+
+def vault_contents(folder):
+    """
+    Get the text of every Markdown file under `folder`, by relative path.
+    """
+
+    contents = {}
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            with open(path, encoding="utf-8") as markdown_file:
+                contents[os.path.relpath(path, folder)] = markdown_file.read()
+
+    return contents
+
+def benchmark_markdown_links(args):
+    """
+    Compare rewriting the media links of a synthetic output folder slug by
+    slug, as `--manifest-only` used to, against `update_manifest_markdown`.
+
+    Notes:
+    - The folder is generated again before each run so they all start from
+      the same files, and the results are compared.
+    - The "again" times run the same manifest a second time, when every link
+      is already rewritten: without the link index each file is read again,
+      with it only the changed files are.
+    """
+
+    from pathlib import Path
+
+    import signal_ui_automation
+
+    def per_slug(output_root, records):
+        grouped = {}
+        for record in records:
+            grouped.setdefault(record.slug, []).append(record)
+
+        for slug, slug_records in grouped.items():
+            slug_root = signal_ui_automation.markdown_slug_root(output_root, slug)
+            if slug_root is None:
+                continue
+            for markdown_file in sorted(slug_root.rglob("*.md")):
+                original = markdown_file.read_text(encoding="utf-8")
+                updated = signal_ui_automation.replace_media_links(original, slug_records)
+                if updated != original:
+                    markdown_file.write_text(updated, encoding="utf-8")
+
+    def run(function):
+        downloads = synthetic_vault(args.folder, args.count, args.slugs, args.link_share)
+        records = [signal_ui_automation.MediaRecord(**record) for record in downloads]
+        start = time.perf_counter()
+        function(Path(args.folder), records)
+        return time.perf_counter() - start, len(records), vault_contents(args.folder)
+
+    def twice(link_index):
+        def update(output_root, records):
+            signal_ui_automation.update_manifest_markdown(output_root, records, args.workers, link_index)
+            start = time.perf_counter()
+            signal_ui_automation.update_manifest_markdown(output_root, records, args.workers, link_index)
+            timings.append(time.perf_counter() - start)
+        return update
+
+    timings = []
+    before, linked, expected = run(per_slug)
+    after, _, results = run(twice(None))
+    if results != expected:
+        raise AssertionError("update_manifest_markdown gave a different result")
+
+    index_path = os.path.join(os.path.dirname(os.path.abspath(args.folder)), "benchmark_link_index.json")
+    link_index = signal_ui_automation.LinkIndex(Path(index_path), Path(args.folder))
+    indexed, _, results = run(twice(link_index))
+    if results != expected:
+        raise AssertionError("update_manifest_markdown with a link index gave a different result")
+
+    after -= timings[0]
+    indexed -= timings[1]
+
+    print(f"{args.count} Markdown files, {args.slugs} slugs, {linked} media links")
+    print(f"  per slug:                 {before:8.3f}s  {args.count / before:12,.0f} files/s")
+    print(f"  single pass:              {after:8.3f}s  {args.count / after:12,.0f} files/s")
+    print(f"  single pass, again:       {timings[0]:8.3f}s  {args.count / timings[0]:12,.0f} files/s")
+    print(f"  building the link index:  {indexed:8.3f}s  {args.count / indexed:12,.0f} files/s")
+    print(f"  with the index, again:    {timings[1]:8.3f}s  {args.count / timings[1]:12,.0f} files/s")
+
+def benchmark_state_journal(args):
+    """
+    Time saving the resume state of `signal_ui_automation.py` after every
+    download, and check that no download is lost when a run stops in the
+    middle of compacting the journal.
+
+    Notes:
+    - The interrupted compaction is simulated by putting back the journal of
+      the previous snapshot after `compact`, as if the run had stopped
+      between replacing the snapshot and emptying the journal. The downloads
+      saved after resuming have to survive the next load.
+    """
+
+    import tempfile
+    from pathlib import Path
+
+    import signal_ui_automation
+
+    def record(index):
+        return signal_ui_automation.MediaRecord(
+            slug=f"person-{index % 50}", label=f"Person {index % 50}", media_kind="image",
+            source_label=f"untitled_{index}.jpg", saved_filename=f"{index}.jpg",
+            saved_path=f"media/{index}.jpg", markdown_target=f"media/{index}.jpg")
+
+    def load(path):
+        state = signal_ui_automation.AutomationState(path)
+        state.load()
+        return state
+
+    def expect(state, count, what):
+        saved = len(state.data["downloads"])
+        if saved != count:
+            raise AssertionError(f"{what}: {saved} downloads loaded, {count} were saved")
+
+    with tempfile.TemporaryDirectory(prefix="benchmark_state_") as folder:
+        path = Path(folder) / "signal_ui_state.json"
+
+        state = load(path)
+        start = time.perf_counter()
+        for index in range(args.count):
+            state.add_download(record(index))
+            state.save()
+        elapsed = time.perf_counter() - start
+        expect(load(path), args.count, "after saving")
+
+        print(f"{args.count} downloads saved one at a time")
+        print(f"  journal:  {elapsed:8.3f}s  {elapsed / args.count * 1000:8.3f} ms/download")
+
+        # stop a run right after it replaced the snapshot
+        state = load(path)
+        stale = state.journal_path.read_bytes()
+        state.compact()
+        state.journal_path.write_bytes(stale)
+
+        state = load(path)
+        for index in range(args.count, args.count + 3):
+            state.add_download(record(index))
+            state.save()
+        expect(load(path), args.count + 3, "after an interrupted compaction")
+
+        # and in the middle of an append
+        with state.journal_path.open("a", encoding="utf-8") as journal:
+            journal.write('{"op": "download", "rec')
+
+        state = load(path)
+        state.add_download(record(args.count + 3))
+        state.save()
+        expect(load(path), args.count + 4, "after a partial line")
+
+    print("  resuming after an interrupted compaction or append: no downloads lost")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for signal_sqlite_md")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    urls = commands.add_parser("urls", help="Stripping query strings from links in message bodies")
+    urls.add_argument("-n", "--count", type=int, default=200000, help="Number of message bodies")
+    urls.add_argument("--link-share", type=float, default=0.3, help="Fraction of bodies with a link")
+    urls.add_argument("--links", type=int, default=500, help="Number of distinct links")
+    urls.set_defaults(run=benchmark_urls)
+
+    memory = commands.add_parser("memory", help="Memory used by the parsed messages")
+    memory.add_argument("-n", "--counts", type=int, nargs="+", default=[100000], help="Numbers of rows, e.g. 100000 1000000")
+    memory.set_defaults(run=benchmark_memory)
+
+    ingestion = commands.add_parser("ingest", help="Reading a synthetic export, stage by stage")
+    ingestion.add_argument("-n", "--counts", type=int, nargs="+", default=[10000], help="Numbers of messages, e.g. 10000 100000 1000000")
+    ingestion.add_argument("--folder", default="../synthetic", help="Where to generate the exports")
+    ingestion.add_argument("--config-template", default="../message_md/config", help="Folder with the rest of the message_md config files")
+    ingestion.set_defaults(run=benchmark_ingest)
+
+    links = commands.add_parser("markdown-links", help="Rewriting media links in --manifest-only mode")
+    links.add_argument("-n", "--count", type=int, default=50000, help="Number of Markdown files")
+    links.add_argument("--slugs", type=int, default=200, help="Number of people and groups")
+    links.add_argument("--link-share", type=float, default=0.1, help="Fraction of files with a media link")
+    links.add_argument("--workers", type=int, default=None, help="Threads rewriting the files")
+    links.add_argument("--folder", default="../synthetic-vault", help="Where to generate the Markdown files")
+    links.set_defaults(run=benchmark_markdown_links)
+
+    journal = commands.add_parser("state-journal", help="Saving the signal_ui_automation.py resume state after every download")
+    journal.add_argument("-n", "--count", type=int, default=5000, help="Number of downloads")
+    journal.set_defaults(run=benchmark_state_journal)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
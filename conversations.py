@@ -12,11 +12,14 @@
 
 import os
 import csv
-import json
 import re
 import logging
 
 import sys
+import signal_db
+import signal_json
+import row_schema
+import timings
 sys.path.insert(1, '../hal/')
 import person
 import identity
@@ -53,48 +56,6 @@ ConversationsFields = [
     CONVERSATION_PROFILE_LAST_FETCHED_AT 
 ]
 
-# -----------------------------------------------------------------------------
-#
-# Parse the header row of the `conversations.csv` file and map it to the fields
-#
-# Parameters:
-#
-#   - row - the header row
-#   - field_map - where the result goes
-#
-# -----------------------------------------------------------------------------
-def parse_conversations_header(row, field_map):
-
-    global ConversationsFields
-
-    count = 0
-    for col in row:
-        for field in ConversationsFields:
-            if col == field:
-                field_map.append( [field, count] )
-        count += 1
-
-def field_index(field_label, field_map):
-    """
-    Find the index of a specific field in the `field_map` based on its label.
-
-    Parameters:
-    - field_label: Label of the field to find e.g., ATTACHMENT_CONTENT_TYPE
-    - field_map: List mapping field names to their indices in the CSV row.
-
-    Returns:
-    - The index of the field if found, otherwise -1.
-    """
-
-    result = -1
-
-    for field in field_map:
-        if field[0] == field_label:
-            result = field[1]
-            break
-
-    return result
-
 def get_slug(full_name):
     """
     Convert a full name string to a slug suitable for use in URLs or filenames.
@@ -161,15 +122,14 @@ def get_first_name(name):
     # join them back together e.g. "Marc-Andre"
     return '-'.join(capitalized_parts)
 
-def store_conversation_info(the_config, field_map, row):
+def store_conversation_info(the_config, record):
     """
     Grab the conversation info from the row and store it in the corresponding
     Person object so it can be used later.
     
     Parameters:
     - the_config: Configuration object with source folder and other settings.       
-    - field_map: List mapping field names to their indices in the CSV row.
-    - row: List representing a row from the `conversations.csv` file.
+    - record: Record representing a row from the `conversations.csv` file.
 
     Returns:
     - None
@@ -185,15 +145,15 @@ def store_conversation_info(the_config, field_map, row):
       profileName is found, ignore it
     """
 
-    e164 = row[field_index(CONVERSATION_E164, field_map)]
+    e164 = record.e164
     phone = e164[-10:]
     slug = ""
     
-    id = row[field_index(CONVERSATION_ID, field_map)]
+    id = record.id
 
     # grab the name fields
-    profile_name = row[field_index(CONVERSATION_PROFILE_NAME, field_map)]
-    full_name = row[field_index(CONVERSATION_PROFILE_FULL_NAME, field_map)]
+    profile_name = record.profileName
+    full_name = record.profileFullName
 
     # first, see if we can find the person using their phone number
     try:
@@ -234,10 +194,10 @@ def store_conversation_info(the_config, field_map, row):
     # get the `ServiceId` value which me thinks is the unique ID for person.
     # this is needed to figure out who replied to group messages as those 
     # don't include a phone number of the sender
-    data = row[field_index(CONVERSATION_JSON, field_map)]
+    data = record.json
 
     try:
-        json_data = json.loads(data)
+        json_data = signal_json.loads(data)
     except Exception as e:
         logging.error(f"store_conversation_info {id}: {e}")
 
@@ -252,6 +212,30 @@ def store_conversation_info(the_config, field_map, row):
     else:
         group_slug = the_config.get_group_slug_by_conversation_id(id)
         
+def read_conversations(the_config):
+    """
+    Read the rows of the Signal `conversations` table, either from the
+    `conversations.csv` export or from the decrypted SQLite database.
+
+    Parameters:
+    - the_config: Configuration object, `signal_db` is the path to the
+      database or empty to use the CSV file in the source folder.
+
+    Returns:
+    - Generator yielding the header row followed by each row as a list.
+    """
+
+    db_path = getattr(the_config, "signal_db", "")
+
+    if db_path:
+        yield from signal_db.read_table(
+            db_path, signal_db.CONVERSATIONS_TABLE, ConversationsFields)
+    else:
+        filename = os.path.join(the_config.source_folder, CONVERSATIONS_FILENAME)
+
+        with open(filename, newline='') as conversations_file:
+            yield from csv.reader(conversations_file)
+
 def parse_conversations_file(the_config):
     """
     Parse the Signal SQLite 'conversations.csv' file to get each person's
@@ -269,27 +253,24 @@ def parse_conversations_file(the_config):
       will occur 😂
     """
 
-    field_map = []
+    schema = None
 
-    global SignalFields
+    global ConversationsFields
   
-    try:
-        filename = os.path.join(the_config.source_folder, CONVERSATIONS_FILENAME)
-        
-        with open(filename, newline='') as conversations_file:
-
-            conversations_reader = csv.reader(conversations_file)
+    with timings.stage("conversations") as stage:
+        try:
             count = 0
-            for row in conversations_reader:
+            for row in read_conversations(the_config):
                 if count == 0:
-                    parse_conversations_header(row, field_map)
+                    schema = row_schema.compile_header(row, ConversationsFields, "ConversationRow")
                 else:
+                    stage.rows += 1
                     try:
-                        store_conversation_info(the_config, field_map, row)
+                        store_conversation_info(the_config, schema.record(row))
                     except Exception as e:
                         logging.error(f"parse_conversations_file failed: {e}")
                 count += 1
 
-    except Exception as e:
-        logging.error(f"parse_conversations_file failed: {e}")
-        return
+        except Exception as e:
+            logging.error(f"parse_conversations_file failed: {e}")
+            return
@@ -0,0 +1,173 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to reading a big CSV export on more than one core.
+#
+# The file is memory-mapped and split into byte ranges of about `CHUNK_SIZE`
+# that each start on a record boundary, then every range is parsed with the
+# `csv` module in a worker process. The ranges are handed back in file order,
+# so the rows come out exactly as `csv.reader` would give them, i.e. in
+# `rowid` order for a DB Browser export.
+#
+# A newline is only a record boundary if it's outside a quoted field. Quotes
+# inside a quoted field are doubled (`""`), so a newline is outside of quotes
+# when the number of `"` bytes before it, since the last boundary, is even.
+# Counting bytes is done in C, so finding the boundaries is fast even though
+# it reads the whole file.
+#
+# -----------------------------------------------------------------------------
+
+import collections
+import concurrent.futures
+import csv
+import io
+import locale
+import mmap
+import os
+
+# bytes per range given to a worker
+CHUNK_SIZE = 16 * 1024 * 1024
+
+QUOTE = b'"'
+NEWLINE = b'\n'
+
+def default_encoding():
+    """
+    Get the encoding `open` uses when none is given, so the rows are the
+    same as reading the file in text mode.
+    """
+
+    return locale.getpreferredencoding(False)
+
+def next_boundary(data, position, parity=0):
+    """
+    Find the start of the first record after `position`.
+
+    Parameters:
+    - data: The memory-mapped file.
+    - position: Where to start looking.
+    - parity: Number of quotes, modulo 2, between the last record boundary
+      and `position`. 1 means `position` is inside a quoted field.
+
+    Returns:
+    - Offset just after the first newline outside of quotes, or the size of
+      the file if there isn't one.
+    """
+
+    while True:
+        newline = data.find(NEWLINE, position)
+        if newline == -1:
+            return len(data)
+
+        parity = (parity + data[position:newline].count(QUOTE)) % 2
+        if parity == 0:
+            return newline + 1
+
+        position = newline + 1
+
+def split_points(data, start, chunk_size=CHUNK_SIZE):
+    """
+    Split the file after `start` into ranges of about `chunk_size` bytes that
+    each start and end on a record boundary.
+
+    Parameters:
+    - data: The memory-mapped file.
+    - start: A record boundary, e.g. the end of the header.
+    - chunk_size: Bytes per range, the ranges are a bit longer.
+
+    Returns:
+    - List of offsets, the ranges are between each pair of them.
+    """
+
+    points = [start]
+    size = len(data)
+
+    while points[-1] < size:
+        target = points[-1] + chunk_size
+        if target >= size:
+            points.append(size)
+            break
+
+        # the number of quotes since the last boundary decides if `target`
+        # is inside a quoted field
+        parity = data[points[-1]:target].count(QUOTE) % 2
+        points.append(next_boundary(data, target, parity))
+
+    return points
+
+def parse_rows(data, encoding):
+    """
+    Parse the bytes of whole records into rows.
+
+    Parameters:
+    - data: The bytes of one or more complete records.
+    - encoding: The file's text encoding.
+
+    Returns:
+    - List of rows, each a list of strings.
+    """
+
+    return list(csv.reader(io.StringIO(data.decode(encoding), newline='')))
+
+def parse_range(path, start, end, encoding):
+    """
+    Parse the records between two boundaries of a file, run in a worker.
+
+    Parameters:
+    - path: The CSV file.
+    - start: Offset of the first record.
+    - end: Offset just after the last record.
+    - encoding: The file's text encoding.
+
+    Returns:
+    - List of rows, each a list of strings.
+    """
+
+    with open(path, "rb") as csv_file:
+        with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return parse_rows(data[start:end], encoding)
+
+def read_rows(path, workers, encoding=None, chunk_size=None):
+    """
+    Read a CSV file using a pool of worker processes.
+
+    Parameters:
+    - path: The CSV file.
+    - workers: Number of worker processes.
+    - encoding: The file's text encoding, the same as `open` by default.
+    - chunk_size: Bytes per range given to a worker, `CHUNK_SIZE` by default.
+
+    Returns:
+    - Generator yielding the header row followed by each row as a list, the
+      same rows `csv.reader` gives for the file opened with `newline=''`.
+
+    Notes:
+    - Only a few ranges per worker are in flight at once, so the whole file
+      is never held in memory.
+    - Like any CSV written by DB Browser or the `csv` module, a field with a
+      `"` in it must be quoted, otherwise the boundaries can be wrong.
+    """
+
+    encoding = encoding or default_encoding()
+    chunk_size = chunk_size or CHUNK_SIZE
+
+    if os.path.getsize(path) == 0:
+        return
+
+    with open(path, "rb") as csv_file:
+        with mmap.mmap(csv_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = next_boundary(data, 0)
+            yield from parse_rows(data[:header_end], encoding)
+
+            points = split_points(data, header_end, chunk_size)
+
+    pending = collections.deque()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        for start, end in zip(points, points[1:]):
+            pending.append(executor.submit(parse_range, path, start, end, encoding))
+
+            while len(pending) > workers * 2:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
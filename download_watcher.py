@@ -0,0 +1,340 @@
+"""Watch a download folder for new files without rescanning it.
+
+Saving a media item used to snapshot the whole folder before the Save dialog,
+poll it with iterdir() plus a stat per entry until a new name showed up, and
+then probe candidate names with exists() to pick an unused one. With thousands
+of files in a media folder every save paid for all of them.
+
+DownloadWatcher lists the folder once and keeps the names in memory. On Linux
+inotify reports each created, renamed and deleted file; elsewhere a scandir
+poller diffs the names, which only reads the directory, not a stat per file.
+Waiting for a file and choosing a unique name are then dictionary lookups.
+
+Run this file on Linux to exercise the watcher with a fake writer process:
+
+    python3 download_watcher.py --files 200 --existing 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = getattr(os, "O_CLOEXEC", 0o2000000)
+
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+# Names a download goes by while it is still being written.
+# .link-tmp is MediaStore's hardlink swap in the same folder.
+PARTIAL_SUFFIXES = (".crdownload", ".part", ".partial", ".download", ".tmp", ".link-tmp")
+
+
+def _load_inotify() -> Any | None:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_LIBC = _load_inotify()
+
+
+class DownloadWatcher:
+    """In-memory index of the file names in one folder, kept current in the background.
+
+    mark() is taken before a download starts and wait_for_new_file(mark)
+    returns the newest file created since, like diffing two snapshots did.
+    unique_path() picks an unused name from the index, and add()/remove()
+    record the renames this process does itself so the index is right
+    before the event arrives.
+    """
+
+    def __init__(self, folder: Path, poll_interval: float = 0.25, use_inotify: bool = True):
+        self.folder = Path(folder)
+        self.poll_interval = poll_interval
+        self.backend = "inotify" if (use_inotify and _LIBC is not None) else "poll"
+        self.names: dict[str, str] = {}
+        self.created: list[str] = []
+        self.next_index: dict[tuple[str, str], int] = {}
+        self.condition = threading.Condition()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+        self.fd = -1
+
+    def __enter__(self) -> DownloadWatcher:
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    @staticmethod
+    def is_partial(name: str) -> bool:
+        return name.startswith(".") or name.lower().endswith(PARTIAL_SUFFIXES)
+
+    @staticmethod
+    def _key(name: str) -> str:
+        # Windows and macOS folders are case-insensitive: "a.jpg" and "A.JPG" clash.
+        return os.path.normcase(name).lower() if os.name == "nt" or sys.platform == "darwin" else name
+
+    def start(self) -> None:
+        self.folder.mkdir(parents=True, exist_ok=True)
+        if self.backend == "inotify":
+            try:
+                self._start_inotify()
+            except OSError as exc:
+                logging.info("inotify unavailable for %s (%s); polling instead", self.folder, exc)
+                self.backend = "poll"
+        # List after the watch is in place so no file falls between the two.
+        with self.condition:
+            self.names = {self._key(name): name for name in self._list()}
+        target = self._read_events if self.backend == "inotify" else self._poll
+        self.thread = threading.Thread(target=target, name=f"watch {self.folder.name}", daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def _list(self) -> list[str]:
+        try:
+            with os.scandir(self.folder) as entries:
+                # is_file() comes from the directory entry type; no stat per file.
+                return [entry.name for entry in entries if entry.is_file()]
+        except FileNotFoundError:
+            return []
+
+    def _start_inotify(self) -> None:
+        fd = _LIBC.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+        if _LIBC.inotify_add_watch(fd, os.fsencode(self.folder), WATCH_MASK) < 0:
+            code = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(code, os.strerror(code))
+        self.fd = fd
+
+    def _read_events(self) -> None:
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while not self.stopped.is_set():
+            if not poller.poll(int(self.poll_interval * 1000)):
+                continue
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError as exc:
+                if exc.errno == errno.EAGAIN:
+                    continue
+                raise
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    self._resync()
+                elif mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED):
+                    # The folder itself went away; nothing more will be reported.
+                    with self.condition:
+                        self.names.clear()
+                elif mask & IN_ISDIR:
+                    continue
+                elif mask & (IN_CREATE | IN_MOVED_TO):
+                    self._created(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._removed(name)
+
+    def _poll(self) -> None:
+        while not self.stopped.wait(self.poll_interval):
+            self._resync()
+
+    def _resync(self) -> None:
+        # List under the lock: an add() or remove() made while listing would
+        # otherwise be overwritten by a listing taken before it.
+        with self.condition:
+            listed = {self._key(name): name for name in self._list()}
+            new = [name for key, name in listed.items() if key not in self.names and not self.is_partial(name)]
+            self.names = listed
+            if new:
+                self.created.extend(new)
+                self.condition.notify_all()
+
+    def _created(self, name: str) -> None:
+        with self.condition:
+            key = self._key(name)
+            # A name already indexed is a replace, or a rename this process
+            # reported through add() before the event arrived; like a snapshot
+            # diff, only names that are new to the folder count.
+            if key in self.names:
+                return
+            self.names[key] = name
+            if not self.is_partial(name):
+                self.created.append(name)
+                self.condition.notify_all()
+
+    def _removed(self, name: str) -> None:
+        with self.condition:
+            self.names.pop(self._key(name), None)
+
+    def add(self, path: Path) -> None:
+        """Record a file this process created or renamed into the folder."""
+        with self.condition:
+            self.names[self._key(path.name)] = path.name
+
+    def remove(self, path: Path) -> None:
+        """Record a file this process deleted or renamed away."""
+        self._removed(path.name)
+
+    def exists(self, name: str) -> bool:
+        with self.condition:
+            return self._key(name) in self.names
+
+    def mark(self) -> int:
+        with self.condition:
+            return len(self.created)
+
+    def wait_for_new_file(self, mark: int, timeout: float) -> Path:
+        """Return the newest file created since mark that is still there.
+
+        Partial downloads (dot files, .crdownload, .part, ...) are skipped;
+        the file counts once it has its final name.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while True:
+                for name in reversed(self.created[mark:]):
+                    if self._key(name) in self.names:
+                        return self.folder / name
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"No new file appeared in {self.folder} within {timeout} seconds")
+                self.condition.wait(remaining)
+
+    def unique_path(self, path: Path) -> Path:
+        """Like signal_ui_automation.unique_path, answered from the index."""
+        with self.condition:
+            if self._key(path.name) not in self.names:
+                return path
+            # Continue after the last suffix handed out for this name instead
+            # of probing _002, _003, ... from the start every time.
+            series = (self._key(path.stem), self._key(path.suffix))
+            for index in range(self.next_index.get(series, 2), 10000):
+                candidate = path.with_name(f"{path.stem}_{index:03d}{path.suffix}")
+                if self._key(candidate.name) not in self.names:
+                    self.next_index[series] = index + 1
+                    return candidate
+        raise FileExistsError(f"Could not find an unused filename for {path}")
+
+
+# --- Fake writer check --------------------------------------------------------
+# A separate process plays the part of Signal's Save dialog: it waits for a
+# line on stdin, writes a file under a random name and moves it into the
+# folder, the way a browser renames its partial download.
+
+FAKE_WRITER = r"""
+import os, sys, uuid
+folder = sys.argv[1]
+for line in sys.stdin:
+    name = uuid.uuid4().hex + ".jpg"
+    tmp = os.path.join(folder, "." + name + ".part")
+    with open(tmp, "wb") as fh:
+        fh.write(os.urandom(int(line)))
+    os.replace(tmp, os.path.join(folder, name))
+    sys.stdout.write(name + "\n")
+    sys.stdout.flush()
+"""
+
+
+def check_with_fake_writer(folder: Path, files: int, existing: int, use_inotify: bool) -> float:
+    for index in range(existing):
+        (folder / f"old_{index:05d}.jpg").write_bytes(b"")
+    (folder / "untitled_001.jpg").write_bytes(b"")
+
+    writer = subprocess.Popen(
+        [sys.executable, "-c", FAKE_WRITER, str(folder)],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+    )
+    start = time.perf_counter()
+    with DownloadWatcher(folder, poll_interval=0.05, use_inotify=use_inotify) as watcher:
+        for index in range(files):
+            mark = watcher.mark()
+            writer.stdin.write(f"{1024 + index}\n")
+            writer.stdin.flush()
+            written = writer.stdout.readline().strip()
+            created = watcher.wait_for_new_file(mark, timeout=10)
+            if created.name != written:
+                raise AssertionError(f"expected {written}, saw {created.name}")
+            target = watcher.unique_path(folder / "untitled_001.jpg")
+            created.rename(target)
+            watcher.remove(created)
+            watcher.add(target)
+        backend = watcher.backend
+    elapsed = time.perf_counter() - start
+    writer.stdin.close()
+    writer.wait()
+
+    expected = {f"untitled_001_{index:03d}.jpg" for index in range(2, files + 2)} | {"untitled_001.jpg"}
+    saved = {name for name in os.listdir(folder) if name.startswith("untitled_")}
+    if saved != expected:
+        raise AssertionError(f"unexpected names: {sorted(saved ^ expected)[:5]}")
+    print(f"{backend:>7}: {files} files in a folder of {existing}: {elapsed:.3f}s, {elapsed / files * 1000:.2f} ms per file")
+    return elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Check DownloadWatcher against a fake writer process")
+    parser.add_argument("--files", type=int, default=200, help="Number of files the writer saves")
+    parser.add_argument("--existing", type=int, default=5000, help="Files already in the folder")
+    args = parser.parse_args()
+
+    backends = [True, False] if _LIBC is not None else [False]
+    for use_inotify in backends:
+        folder = Path(tempfile.mkdtemp(prefix="download_watcher_"))
+        try:
+            check_with_fake_writer(folder, args.files, args.existing, use_inotify)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,186 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to linking quotes and reactions to the messages they refer to.
+#
+# A reply's `quote` holds the `sent_at` of the original message and the
+# service ID of its author, and a reaction holds the `sent_at` of the message
+# it reacts to. `MessageIndex` keeps the parsed messages by `sent_at` so each
+# of them is found with a dictionary lookup rather than a scan of every
+# message. Two messages sent in the same millisecond are told apart by their
+# author.
+#
+# -----------------------------------------------------------------------------
+
+import timings
+
+class MessageIndex:
+    """
+    The messages by the `sent_at` they were sent at, in milliseconds.
+
+    Attributes:
+    - by_sent_at: Dictionary of the message sent at each `sent_at`, or a list
+      of them in the rare case more than one was.
+    """
+
+    def __init__(self, messages=()):
+        self.by_sent_at = {}
+
+        for the_message in messages:
+            self.add(the_message)
+
+    def add(self, the_message):
+        """
+        Add a message, its `sent_at` must be set.
+        """
+
+        sent_at = the_message.sent_at
+        found = self.by_sent_at.get(sent_at)
+
+        if found is None:
+            self.by_sent_at[sent_at] = the_message
+        elif isinstance(found, list):
+            found.append(the_message)
+        else:
+            self.by_sent_at[sent_at] = [found, the_message]
+
+    def find(self, sent_at, author_slug=""):
+        """
+        Find the message sent at `sent_at`.
+
+        Parameters:
+        - sent_at: Milliseconds since the epoch, e.g. a quote's `id`.
+        - author_slug: Slug of the person who sent it, empty if unknown.
+
+        Returns:
+        - The message, or None if there's no such message or, without an
+          author, more than one.
+        """
+
+        found = self.by_sent_at.get(sent_at)
+        if found is None:
+            return None
+
+        if not isinstance(found, list):
+            found = [found]
+
+        if author_slug:
+            for the_message in found:
+                if the_message.from_slug == author_slug:
+                    return the_message
+            return None
+
+        return found[0] if len(found) == 1 else None
+
+def to_sent_at(value):
+    """
+    Convert a quote `id` or reaction `targetTimestamp` to an int, None if it
+    isn't a number.
+    """
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def link_quote(the_message, the_resolver, index):
+    """
+    Link a reply to the message it quotes, see `link_messages`.
+
+    Returns:
+    - True if the quoted message was found.
+    """
+
+    quote_sent_at = to_sent_at(the_message.quote.id) if the_message.quote.id else None
+    if quote_sent_at is None:
+        return False
+
+    author_slug = ""
+    if the_message.quote_author_id:
+        author = the_resolver.get_person_by_service_id(the_message.quote_author_id)
+        if author:
+            author_slug = author.slug
+
+    original = index.find(quote_sent_at, author_slug)
+    if original is None:
+        return False
+
+    the_message.quoted_message = original
+    if not the_message.quote.text:
+        the_message.quote.text = original.body
+
+    return True
+
+def unlinked_quotes(messages):
+    """
+    Find the replies whose quote has no text and whose original wasn't found,
+    e.g. because it wasn't loaded by this run.
+
+    Returns:
+    - List of the replies.
+    """
+
+    return [
+        the_message for the_message in messages
+        if the_message.quote.id and the_message.quoted_message is None
+        and not the_message.quote.text and to_sent_at(the_message.quote.id) is not None
+    ]
+
+def link_quotes(messages, the_resolver, index):
+    """
+    Link the quotes of `messages` to the messages in `index`, leaving their
+    reactions alone.
+
+    Returns:
+    - The number of quotes that were linked.
+    """
+
+    with timings.stage("link_quotes") as stage:
+        stage.rows += len(messages)
+        return sum(1 for the_message in messages if link_quote(the_message, the_resolver, index))
+
+def link_messages(messages, the_resolver, index=None):
+    """
+    Link every quote and reaction to the message it refers to.
+
+    Parameters:
+    - messages: The parsed SignalMessage objects.
+    - the_resolver: IdentityResolver used to find the author of a quote.
+    - index: MessageIndex to look the messages up in, built from `messages`
+      if not given.
+
+    Returns:
+    - Tuple of the number of quotes and reactions that were linked.
+
+    Notes:
+    - A reply's `quoted_message` is set to the original message and, if the
+      quote has no text of its own, e.g. it's been trimmed from the export,
+      the original's body is used.
+    - A reaction's `target_message` is set to the message it reacts to,
+      usually the message it's stored with.
+    """
+
+    quotes = 0
+    reactions = 0
+
+    with timings.stage("link_messages") as stage:
+        if index is None:
+            index = MessageIndex(messages)
+
+        for the_message in messages:
+            stage.rows += 1
+
+            if link_quote(the_message, the_resolver, index):
+                quotes += 1
+
+            for reaction in the_message.reactions:
+                target_sent_at = to_sent_at(reaction.target_time_sent)
+                if target_sent_at == the_message.sent_at:
+                    target = the_message
+                else:
+                    target = index.find(target_sent_at)
+
+                if target is not None:
+                    reaction.target_message = target
+                    reactions += 1
+
+    return quotes, reactions
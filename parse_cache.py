@@ -0,0 +1,418 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to the `--cache` option of `signal_sqlite_md.py`.
+#
+# Reading the CSV exports (or the database) and decoding the `json` column of
+# every message is most of the work of a run, yet it only depends on the
+# source files. With `--cache` the result is kept in a local SQLite database
+# in the source folder: the message rows with their decoded reactions and
+# quote, and the attachment rows, with indexes on the message and
+# conversation IDs.
+#
+# The cache remembers the size, modification time and SHA-256 hash of the
+# files it was built from. When they haven't changed, later runs query the
+# cache instead of parsing, so changing `people.json`, the output folder or
+# `-b` doesn't re-read the exports. Nothing in the cache depends on the config:
+# people and groups are still looked up when the rows are turned into
+# Messages, so edits to the config take effect.
+#
+# -----------------------------------------------------------------------------
+
+import hashlib
+import logging
+import os
+import sqlite3
+
+import signal_db
+
+CACHE_FILENAME = "signal_sqlite_md_cache.sqlite"
+
+# bump when the tables change so an older cache is rebuilt
+CACHE_VERSION = 1
+
+SOURCE_MESSAGES = "messages"
+SOURCE_ATTACHMENTS = "attachments"
+
+# the `SignalFields` of `signal_sqlite_md`, without `json` which is kept
+# decoded, in the order they're returned
+MESSAGE_COLUMNS = [
+    "rowid", "id", "sent_at", "conversationId", "source",
+    "hasAttachments", "type", "body", "sourceServiceId",
+]
+
+# the `AttachmentsFields` of `attachments`, with the first non-empty file
+# name column kept as `fileName`
+ATTACHMENT_COLUMNS = [
+    "messageId", "conversationId", "contentType", "sentAt",
+    "orderInMessage", "height", "width", "size", "fileName",
+]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+INSERT_BATCH_SIZE = 2000
+
+# columns without a type keep the values decoded from the JSON as they were,
+# e.g. a timestamp stays an int and a missing quote text stays NULL
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    path TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha256 TEXT
+);
+CREATE TABLE IF NOT EXISTS messages (
+    position INTEGER PRIMARY KEY,
+    "rowid" INTEGER,
+    id TEXT,
+    sent_at INTEGER,
+    conversationId TEXT,
+    source TEXT,
+    hasAttachments TEXT,
+    type TEXT,
+    body TEXT,
+    sourceServiceId TEXT,
+    json_error INTEGER,
+    json_service_id TEXT,
+    reaction_count INTEGER,
+    has_quote INTEGER,
+    quote_id,
+    quote_text,
+    quote_author TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_id ON messages (id);
+CREATE INDEX IF NOT EXISTS messages_conversation ON messages (conversationId, sent_at);
+CREATE INDEX IF NOT EXISTS messages_sent_at ON messages (sent_at);
+CREATE TABLE IF NOT EXISTS reactions (
+    position INTEGER,
+    message_id TEXT,
+    emoji,
+    timestamp,
+    target_timestamp,
+    from_id
+);
+CREATE INDEX IF NOT EXISTS reactions_position ON reactions (position);
+CREATE INDEX IF NOT EXISTS reactions_message ON reactions (message_id);
+CREATE TABLE IF NOT EXISTS attachments (
+    position INTEGER PRIMARY KEY,
+    messageId TEXT,
+    conversationId TEXT,
+    contentType TEXT,
+    sentAt TEXT,
+    orderInMessage TEXT,
+    height TEXT,
+    width TEXT,
+    size TEXT,
+    fileName TEXT
+);
+CREATE INDEX IF NOT EXISTS attachments_message ON attachments (messageId);
+"""
+
+def file_hash(path):
+    """
+    Get the SHA-256 hash of a file as a hex string.
+    """
+
+    digest = hashlib.sha256()
+
+    with open(path, "rb") as source_file:
+        while True:
+            block = source_file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+
+    return digest.hexdigest()
+
+def file_stat(path):
+    """
+    Get the size and modification time of a file, None if it doesn't exist.
+    """
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+
+    return (stat.st_size, stat.st_mtime_ns)
+
+class ParseCache:
+    """
+    The parsed rows of one source folder.
+
+    Attributes:
+    - path: The cache database.
+    - connection: Open `sqlite3.Connection`, None until `connect`.
+    - fresh: True once the cache is known to match the source files, either
+      by `is_fresh` or by building it.
+    - message_count: Number of messages added while building.
+    - attachment_count: Number of attachments added while building.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, CACHE_FILENAME)
+        self.connection = None
+        self.fresh = False
+        self.message_count = 0
+        self.attachment_count = 0
+
+        # rows waiting to be written while building
+        self.message_rows = []
+        self.reaction_rows = []
+        self.attachment_rows = []
+
+    def connect(self):
+        """
+        Open the cache, creating its tables, and dropping them first if they
+        were made by another version.
+        """
+
+        if self.connection is not None:
+            return self.connection
+
+        self.connection = sqlite3.connect(self.path)
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CACHE_VERSION:
+            for table in ["sources", "messages", "reactions", "attachments"]:
+                self.connection.execute("DROP TABLE IF EXISTS " + table)
+            self.connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def is_fresh(self, sources):
+        """
+        Check if the cache was built from the same source files.
+
+        Parameters:
+        - sources: Dictionary of the path of each source, by `SOURCE_*` name.
+
+        Returns:
+        - True if every source has the same path, size and modification time
+          as when the cache was built, or the same size and hash if only the
+          modification time changed, e.g. the file was copied again.
+        """
+
+        connection = self.connect()
+
+        for name, path in sources.items():
+            stored = connection.execute(
+                "SELECT path, size, mtime_ns, sha256 FROM sources WHERE name = ?", (name,)).fetchone()
+            if stored is None:
+                return False
+
+            stored_path, size, mtime_ns, sha256 = stored
+            if stored_path != path:
+                return False
+
+            # a source that was missing, e.g. no attachments export, must
+            # still be missing
+            stat = file_stat(path)
+            if stat is None or size is None:
+                if stat is None and size is None:
+                    continue
+                return False
+
+            if stat[0] != size:
+                return False
+
+            if stat[1] != mtime_ns:
+                if file_hash(path) != sha256:
+                    return False
+
+                # same content, only check the hash again if it's touched again
+                connection.execute(
+                    "UPDATE sources SET mtime_ns = ? WHERE name = ?", (stat[1], name))
+                connection.commit()
+
+        self.fresh = True
+        return True
+
+    def begin(self):
+        """
+        Empty the cache before it's built again.
+        """
+
+        connection = self.connect()
+        self.fresh = False
+
+        for table in ["sources", "messages", "reactions", "attachments"]:
+            connection.execute("DELETE FROM " + table)
+
+        self.message_rows = []
+        self.reaction_rows = []
+        self.attachment_rows = []
+        self.message_count = 0
+        self.attachment_count = 0
+
+    def add_message(self, record, json_fields):
+        """
+        Add a message row.
+
+        Parameters:
+        - record: The message Record, with the `MESSAGE_COLUMNS` fields.
+        - json_fields: Its `signal_json.extract_json_fields` result, None if
+          the JSON couldn't be decoded.
+        """
+
+        self.message_count += 1
+        position = self.message_count
+
+        reactions, quote, json_service_id = json_fields if json_fields is not None else ((), None, "")
+        quote_id, quote_text, quote_author = quote if quote is not None else (None, None, None)
+
+        self.message_rows.append(
+            [position] + [getattr(record, column) for column in MESSAGE_COLUMNS] + [
+                1 if json_fields is None else 0, json_service_id, len(reactions),
+                0 if quote is None else 1, quote_id, quote_text, quote_author,
+            ])
+
+        for emoji, timestamp, target_timestamp, from_id in reactions:
+            self.reaction_rows.append((position, record.id, emoji, timestamp, target_timestamp, from_id))
+
+        if len(self.message_rows) >= INSERT_BATCH_SIZE:
+            self.flush()
+
+    def add_attachment(self, values):
+        """
+        Add an attachment row, `values` are in `ATTACHMENT_COLUMNS` order.
+        """
+
+        self.attachment_count += 1
+        self.attachment_rows.append([self.attachment_count] + list(values))
+
+        if len(self.attachment_rows) >= INSERT_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the rows added so far.
+        """
+
+        if self.message_rows:
+            self.connection.executemany(
+                "INSERT INTO messages VALUES (" + ", ".join("?" * (len(MESSAGE_COLUMNS) + 8)) + ")",
+                self.message_rows)
+            self.message_rows = []
+
+        if self.reaction_rows:
+            self.connection.executemany(
+                "INSERT INTO reactions VALUES (?, ?, ?, ?, ?, ?)", self.reaction_rows)
+            self.reaction_rows = []
+
+        if self.attachment_rows:
+            self.connection.executemany(
+                "INSERT INTO attachments VALUES (" + ", ".join("?" * (len(ATTACHMENT_COLUMNS) + 1)) + ")",
+                self.attachment_rows)
+            self.attachment_rows = []
+
+    def finish(self, sources):
+        """
+        Write the remaining rows and the fingerprints of the source files the
+        cache was built from.
+
+        Parameters:
+        - sources: Dictionary of the path of each source, by `SOURCE_*` name.
+        """
+
+        self.flush()
+
+        for name, path in sources.items():
+            stat = file_stat(path)
+            if stat is None:
+                self.connection.execute(
+                    "INSERT INTO sources VALUES (?, ?, NULL, NULL, NULL)", (name, path))
+            else:
+                self.connection.execute(
+                    "INSERT INTO sources VALUES (?, ?, ?, ?, ?)",
+                    (name, path, stat[0], stat[1], file_hash(path)))
+
+        self.connection.commit()
+        self.fresh = True
+
+        logging.info(f"Cached {self.message_count} messages and {self.attachment_count} attachments in {self.path}")
+
+    def messages(self, where="", params=()):
+        """
+        Query the message rows.
+
+        Parameters:
+        - where: Optional SQL condition on the `MESSAGE_COLUMNS`, e.g. from
+          `RowFilter.where`.
+        - params: Values for the `?` placeholders in `where`.
+
+        Returns:
+        - Generator yielding each row as a list of the `MESSAGE_COLUMNS`
+          values as strings, followed by the decoded JSON fields in the
+          `signal_json.extract_json_fields` shape, in the order of the source.
+        """
+
+        connection = self.connect()
+
+        sql = "SELECT position, " + ", ".join(signal_db.quote_identifier(column) for column in MESSAGE_COLUMNS)
+        sql += ", json_error, json_service_id, reaction_count, has_quote, quote_id, quote_text, quote_author"
+        sql += " FROM messages"
+        if where:
+            sql += " WHERE " + where
+        sql += " ORDER BY position"
+
+        width = len(MESSAGE_COLUMNS)
+        cursor = connection.execute(sql, params)
+
+        while True:
+            rows = cursor.fetchmany(signal_db.FETCH_SIZE)
+            if not rows:
+                break
+
+            for row in rows:
+                values = [signal_db.to_text(value) for value in row[1:width + 1]]
+                json_error, json_service_id, reaction_count, has_quote, quote_id, quote_text, quote_author = row[width + 1:]
+
+                if json_error:
+                    values.append(None)
+                    yield values
+                    continue
+
+                reactions = ()
+                if reaction_count:
+                    reactions = tuple(connection.execute(
+                        "SELECT emoji, timestamp, target_timestamp, from_id FROM reactions "
+                        "WHERE position = ? ORDER BY rowid", (row[0],)))
+
+                quote = None
+                if has_quote:
+                    quote = (quote_id, quote_text, quote_author)
+
+                values.append((reactions, quote, json_service_id or ""))
+                yield values
+
+    def attachments(self):
+        """
+        Query the attachment rows.
+
+        Returns:
+        - Generator yielding the `ATTACHMENT_COLUMNS` header followed by each
+          row as a list of strings, like `csv.reader`, in the order of the
+          source.
+        """
+
+        connection = self.connect()
+
+        yield list(ATTACHMENT_COLUMNS)
+
+        cursor = connection.execute(
+            "SELECT " + ", ".join(ATTACHMENT_COLUMNS) + " FROM attachments ORDER BY position")
+
+        while True:
+            rows = cursor.fetchmany(signal_db.FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield [signal_db.to_text(value) for value in row]
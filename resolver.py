@@ -0,0 +1,100 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to figuring out who a message is from and to.
+#
+# Messages only carry ids: the `conversationId` of the person or group the
+# message belongs to, the `sourceServiceId` of the sender of a group message
+# and the `fromId` (a `conversationId`) of each reaction. The `Config` lookups
+# for those walk the list of people or groups every time, so they're done once
+# per id here and kept in dictionaries for the rest of the messages.
+#
+# Build the resolver after `conversations.parse_conversations_file` so every
+# person has their `conversation_id` and `service_id`.
+#
+# -----------------------------------------------------------------------------
+
+class IdentityResolver:
+    """
+    Cached lookups of people and groups by their Signal ids.
+
+    Attributes:
+    - the_config: The configuration object with the people and groups.
+    - me: The Person object representing the user (me).
+    """
+
+    def __init__(self, the_config):
+        self.the_config = the_config
+        self.me = the_config.me
+
+        # keep the first person with a given service ID, same as walking the
+        # list of people would
+        self.people_by_service_id = {}
+        for the_person in the_config.people:
+            service_id = getattr(the_person, "service_id", "")
+            if service_id and service_id not in self.people_by_service_id:
+                self.people_by_service_id[service_id] = the_person
+
+        self.people_by_conversation_id = {}
+        self.groups_by_conversation_id = {}
+
+    def get_person_by_service_id(self, id):
+        """
+        Lookup a person by their Service ID.
+
+        Parameters:
+        - id: The `sourceServiceId` of the person to look up.
+
+        Returns:
+        - Person object if a person was found, False if not.
+        """
+
+        return self.people_by_service_id.get(id, False)
+
+    def get_person_by_conversation_id(self, id):
+        """
+        Lookup a person by the `conversationId` of their 1:1 conversation.
+
+        Parameters:
+        - id: The `conversationId` to look up.
+
+        Returns:
+        - Person object, or whatever `Config.get_person_by_conversation_id`
+          returns if there's no such person.
+
+        Notes:
+        - If the `Config` lookup raises an exception, e.g. because there's no
+          person with that conversation ID, a `LookupError` with the same
+          message is raised for every lookup of that ID.
+        """
+
+        try:
+            result = self.people_by_conversation_id[id]
+        except KeyError:
+            try:
+                result = self.the_config.get_person_by_conversation_id(id)
+            except Exception as e:
+                result = LookupError(str(e))
+            self.people_by_conversation_id[id] = result
+
+        if isinstance(result, LookupError):
+            raise LookupError(str(result))
+
+        return result
+
+    def get_group_slug_by_conversation_id(self, id):
+        """
+        Lookup the slug of a group by the group's `conversationId`.
+
+        Parameters:
+        - id: The `conversationId` to look up.
+
+        Returns:
+        - The group's slug, or a falsy value if it's not a group.
+        """
+
+        try:
+            return self.groups_by_conversation_id[id]
+        except KeyError:
+            slug = self.the_config.get_group_slug_by_conversation_id(id)
+            self.groups_by_conversation_id[id] = slug
+            return slug
@@ -0,0 +1,169 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to dropping message rows before they're parsed.
+#
+# A large share of the rows in the `messages` table are never converted:
+# call history, group updates and other non-message types, rows before the
+# `-b` begin date and, with `--conversations`, rows of other conversations.
+# `RowFilter` checks the raw `type`, `sent_at` and `conversationId` columns
+# of each row so those are dropped before a Record or Message is created, any
+# URL is cleaned or any JSON is decoded. With `--db` the same checks are part
+# of the SQL query instead.
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+from datetime import date, datetime
+
+import timings
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+def begin_from_argv(argv):
+    """
+    Peek at the `-b` begin date that `message_md` will use, without removing
+    it from the command line.
+
+    Parameters:
+    - argv: The command line, e.g. `sys.argv`.
+
+    Returns:
+    - The begin date as a `date`, or None if there isn't one or it isn't a
+      `YYYY-MM-DD` date.
+    """
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-b", dest="begin", default="")
+    args, _ = parser.parse_known_args(argv[1:])
+
+    try:
+        return datetime.strptime(args.begin, "%Y-%m-%d").date()
+    except ValueError:
+        return None
+
+def begin_timestamp(begin):
+    """
+    Get the earliest `sent_at` to keep for a begin date.
+
+    Parameters:
+    - begin: The `-b` date.
+
+    Returns:
+    - Milliseconds since the epoch of a day before midnight UTC of that date,
+      so no row on the begin date is dropped in any time zone. `message_md`
+      still applies the exact date.
+    """
+
+    return (begin - date(1970, 1, 1)).days * MS_PER_DAY - MS_PER_DAY
+
+class RowFilter:
+    """
+    The checks done on the raw message rows.
+
+    Attributes:
+    - types: The `type` values to keep.
+    - begin: Earliest `sent_at` to keep, in milliseconds, or None.
+    - conversation_ids: Set of the `conversationId` values to keep, or None
+      to keep all of them.
+    """
+
+    def __init__(self, types, begin=None, conversation_ids=None):
+        self.types = frozenset(types)
+        self.begin = begin
+        self.conversation_ids = frozenset(conversation_ids) if conversation_ids is not None else None
+
+    def narrowed(self):
+        """
+        Check if messages are dropped because of their date or conversation,
+        so their attachments are expected to be left without a message.
+        """
+
+        return self.begin is not None or self.conversation_ids is not None
+
+    def compile(self, schema, type_field, sent_at_field, conversation_field, count=True):
+        """
+        Build the check for rows with a given header.
+
+        Parameters:
+        - schema: The `row_schema.RowSchema` of the rows.
+        - type_field: Name of the `type` column.
+        - sent_at_field: Name of the `sent_at` column.
+        - conversation_field: Name of the `conversationId` column.
+        - count: Count the dropped rows for `--timings`, off when the rows
+          are read a second time.
+
+        Returns:
+        - Function taking a raw row (list of strings) and returning True to
+          keep it.
+
+        Notes:
+        - A check is skipped if its column isn't in the header, and a row
+          whose `sent_at` isn't a number is kept, so those are handled like
+          they were before.
+        """
+
+        type_index = schema.index(type_field)
+        sent_at_index = schema.index(sent_at_field) if self.begin is not None else -1
+        conversation_index = schema.index(conversation_field) if self.conversation_ids is not None else -1
+
+        types = self.types
+        begin = self.begin
+        conversation_ids = self.conversation_ids
+
+        def keep(row):
+            width = len(row)
+
+            if 0 <= type_index:
+                type = row[type_index] if type_index < width else ""
+                if type not in types:
+                    if count:
+                        timings.skip_type(type)
+                    return False
+
+            if 0 <= sent_at_index < width:
+                try:
+                    if int(row[sent_at_index]) < begin:
+                        if count:
+                            timings.count(timings.COUNTER_BEFORE_BEGIN)
+                        return False
+                except ValueError:
+                    pass
+
+            if 0 <= conversation_index:
+                conversation_id = row[conversation_index] if conversation_index < width else ""
+                if conversation_id not in conversation_ids:
+                    if count:
+                        timings.count(timings.COUNTER_OTHER_CONVERSATIONS)
+                    return False
+
+            return True
+
+        return keep
+
+    def where(self, type_field, sent_at_field, conversation_field):
+        """
+        Build the same checks as an SQL `WHERE` clause for `--db`.
+
+        Parameters:
+        - type_field: Name of the `type` column.
+        - sent_at_field: Name of the `sent_at` column.
+        - conversation_field: Name of the `conversationId` column.
+
+        Returns:
+        - Tuple of the clause, without `WHERE`, and the list of parameters.
+        """
+
+        types = sorted(self.types)
+        clauses = [type_field + " IN (" + ", ".join("?" * len(types)) + ")"]
+        params = list(types)
+
+        if self.begin is not None:
+            clauses.append(sent_at_field + " >= ?")
+            params.append(self.begin)
+
+        if self.conversation_ids is not None:
+            ids = sorted(self.conversation_ids)
+            clauses.append(conversation_field + " IN (" + ", ".join("?" * len(ids)) + ")")
+            params.extend(ids)
+
+        return " AND ".join(clauses), params
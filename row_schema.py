@@ -0,0 +1,105 @@
+# -----------------------------------------------------------------------------
+#
+# Code shared by the `messages`, `conversations` and `message_attachments`
+# parsers to map the columns of a CSV (or database) row to named fields.
+#
+# The header row is compiled once into a `RowSchema` which knows the index of
+# every field the parser needs. Each row is then turned into a named tuple
+# with a single `itemgetter` call so the parsers can use `record.body`,
+# `record.sent_at`, etc. without looking up the column every time.
+#
+# The column order changes between Signal versions so the schema is always
+# built from the header row. Fields that aren't in the header are given an
+# empty string.
+#
+# -----------------------------------------------------------------------------
+
+from collections import namedtuple
+from operator import itemgetter
+
+MISSING_VALUE = ""
+
+class RowSchema:
+    """
+    The fields of a header row compiled into a fast row accessor.
+
+    Attributes:
+    - fields: The field names the parser asked for, in that order.
+    - indices: Dictionary of the column index of each field in the header.
+    - missing: List of the fields that aren't in the header.
+    - width: Number of columns in the header.
+    - Record: The named tuple class each row is converted to.
+    """
+
+    def __init__(self, header, fields, name="Record"):
+        self.fields = list(dict.fromkeys(fields))
+        self.width = len(header)
+
+        # if a column name appears more than once, use the first one
+        self.indices = {}
+        for index, column in enumerate(header):
+            if column in self.fields and column not in self.indices:
+                self.indices[column] = index
+
+        present = [field for field in self.fields if field in self.indices]
+        self.missing = [field for field in self.fields if field not in self.indices]
+
+        # the missing fields go last so they can be filled in by the defaults
+        self.Record = namedtuple(name, present + self.missing,
+                                 defaults=[MISSING_VALUE] * len(self.missing))
+
+        positions = [self.indices[field] for field in present]
+        if len(positions) > 1:
+            self._getter = itemgetter(*positions)
+        elif positions:
+            position = positions[0]
+            self._getter = lambda row: (row[position],)
+        else:
+            self._getter = lambda row: ()
+
+    def has(self, field):
+        """
+        Check if the header has a column for `field`.
+        """
+
+        return field in self.indices
+
+    def index(self, field):
+        """
+        Get the column index of `field` in the header, -1 if it's missing.
+        """
+
+        return self.indices.get(field, -1)
+
+    def record(self, row):
+        """
+        Convert a row into a `Record` named tuple.
+
+        Parameters:
+        - row: List of the values in the row.
+
+        Returns:
+        - The row's values as a `Record`, missing fields are an empty string.
+        """
+
+        try:
+            return self.Record(*self._getter(row))
+        except IndexError:
+            # short row, e.g. a truncated last line, so pad it out
+            padded = list(row) + [MISSING_VALUE] * (self.width - len(row))
+            return self.Record(*self._getter(padded))
+
+def compile_header(header, fields, name="Record"):
+    """
+    Compile the header row of a Signal CSV export or table into a `RowSchema`.
+
+    Parameters:
+    - header: The header row, i.e. the list of column names.
+    - fields: The field names the parser needs, e.g. `SignalFields`.
+    - name: Name of the named tuple class, handy when debugging.
+
+    Returns:
+    - A `RowSchema` for converting the following rows into records.
+    """
+
+    return RowSchema(header, fields, name)
@@ -0,0 +1,137 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to reading the decrypted Signal SQLite database directly.
+#
+# Instead of exporting `messages`, `conversations` and `message_attachments`
+# to CSV with DB Browser, the tables can be read straight from a decrypted
+# copy of `db.sqlite`. Only the columns the parsers need are selected and the
+# filtering and ordering is done by SQLite, so the rest of the JSON-heavy
+# rows never leave the database.
+#
+# The rows are returned in the same shape as `csv.reader` rows, i.e. a header
+# row followed by lists of strings, so the CSV parsing code works unchanged.
+#
+# -----------------------------------------------------------------------------
+
+import os
+import sqlite3
+from urllib.request import pathname2url
+
+MESSAGES_TABLE = "messages"
+CONVERSATIONS_TABLE = "conversations"
+ATTACHMENTS_TABLE = "message_attachments"
+
+# every ordinary SQLite table has an implicit `rowid` even when it's not
+# declared as a column
+ROWID_COLUMN = "rowid"
+
+FETCH_SIZE = 2000
+
+def connect(db_path):
+    """
+    Open the decrypted Signal database read-only.
+
+    Parameters:
+    - db_path: Path to the decrypted `db.sqlite` file.
+
+    Returns:
+    - An `sqlite3.Connection` to the database.
+    """
+
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"Signal database not found: {db_path}")
+
+    uri = "file:" + pathname2url(os.path.abspath(db_path)) + "?mode=ro"
+
+    return sqlite3.connect(uri, uri=True)
+
+def quote_identifier(name):
+    """
+    Quote a table or column name so it can be used in an SQL statement.
+    """
+
+    return '"' + name.replace('"', '""') + '"'
+
+def table_columns(connection, table):
+    """
+    Get the names of the columns in a table.
+
+    Parameters:
+    - connection: An open `sqlite3.Connection`.
+    - table: Name of the table e.g. `messages`.
+
+    Returns:
+    - List of column names in the order they're defined in the table.
+    """
+
+    cursor = connection.execute("PRAGMA table_info(" + quote_identifier(table) + ")")
+    columns = [row[1] for row in cursor]
+
+    if not columns:
+        raise ValueError(f"Table '{table}' not found in the Signal database")
+
+    return columns
+
+def to_text(value):
+    """
+    Convert a value from SQLite to the text DB Browser would put in a CSV file.
+    """
+
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+
+    return str(value)
+
+def read_table(db_path, table, fields, where="", params=(), order_by=""):
+    """
+    Stream rows from a Signal table selecting only the `fields` we need.
+
+    Parameters:
+    - db_path: Path to the decrypted `db.sqlite` file.
+    - table: Name of the table e.g. `messages`.
+    - fields: List of column names to select, e.g. `SignalFields`. Fields
+      missing from the table are left out of the header.
+    - where: Optional SQL condition, e.g. `type IN (?, ?)`.
+    - params: Values for the `?` placeholders in `where`.
+    - order_by: Optional column to sort by, e.g. `rowid`. Ignored when the
+      table doesn't have that column.
+
+    Returns:
+    - Generator yielding the header row first and then each row, all as lists
+      of strings just like `csv.reader`.
+    """
+
+    connection = connect(db_path)
+
+    try:
+        available = set(table_columns(connection, table))
+        available.add(ROWID_COLUMN)
+
+        header = []
+        for field in fields:
+            if field in available and field not in header:
+                header.append(field)
+
+        sql = "SELECT " + ", ".join(quote_identifier(field) for field in header)
+        sql += " FROM " + quote_identifier(table)
+        if where:
+            sql += " WHERE " + where
+        if order_by in available:
+            sql += " ORDER BY " + quote_identifier(order_by)
+
+        yield header
+
+        cursor = connection.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            for row in rows:
+                yield [to_text(value) for value in row]
+
+    finally:
+        connection.close()
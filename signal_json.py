@@ -0,0 +1,237 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to the `json` column of the Signal `messages` table.
+#
+# Each message row carries a JSON copy of the message but only the reactions,
+# the quote (if it's a reply) and the `sourceServiceId` are used. These are
+# pulled out into plain tuples by `extract_json_fields` which doesn't depend on
+# `message_md`, so it can run in a worker process (`--workers`) as well as in
+# the main one and both give exactly the same result.
+#
+# Decoding the JSON is a big part of the run time so `orjson` or `msgspec` is
+# used when installed, falling back to the standard `json` module.
+#
+# -----------------------------------------------------------------------------
+
+import json
+
+try:
+    import orjson # pip install orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec # pip install msgspec
+except ImportError:
+    msgspec = None
+
+JSON_REACTIONS = "reactions"
+JSON_TIMESTAMP = "timestamp"
+JSON_FROM_ID = "fromId"
+JSON_EMOJI = "emoji"
+JSON_TARGET_TIMESTAMP = "targetTimestamp"
+JSON_QUOTE = "quote"
+JSON_QUOTE_ID = "id"
+JSON_QUOTE_TEXT = "text"
+JSON_QUOTE_AUTHOR = ("authorAci", "authorUuid")
+JSON_SOURCE_SERVICE_ID = "sourceServiceId"
+
+# passed to `parse_json` when the `json` column still needs to be decoded
+NOT_DECODED = object()
+
+# what the keys look like in the raw JSON text, used to skip decoding rows
+# that don't have anything we need
+REACTIONS_KEY = '"' + JSON_REACTIONS + '"'
+EMPTY_REACTIONS = (REACTIONS_KEY + ':[]', REACTIONS_KEY + ': []')
+QUOTE_KEY = '"' + JSON_QUOTE + '"'
+NULL_QUOTE = (QUOTE_KEY + ':null', QUOTE_KEY + ': null')
+SOURCE_SERVICE_ID_KEY = '"' + JSON_SOURCE_SERVICE_ID + '"'
+
+# the result for a message without reactions, quote or `sourceServiceId`
+NO_JSON_FIELDS = ((), None, "")
+
+def select_decoder():
+    """
+    Pick the fastest JSON decoder that's installed.
+
+    Returns:
+    - Tuple of the decoder's name and its decode function.
+    """
+
+    if orjson is not None:
+        return "orjson", orjson.loads
+
+    if msgspec is not None:
+        return "msgspec", msgspec.json.Decoder().decode
+
+    return "json", json.loads
+
+JSON_BACKEND, fast_loads = select_decoder()
+
+def loads(data):
+    """
+    Decode a JSON string with `JSON_BACKEND`.
+
+    Parameters:
+    - data: The JSON string.
+
+    Returns:
+    - The decoded value.
+
+    Notes:
+    - Anything the fast decoder rejects, e.g. integers too big for `orjson`,
+      is given to the standard `json` module, so the result is always the same
+      as `json.loads` and it raises the same errors.
+    """
+
+    if fast_loads is json.loads:
+        return json.loads(data)
+
+    try:
+        return fast_loads(data)
+    except Exception:
+        return json.loads(data)
+
+def extract_reactions(reactions):
+    """
+    Pull the reactions out of the decoded `reactions` list.
+
+    Parameters:
+    - reactions: The `reactions` list from the message JSON.
+
+    Returns:
+    - Tuple of `(emoji, timestamp, targetTimestamp, fromId)` tuples. Stops at
+      the first reaction that's missing one of those.
+    """
+
+    result = []
+
+    try:
+        for reaction in reactions:
+            result.append((
+                reaction[JSON_EMOJI],
+                reaction[JSON_TIMESTAMP],
+                reaction[JSON_TARGET_TIMESTAMP],
+                str(reaction[JSON_FROM_ID]),
+            ))
+    except Exception:
+        pass
+
+    return tuple(result)
+
+def extract_quote(quote):
+    """
+    Pull the quoted message's id, text and author out of the decoded `quote`.
+
+    Parameters:
+    - quote: The `quote` dictionary from the message JSON.
+
+    Returns:
+    - Tuple of `(id, text, author)` where text is None if there isn't any and
+      author is the service ID of the person who sent the quoted message,
+      empty if it's missing, or None if there's no quote.
+
+    Notes:
+    - Newer exports call the author `authorAci`, older ones `authorUuid`.
+    """
+
+    if not isinstance(quote, dict) or JSON_QUOTE_ID not in quote:
+        return None
+
+    author = ""
+    for key in JSON_QUOTE_AUTHOR:
+        if quote.get(key):
+            author = quote[key]
+            break
+
+    return (quote[JSON_QUOTE_ID], quote.get(JSON_QUOTE_TEXT), author)
+
+def count_any(data, patterns):
+    """
+    Count how many times any of `patterns` appears in `data`.
+    """
+
+    return sum(data.count(pattern) for pattern in patterns)
+
+def needs_decoding(data, want_service_id=False):
+    """
+    Check the raw `json` column for the keys we use before paying for a full
+    decode. Most rows are plain text messages with no reactions or quote.
+
+    Parameters:
+    - data: The `json` column of the row.
+    - want_service_id: The `sourceServiceId` is needed too.
+
+    Returns:
+    - False if the JSON can't have anything we need, True otherwise.
+
+    Notes:
+    - Double quotes inside JSON strings are escaped, so a message body can't
+      look like one of the keys. Any key that's present, even if it might be
+      empty or nested, means the row is decoded so the result is the same.
+    """
+
+    if want_service_id and SOURCE_SERVICE_ID_KEY in data:
+        return True
+
+    if QUOTE_KEY in data and data.count(QUOTE_KEY) != count_any(data, NULL_QUOTE):
+        return True
+
+    if REACTIONS_KEY in data and data.count(REACTIONS_KEY) != count_any(data, EMPTY_REACTIONS):
+        return True
+
+    return False
+
+def extract_json_fields(data, want_service_id=False):
+    """
+    Decode the `json` column of a message and keep only what we use.
+
+    Parameters:
+    - data: The `json` column of the row.
+    - want_service_id: Also return the `sourceServiceId`, used when the
+      `sourceServiceId` column is empty.
+
+    Returns:
+    - Tuple of `(reactions, quote, source_service_id)` as returned by
+      `extract_reactions` and `extract_quote`, or None if the JSON couldn't
+      be decoded.
+
+    Notes:
+    - Rows that `needs_decoding` skips aren't decoded at all, so broken JSON
+      without reactions, a quote or a `sourceServiceId` gives
+      `NO_JSON_FIELDS` rather than None and isn't reported as an error.
+    """
+
+    if not needs_decoding(data, want_service_id):
+        return NO_JSON_FIELDS
+
+    try:
+        json_data = loads(data)
+    except Exception:
+        return None
+
+    if not isinstance(json_data, dict):
+        return NO_JSON_FIELDS
+
+    reactions = extract_reactions(json_data.get(JSON_REACTIONS) or ())
+    quote = extract_quote(json_data.get(JSON_QUOTE))
+
+    source_service_id = ""
+    if want_service_id:
+        source_service_id = json_data.get(JSON_SOURCE_SERVICE_ID) or ""
+
+    return (reactions, quote, source_service_id)
+
+def extract_json_batch(batch):
+    """
+    Run `extract_json_fields` over a batch of rows, used by the `--workers`
+    process pool.
+
+    Parameters:
+    - batch: List of `(data, want_service_id)` tuples.
+
+    Returns:
+    - List of the `extract_json_fields` results, in the same order.
+    """
+
+    return [extract_json_fields(data, want_service_id) for data, want_service_id in batch]
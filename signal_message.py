@@ -3,9 +3,229 @@
 import sys
 sys.path.insert(1, '../message_md/')
 import message
+import timestamps
+
+def intern_string(value):
+    """
+    Intern a string that repeats across many messages, e.g. a service ID, a
+    reaction emoji or an attachment content type, so all of them share one
+    copy instead of each row from the CSV file or database keeping its own.
+
+    Parameters:
+    - value: The string, anything else is returned as is.
+
+    Returns:
+    - The interned string.
+    """
+
+    if type(value) is str:
+        return sys.intern(value)
+
+    return value
+
+def set_sent_at(the_message, sent_at):
+    """
+    Set the time a message was sent, and its local date and time.
+
+    Parameters:
+    - the_message: The Message.
+    - sent_at: Milliseconds since the epoch, the `sent_at` column.
+    """
+
+    time_in_seconds = int(sent_at/1000)
+
+    # quotes and reactions refer to messages by this timestamp
+    the_message.sent_at = sent_at
+
+    # convert the time seconds since epoch to a time.struct_time object
+    the_message.time = timestamps.local_time(time_in_seconds)
+
+    the_message.timestamp = float(time_in_seconds)
+    the_message.set_date_time()
 
 class SignalMessage(message.Message):
     def __init__(self):
         super(SignalMessage, self).__init__()
 
-    source_service_id = ""
\ No newline at end of file
+        # set here, after the `Message` attributes, so every message's
+        # `__dict__` has its keys in the same order and they can share them
+        self.source_service_id = ""
+        self.sent_at = 0
+
+    source_service_id = ""
+
+    # `sent_at` in milliseconds, what quotes and reactions refer to
+    sent_at = 0
+
+    # only set on replies, see `message_index.link_messages`
+    quote_author_id = ""
+    quoted_message = None
+
+    def __getstate__(self):
+        # a `--markdown-workers` process only gets the messages of its own
+        # conversations, so don't send the quoted messages along
+        state = self.__dict__.copy()
+        state.pop("quoted_message", None)
+        return state
+
+    def add_attachment(self, the_attachment):
+        self.attachments.append(the_attachment)
+
+class SignalReaction(message.Reaction):
+    """
+    A Reaction that knows the message it reacts to, once it's been linked by
+    `message_index.link_messages`.
+    """
+
+    target_message = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("target_message", None)
+        return state
+
+# every message of a conversation has the same `to_slugs`, see `CompactMessage`
+SLUG_TUPLES = {}
+
+class CompactQuote:
+    """
+    The quote of a `CompactMessage`.
+    """
+
+    __slots__ = ("id", "text")
+
+    def __init__(self, id=None, text=None):
+        self.id = id
+        self.text = text
+
+# shared by the messages that aren't replies, never changed since
+# `message_index` only touches quotes with an `id`
+NO_QUOTE = CompactQuote()
+
+class CompactReaction:
+    """
+    A SignalReaction without the `__dict__`, see `CompactMessage`.
+    """
+
+    __slots__ = ("emoji", "timestamp", "target_time_sent", "from_slug", "target_message")
+
+    def __init__(self, the_reaction):
+        self.emoji = the_reaction.emoji
+        self.timestamp = the_reaction.timestamp
+        self.target_time_sent = the_reaction.target_time_sent
+        self.from_slug = the_reaction.from_slug
+        self.target_message = None
+
+    def to_reaction(self):
+        the_reaction = SignalReaction()
+        the_reaction.emoji = self.emoji
+        the_reaction.timestamp = self.timestamp
+        the_reaction.target_time_sent = self.target_time_sent
+        the_reaction.from_slug = self.from_slug
+        return the_reaction
+
+    def __getstate__(self):
+        return (self.emoji, self.timestamp, self.target_time_sent, self.from_slug)
+
+    def __setstate__(self, state):
+        self.emoji, self.timestamp, self.target_time_sent, self.from_slug = state
+        self.target_message = None
+
+class CompactMessage:
+    """
+    A parsed SignalMessage kept in a fraction of the memory, for when many
+    messages are held before they're written, e.g. the partitions of
+    `--markdown-workers` or the open windows of `--stream`.
+
+    Only what the row gave is kept, in slots: the local date and time are
+    worked out again from `sent_at`, messages without reactions, quote or
+    attachments share empty ones and the messages of a conversation share
+    their `to_slugs`. `message_index` and `attachments` work on these the same
+    as on a SignalMessage and `to_message` makes the SignalMessage that
+    `message_md` gets.
+
+    Notes:
+    - `message.Message` is dict based, a slotted subclass of it would still
+      have a `__dict__`, so this isn't one.
+    - The attachments are kept as they are, only a few messages have them.
+    """
+
+    __slots__ = (
+        "id", "body", "sent_at", "from_slug", "to_slugs", "group_slug",
+        "source_service_id", "has_attachments", "reactions", "quote",
+        "quote_author_id", "attachments", "quoted_message",
+    )
+
+    def __init__(self, the_message):
+        self.id = the_message.id
+        self.body = the_message.body
+        self.sent_at = the_message.sent_at
+        self.from_slug = the_message.from_slug
+
+        to_slugs = tuple(the_message.to_slugs)
+        self.to_slugs = SLUG_TUPLES.setdefault(to_slugs, to_slugs)
+
+        self.group_slug = the_message.group_slug
+        self.source_service_id = the_message.source_service_id
+        self.has_attachments = the_message.has_attachments
+        self.reactions = tuple(CompactReaction(the_reaction) for the_reaction in the_message.reactions)
+
+        self.quote = NO_QUOTE
+        if the_message.quote.id or the_message.quote.text:
+            self.quote = CompactQuote(the_message.quote.id, the_message.quote.text)
+
+        self.quote_author_id = the_message.quote_author_id
+        self.attachments = tuple(the_message.attachments)
+        self.quoted_message = None
+
+    def add_attachment(self, the_attachment):
+        self.attachments += (the_attachment,)
+
+    def to_message(self):
+        """
+        Make the SignalMessage this was made from, with the quote text and
+        attachments added since.
+
+        Notes:
+        - `quoted_message` and the reactions' `target_message` are left out,
+          the messages they point to may not be made at all.
+        """
+
+        the_message = SignalMessage()
+        the_message.body = self.body
+        the_message.has_attachments = self.has_attachments
+        the_message.source_service_id = self.source_service_id
+
+        the_message.reactions.extend(the_reaction.to_reaction() for the_reaction in self.reactions)
+
+        if self.quote is not NO_QUOTE:
+            the_message.quote.id = self.quote.id
+            the_message.quote.text = self.quote.text
+        if self.quote_author_id:
+            the_message.quote_author_id = self.quote_author_id
+
+        the_message.id = self.id
+        the_message.group_slug = self.group_slug
+        the_message.from_slug = self.from_slug
+        the_message.to_slugs.extend(self.to_slugs)
+
+        set_sent_at(the_message, self.sent_at)
+
+        the_message.attachments.extend(self.attachments)
+
+        return the_message
+
+    def __getstate__(self):
+        # like SignalMessage, a `--markdown-workers` process doesn't get the
+        # quoted messages, and `NO_QUOTE` has to stay the shared one
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["quoted_message"] = None
+        if self.quote is NO_QUOTE:
+            state["quote"] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+        if self.quote is None:
+            self.quote = NO_QUOTE
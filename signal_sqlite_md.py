@@ -1,22 +1,36 @@
+import argparse
 import csv
-import time
-import json
+import os
+import logging
+import collections
+import itertools
+import concurrent.futures
 import re
-from datetime import datetime, timezone
+import functools
+from datetime import date, datetime, timezone
 from urllib.parse import urlsplit, urlunsplit
-import tzlocal # pip install tzlocal
 
 import sys
 import conversations
 import attachments
 import signal_message
+import signal_db
+import csv_chunks
+import row_filter
+import row_schema
+import watermark
+import signal_json
+import resolver
+import timestamps
+import timings
+import message_index
+import parse_cache
 sys.path.insert(1, '../hal/')
 import person
 sys.path.insert(1, '../message_md/')
 import message_md
 import config
 import markdown
-import message
 
 SIGNAL_ID = "id"           # Unique identifier for the message
 SIGNAL_ROW_ID = "rowid"    # Row ID in the SQLite table
@@ -33,88 +47,59 @@ SIGNAL_OUTGOING = "outgoing"  # Outgoing message sent by the user
 
 SIGNAL_SOURCE_SERVICE_ID = "sourceServiceId"  # Service ID of the sender/recipient 
 
-JSON_REACTIONS = "reactions"
-JSON_TIMESTAMP = "timestamp"
-JSON_FROM_ID = "fromId"
-JSON_EMOJI = "emoji"
-JSON_TARGET_TIMESTAMP = "targetTimestamp"
-JSON_QUOTE = "quote"
-JSON_QUOTE_ID = "id"
-JSON_QUOTE_TEXT = "text"
+# number of rows sent to a `--workers` process at a time
+JSON_BATCH_SIZE = 1000
 
 URL_RE = re.compile(r'https?://[^\s<>"\]]+')
 TRAILING_URL_PUNCTUATION = ".,;:!?)"
 
+# number of cleaned URLs to remember
+URL_CACHE_SIZE = 4096
+
 SignalFields = [
     SIGNAL_ROW_ID, SIGNAL_ID, SIGNAL_JSON, SIGNAL_SENT_AT, 
     SIGNAL_CONVERSATION_ID, SIGNAL_SOURCE, SIGNAL_HAS_ATTACHMENTS, 
     SIGNAL_TYPE, SIGNAL_BODY, SIGNAL_SOURCE_SERVICE_ID
 ]
 
-def strip_shared_url_query_params(text):
-    if not text:
-        return text
-
-    def clean_match(match):
-        url = match.group(0)
-        suffix = ""
-        while url and url[-1] in TRAILING_URL_PUNCTUATION:
-            suffix = url[-1] + suffix
-            url = url[:-1]
-
-        if "?" not in url:
-            return url + suffix
-
-        parts = urlsplit(url)
-        if not parts.scheme or not parts.netloc or not parts.query:
-            return match.group(0)
-
-        return urlunsplit((parts.scheme, parts.netloc, parts.path, "", parts.fragment)) + suffix
-
-    return URL_RE.sub(clean_match, text)
-
-def parse_header(row, field_map):
+@functools.lru_cache(maxsize=URL_CACHE_SIZE)
+def strip_url_query_params(url):
     """
-    Parse the header row of the `messages.csv` file and map it to the fields.
-    
+    Remove the query string, e.g. `?utm_source=...`, from a URL matched by
+    `URL_RE`, keeping any trailing punctuation.
+
     Parameters:
-    row (list): The header row from the CSV file containing column names.
-    field_map (list): The field names and their indices will be stored.
+    url (str): The URL as matched in the text.
 
     Returns:
-    dict: Dictionary mapping field names to their column indices.
-          Example: {'timestamp': 0, 'sender': 1, 'message': 2}
-    """
-
-    global SignalFields
+    str: The URL without its query string.
 
-    count = 0
-    for col in row:
-        for field in SignalFields:
-            if col == field:
-                field_map.append([field, count])
-        count += 1
-
-def field_index(field_label, field_map):
+    Notes:
+    - Forwarded links repeat a lot, especially in group chats, so the result
+      is cached.
     """
-    Find the index of a specific field in the `field_map` based on its label.
 
-    Parameters:
-    field_label (str): Label of the field to find e.g., ATTACHMENT_CONTENT_TYPE
-    field_map (list): List mapping field names to their indices in the CSV row.
+    suffix = ""
+    stripped = url
+    while stripped and stripped[-1] in TRAILING_URL_PUNCTUATION:
+        suffix = stripped[-1] + suffix
+        stripped = stripped[:-1]
 
-    Returns:
-    int: The index of the field if found, otherwise -1.
-    """
+    if "?" not in stripped:
+        return stripped + suffix
 
-    result = -1
+    parts = urlsplit(stripped)
+    if not parts.scheme or not parts.netloc or not parts.query:
+        return url
 
-    for field in field_map:
-        if field[0] == field_label:
-            result = field[1]
-            break
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", parts.fragment)) + suffix
 
-    return result
+def strip_shared_url_query_params(text):
+    # most messages have no links so don't bother with the regex
+    if not text or "http" not in text:
+        return text
+
+    return URL_RE.sub(lambda match: strip_url_query_params(match.group(0)), text)
 
 def get_filename(str):
     """
@@ -140,14 +125,15 @@ def get_filename(str):
         # if "\\" is not found, return the original string
         return str
 
-def parse_reactions(reactions, the_message):
+def parse_reactions(reactions, the_message, the_resolver):
     """
     Parse the `json` portion of the message into a Reaction object and add to the 
     Message. Luckily, Signal stores reactions along with the original message.
     
     Parameters:
-    reactions (list): List of reaction data in JSON format.
+    reactions (tuple): The reactions from `signal_json.extract_reactions`.
     the_message (Message): The Message object where the reactions will be added.
+    the_resolver (IdentityResolver): Used to find the people who reacted.
     
     Returns:
     int: The number of reactions added to the Message object.
@@ -173,37 +159,33 @@ def parse_reactions(reactions, the_message):
 
     count = 0
 
-    the_config = config.Config()
+    for emoji, timestamp, target_timestamp, from_id in reactions:
+        reaction = signal_message.SignalReaction()
+        reaction.emoji = signal_message.intern_string(emoji)
+        reaction.timestamp = timestamp
+        reaction.target_time_sent = target_timestamp
+        
+        reactor = person.Person()
+        try:
+            reactor = the_resolver.get_person_by_conversation_id(from_id)
+        except Exception as e:
+            print(e)
+
+        if reactor:
+            reaction.from_slug = reactor.slug
+            the_message.reactions.append(reaction)
 
-    if reactions:
-        for reaction_json in reactions:
-            reaction = message.Reaction()
-            reaction.emoji = reaction_json[JSON_EMOJI]
-            reaction.timestamp = reaction_json[JSON_TIMESTAMP]
-            reaction.target_time_sent = reaction_json[JSON_TARGET_TIMESTAMP]
-            
-            from_id = str(reaction_json[JSON_FROM_ID])
-            reactor = person.Person()
-            try:
-                reactor = the_config.get_person_by_conversation_id(from_id)
-            except Exception as e:
-                print(e)
-
-            if reactor:
-                reaction.from_slug = reactor.slug
-                the_message.reactions.append(reaction)
-
-            count +=1
+        count +=1
 
     return count
 
-def parse_quote(data, the_message):
+def parse_quote(quote, the_message):
     """
     If this is a reply, parse the "quote" data from the JSON portion of the 
     message and set it in the Message object.
     
     Parameters:
-    data (dict): The "quote" data from the JSON portion of the message.
+    quote (tuple): The `(id, text, author)` from `signal_json.extract_quote`.
     the_message (Message): The Message object where the quote data will be set.
 
     Example:
@@ -220,27 +202,38 @@ def parse_quote(data, the_message):
 
     Notes:
     - The quoted reply is part of the JSON portion of the CSV row.
+    - The author is kept so `message_index.link_messages` can find the
+      original message.
     """
 
-    try:
-        the_message.quote.id = data[JSON_QUOTE_ID]
-        the_message.quote.text = strip_shared_url_query_params(data[JSON_QUOTE_TEXT])
-    except:
-        pass
+    if quote is None:
+        return
 
-def parse_json(row, the_message, field_map):
+    id, text, author = quote
+
+    the_message.quote.id = id
+    if author:
+        the_message.quote_author_id = signal_message.intern_string(author)
+    if text is not None:
+        the_message.quote.text = strip_shared_url_query_params(text)
+
+def parse_json(record, the_message, the_resolver, json_fields=signal_json.NOT_DECODED):
     """
     Parse the `json` portion of the message into a Reaction object and adds the
     source service ID and attachment IDs.
     
     Parameters:
-    row (list): The row from the CSV file containing the message data.
+    record (Record): The row from the CSV file containing the message data.
     the_message (Message): The target Message object where the values will be set.
-    field_map (dict): The mapping of columns to their field names.
+    the_resolver (IdentityResolver): Used to find the people who reacted.
+    json_fields (tuple): The `signal_json.extract_json_fields` result when it
+                         was already decoded by a `--workers` process.
 
     Notes:
     - The reactions are stored right inside the message row
     or received (?) the message.
+    - Rows from the `--cache` have the decoded result in their `json` field,
+      see `CachedRecords`.
     - The `json` portion of the message contains various fields including:
     {
         "timestamp": 1703540110922,
@@ -262,111 +255,80 @@ def parse_json(row, the_message, field_map):
 
     num_reactions = 0
     num_attachments = 0
-    
-    json_index = field_index(SIGNAL_JSON, field_map)
-    data = row[json_index]
 
-    try:
-        json_data = json.loads(data)
-    except Exception as e:
-        print("Error parsing JSON for message " + the_message.id + ": " + e)
+    if json_fields is signal_json.NOT_DECODED and not isinstance(record.json, str):
+        json_fields = record.json
 
-    try:
-        num_reactions = parse_reactions(json_data[JSON_REACTIONS], the_message)
-    except:
-        pass
+    if json_fields is signal_json.NOT_DECODED:
+        with timings.stage("parse_json") as stage:
+            json_fields = signal_json.extract_json_fields(record.json, not the_message.source_service_id)
+            stage.rows += 1
 
-    try:
-        parse_quote(json_data[JSON_QUOTE], the_message)
-    except:
-        pass
+    if json_fields is None:
+        timings.count(timings.COUNTER_JSON_ERRORS)
+        print("Error parsing JSON for message " + record.id)
+        return 0
 
-    return num_reactions + num_attachments
+    reactions, quote, source_service_id = json_fields
 
-def get_person_by_service_id(id):
-    """
-    Lookup a person in the `Config.people` array by their Service ID.
+    num_reactions = parse_reactions(reactions, the_message, the_resolver)
 
-    Parameters:
-    id (int): The `serviceId` for the person to look up.
+    parse_quote(quote, the_message)
 
-    Returns:
-    bool: False if no person found 
-    Person: Person object if a person was found
-    """
-
-    the_config = config.Config()
+    # older exports don't have a `sourceServiceId` column
+    if source_service_id and not the_message.source_service_id:
+        the_message.source_service_id = signal_message.intern_string(source_service_id)
 
-    if len(id):
-        for the_person in the_config.people:
-            try:
-                if the_person.service_id == id:
-                    return the_person
-            except Exception as e:
-                print(e)
-                pass
-            
-    return False
+    return num_reactions + num_attachments
 
-def parse_time(row, message, field_map):
+def parse_time(record, message):
     """
     Parse the date and time from a comma-separated row into the Message object.
     
     Parameters:
-    row (list): The row from the CSV file containing the message data.
+    record (Record): The row from the CSV file containing the message data.
     message (Message): The Message object where the date and time will be set.
-    field_map (dict): The mapping of columns to their field names.
 
     Notes:
     - The `sent_at` field in the CSV is a timestamp in milliseconds since epoch.
     - The timestamp is converted to seconds by dividing by 1000.
-    - The time is then converted to a `time.struct_time` object.
+    - The time is then converted to a `time.struct_time` object in the local
+      time zone, or the one given with `--timezone`.
     """
     
-    time_index = field_index(SIGNAL_SENT_AT, field_map)
-
-    timestamp = int(row[time_index])
-    time_in_seconds = int(timestamp/1000)
+    signal_message.set_sent_at(message, int(record.sent_at))
 
-    # convert the time seconds since epoch to a time.struct_time object
-    message.time = time.localtime(time_in_seconds)
-
-    message.timestamp = time.mktime(message.time)
-    message.set_date_time()
-
-def parse_people(row, message, field_map, me):
+def parse_people(record, message, the_resolver):
     """
     Parse the People from a comma-separated row into a Message.
 
     Parameters:
-    row (list): The row from the CSV file containing the message data.
+    record (Record): The row from the CSV file containing the message data.
     message (Message): The Message object where the data will be set.
-    field_map (dict): The mapping of columns to their field names.
-    me (Person): The Person object representing the user (me).
+    the_resolver (IdentityResolver): Used to find the people and groups, its
+                                     `me` is the Person representing the user.
 
     Returns:
     bool: True if sender and receiver found. False if neither is found.
     """
 
-    the_config = config.Config()
+    me = the_resolver.me
 
     found = False
 
-    message.id = row[field_index(SIGNAL_ID, field_map)]
+    message.id = record.id
 
-    type = row[field_index(SIGNAL_TYPE, field_map)]
+    type = record.type
 
     if type not in [SIGNAL_INCOMING, SIGNAL_OUTGOING]:
         return found
 
-    phone_index = field_index(SIGNAL_SOURCE, field_map)
-    phone_number = row[phone_index]
+    phone_number = record.source
 
-    conversation_id_index = field_index(SIGNAL_CONVERSATION_ID, field_map)
-    id = row[conversation_id_index]
+    id = record.conversationId
 
     # see if it's a group message by checking the `conversation_id`
-    group_slug = the_config.get_group_slug_by_conversation_id(id)
+    group_slug = the_resolver.get_group_slug_by_conversation_id(id)
     if group_slug:
         message.group_slug = group_slug
 
@@ -381,7 +343,7 @@ def parse_people(row, message, field_map, me):
         # if it's a group slug then this call would generate an error since it
         # won't find the person and that could confuse the user
         try:
-            to_person = the_config.get_person_by_conversation_id(id)
+            to_person = the_resolver.get_person_by_conversation_id(id)
         except:
             pass
 
@@ -397,7 +359,7 @@ def parse_people(row, message, field_map, me):
         # if couldn't get them by the convo ID, it is likely a group so try the 
         # `sourceServiceId` which is inside the json portion
         if not from_person and service_id:
-            from_person = get_person_by_service_id(service_id)
+            from_person = the_resolver.get_person_by_service_id(service_id)
 
     if from_person and len(from_person.slug):
         message.from_slug = from_person.slug
@@ -411,15 +373,16 @@ def parse_people(row, message, field_map, me):
 
     return found
 
-def parse_row(row, message, field_map):
+def parse_row(record, message, the_resolver, json_fields=signal_json.NOT_DECODED):
     """
     Parse one comma-separated row of the Signal `messages` CSV file into a
     Message object.
 
     Parameters:
-    row (list): The row from the CSV file containing the message data.
+    record (Record): The row from the CSV file containing the message data.
     message (Message): The Message object where the data will be set.
-    field_map (dict): The mapping of columns to their field names.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+    json_fields (tuple): The already decoded `json` column, see `parse_json`.
 
     Returns:
     bool: True if parsing was successful, False otherwise.
@@ -427,49 +390,671 @@ def parse_row(row, message, field_map):
    
     result = False
 
-    the_config = config.Config()
-
     # see if it's incoming our outgoing
 
-    type = row[field_index(SIGNAL_TYPE, field_map)]
+    type = record.type
 
     # only deal with "incoming" and "outgoing" messages
     if type in [SIGNAL_INCOMING, SIGNAL_OUTGOING]:
 
-        body_index = field_index(SIGNAL_BODY, field_map)
-        message.body = strip_shared_url_query_params(row[body_index])
+        message.body = strip_shared_url_query_params(record.body)
 
-        has_attachments_index = field_index(SIGNAL_HAS_ATTACHMENTS, field_map)
-        has_attachments_value = row[has_attachments_index] if has_attachments_index != -1 else ""
-        message.has_attachments = str(has_attachments_value).strip().lower() in ["1", "true", "yes"]
+        message.has_attachments = str(record.hasAttachments).strip().lower() in ["1", "true", "yes"]
 
-        try:
-            service_id_index = field_index(SIGNAL_SOURCE_SERVICE_ID, field_map)
-            message.source_service_id = row[service_id_index]
-        except:
-            pass
+        message.source_service_id = signal_message.intern_string(record.sourceServiceId)
 
         # parse the `json` portion of the message into a Reaction and
         # include it inside the Message object.
         try:
-            parse_json(row, message, field_map)
+            parse_json(record, message, the_resolver, json_fields)
         except:
             pass
 
     # find out who the people are in the conversation, i.e. who the
     # message is from and to 
-    if parse_people(row, message, field_map, the_config.me):
+    if parse_people(record, message, the_resolver):
 
         # we get here if we figured out who they are
 
-        parse_time(row, message, field_map)
+        parse_time(record, message)
 
         if len(message.body) or message.has_attachments:
             result = True
 
     return result
 
-def load_messages(filename, messages, reactions, the_config):
+def get_row_filter(the_config):
+    """
+    Get the filter applied to the raw message rows.
+
+    Parameters:
+    the_config (Config): The configuration object, `signal_row_filter` is set
+                         by `main`.
+
+    Returns:
+    RowFilter: The filter, keeping all incoming and outgoing messages if
+               none was set.
+    """
+
+    the_filter = getattr(the_config, "signal_row_filter", None)
+    if the_filter is None:
+        the_filter = row_filter.RowFilter([SIGNAL_INCOMING, SIGNAL_OUTGOING])
+
+    return the_filter
+
+def get_conversation_ids(the_config, names):
+    """
+    Find the `conversationId` of each person or group named on the command
+    line.
+
+    Parameters:
+    the_config (Config): The configuration object, after the conversations
+                         file was parsed.
+    names (str): Comma separated person or group slugs or conversation IDs.
+
+    Returns:
+    set: The conversation IDs. A name that isn't the slug of a person or
+         group is used as an ID as is.
+    """
+
+    ids = set()
+
+    for name in [name.strip() for name in names.split(",") if name.strip()]:
+        found = False
+
+        for the_person in the_config.people:
+            if the_person.slug == name and getattr(the_person, "conversation_id", ""):
+                ids.add(the_person.conversation_id)
+                found = True
+
+        for the_group in the_config.groups:
+            if getattr(the_group, "slug", "") == name and getattr(the_group, "id", ""):
+                ids.add(the_group.id)
+                found = True
+
+        if not found:
+            ids.add(name)
+
+    return ids
+
+def message_where(the_config, filtered=True):
+    """
+    Build the SQL condition for the message rows to read from the database
+    or the `--cache`.
+
+    Parameters:
+    the_config (Config): The configuration object.
+    filtered (bool): Apply `the_config.signal_row_filter` and the
+                     `--incremental` watermark, otherwise only keep the
+                     "incoming" and "outgoing" messages.
+
+    Notes:
+    - Once `Watermark.days` is known, the rows from the day before the
+      earliest of those days are read too, `Watermark.keep` drops the ones
+      on other days.
+
+    Returns:
+    tuple: The condition, without `WHERE`, and the list of parameters.
+    """
+
+    if not filtered:
+        the_filter = row_filter.RowFilter([SIGNAL_INCOMING, SIGNAL_OUTGOING])
+        return the_filter.where(SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID)
+
+    where, params = get_row_filter(the_config).where(
+        SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID)
+
+    # before the days with new rows are known, only the new rows are read to
+    # find them, then every row of those days
+    the_watermark = getattr(the_config, "signal_watermark", None)
+    if the_watermark and the_watermark.rowid:
+        if the_watermark.days:
+            where += " AND (" + SIGNAL_ROW_ID + " > ? OR " + SIGNAL_SENT_AT + " >= ?)"
+            params.extend([the_watermark.rowid, the_watermark.since])
+        else:
+            where += " AND " + SIGNAL_ROW_ID + " > ?"
+            params.append(the_watermark.rowid)
+
+    return where, params
+
+def split_workers(filename, the_config):
+    """
+    Share the `--workers` processes between reading a big CSV file and
+    decoding the `json` column, which run at the same time.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object, `signal_workers` is the
+                         number of `--workers`.
+
+    Returns:
+    tuple: The number of processes reading the CSV file, 0 to read it in this
+           process, and the number decoding the JSON.
+
+    Notes:
+    - Only a CSV file big enough to be split by `csv_chunks` is read by
+      worker processes, otherwise all of them decode the JSON.
+    - A single reading process only reads the ranges one after the other and
+      sends every row back, which is slower than reading them here, and a
+      single decoding process means decoding here. So the file is only read
+      by worker processes when both sides get at least 2 of them.
+    """
+
+    workers = getattr(the_config, "signal_workers", 0)
+
+    if workers >= 4 and not getattr(the_config, "signal_db", "") \
+            and os.path.isfile(filename) and os.path.getsize(filename) >= csv_chunks.CHUNK_SIZE * 2:
+        read_workers = workers // 2
+        return read_workers, workers - read_workers
+
+    return 0, workers
+
+def read_messages(filename, the_config, filtered=True):
+    """
+    Read the rows of the Signal `messages` table, either from the CSV export
+    or, if `--db` was given, straight from the decrypted SQLite database.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object, `signal_db` is the path to
+                         the database or empty to use the CSV file.
+    filtered (bool): Leave the rows dropped by the row filter and the
+                     watermark in the database, see `message_where`.
+
+    Returns:
+    generator: The header row followed by each message row as a list.
+
+    Notes:
+    - When reading from the database only the `SignalFields` columns of the
+      rows kept by `the_config.signal_row_filter` are selected, in `rowid`
+      order.
+    - In `--incremental` mode the rows at or below the watermark are left in
+      the database.
+    - With `--workers`, a big CSV file is split into byte ranges that are
+      parsed by some of the worker processes, see `csv_chunks` and
+      `split_workers`.
+    """
+
+    db_path = getattr(the_config, "signal_db", "")
+    read_workers = split_workers(filename, the_config)[0]
+
+    if db_path:
+        where, params = message_where(the_config, filtered)
+
+        yield from signal_db.read_table(
+            db_path, signal_db.MESSAGES_TABLE, SignalFields,
+            where=where, params=params, order_by=SIGNAL_ROW_ID)
+    elif read_workers:
+        yield from csv_chunks.read_rows(filename, read_workers)
+    else:
+        with open(filename, 'r', newline='') as csv_file:
+            yield from csv.reader(csv_file)
+
+def parse_json_results(records, results, the_resolver):
+    """
+    Finish parsing a batch of rows whose `json` column was decoded by a
+    `--workers` process.
+
+    Parameters:
+    records (list): The rows in the batch.
+    results (list): The `signal_json.extract_json_fields` result for each row.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+
+    Returns:
+    generator: The parsed Message objects.
+    """
+
+    for record, json_fields in zip(records, results):
+        the_message = signal_message.SignalMessage()
+        if parse_row(record, the_message, the_resolver, json_fields):
+            yield the_message
+
+def parse_records_in_parallel(records, workers, the_resolver):
+    """
+    Parse the message rows, decoding the `json` column in a pool of worker
+    processes.
+
+    Parameters:
+    records (iterable): The rows to parse.
+    workers (int): Number of worker processes.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+
+    Returns:
+    generator: The parsed Message objects.
+
+    Notes:
+    - Rows are sent to the workers in batches of `JSON_BATCH_SIZE` and the
+      results are merged back in the original order, so the messages are
+      exactly the same as when parsing them one by one.
+    - Only a few batches per worker are in flight at once so the rows don't
+      all have to be held in memory.
+    - With `--timings`, the "parse_json" stage is the time spent waiting for
+      the workers.
+    """
+
+    pending = collections.deque()
+    batch = []
+
+    def finish():
+        done, future = pending.popleft()
+        with timings.stage("parse_json") as stage:
+            results = future.result()
+            stage.rows += len(done)
+        return parse_json_results(done, results, the_resolver)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+
+        def submit(batch):
+            jobs = [(record.json, not record.sourceServiceId) for record in batch]
+            pending.append((batch, executor.submit(signal_json.extract_json_batch, jobs)))
+
+        for record in records:
+
+            # other types of rows are never turned into messages
+            if record.type not in [SIGNAL_INCOMING, SIGNAL_OUTGOING]:
+                continue
+
+            batch.append(record)
+            if len(batch) == JSON_BATCH_SIZE:
+                submit(batch)
+                batch = []
+
+                while len(pending) > workers * 2:
+                    yield from finish()
+
+        if batch:
+            submit(batch)
+
+        while pending:
+            yield from finish()
+
+def parse_records(records, workers, the_resolver):
+    """
+    Parse the message rows into Message objects, one at a time.
+
+    Parameters:
+    records (iterable): The rows to parse.
+    workers (int): Number of `--workers` processes, 0 or 1 to parse the rows
+                   in this process.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+
+    Returns:
+    generator: The Message objects, in the order of the rows.
+
+    Notes:
+    - Rows from the `--cache` are already decoded so `workers` isn't used.
+    """
+
+    if workers > 1 and not getattr(records, "decoded", False):
+        yield from parse_records_in_parallel(records, workers, the_resolver)
+        return
+
+    for record in records:
+        the_message = signal_message.SignalMessage()
+        if parse_row(record, the_message, the_resolver):
+            yield the_message
+
+class MessageRecords:
+    """
+    The rows of the Signal `messages` table as Records, leaving out the ones
+    converted by a previous `--incremental` run.
+
+    Attributes:
+    - filename: The path to the CSV file containing the messages.
+    - the_config: The configuration object.
+    - count: Number of rows read, including the header, 0 if there wasn't one.
+    - count_skipped: Count the rows dropped by the row filter for `--timings`,
+      off when the rows are read a second time.
+
+    Notes:
+    - Rows dropped by `the_config.signal_row_filter` are left out before the
+      watermark sees them, so only message rows move it.
+    - In `--incremental` mode the rows are read twice, first to find the
+      local days with new rows, see `scan_new_days`.
+    """
+
+    # the `json` column still has to be decoded
+    decoded = False
+
+    def __init__(self, filename, the_config, count_skipped=True):
+        self.filename = filename
+        self.the_config = the_config
+        self.count = 0
+        self.count_skipped = count_skipped
+
+    def __iter__(self):
+        the_watermark = getattr(self.the_config, "signal_watermark", None)
+        if the_watermark is not None and the_watermark.days is None:
+            scan_new_days(read_messages(self.filename, self.the_config), self.the_config)
+
+        rows = read_messages(self.filename, self.the_config)
+        header = next(rows, None)
+        if header is None:
+            return
+
+        self.count = 1
+        rows = timings.timed("read rows", rows)
+
+        schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+        keep = get_row_filter(self.the_config).compile(
+            schema, SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID, self.count_skipped)
+
+        for row in rows:
+            self.count += 1
+            if not keep(row):
+                continue
+            record = schema.record(row)
+            if the_watermark is None or the_watermark.keep(record.rowid, record.sent_at):
+                yield record
+
+def scan_new_days(rows, the_config):
+    """
+    Find the local days that have rows newer than the `--incremental`
+    watermark, so every row of those days is converted again.
+
+    Parameters:
+    rows (iterable): The header row followed by the message rows, read
+                     before the days are known so only the new rows are
+                     selected from the database or the `--cache`.
+    the_config (Config): The configuration object, `signal_watermark` gets
+                         the days.
+
+    Notes:
+    - `message_md` writes a file per person per day, converting only the new
+      rows of a day would replace the messages converted before.
+    """
+
+    the_watermark = the_config.signal_watermark
+
+    if the_watermark.is_empty():
+        the_watermark.no_new_days()
+        return
+
+    with timings.stage("scan_new_days") as stage:
+        header = next(iter(rows), None)
+        if header is None:
+            the_watermark.no_new_days()
+            return
+
+        schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+        keep = get_row_filter(the_config).compile(
+            schema, SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID, count=False)
+        rowid_index = schema.index(SIGNAL_ROW_ID)
+        sent_at_index = schema.index(SIGNAL_SENT_AT)
+
+        for row in rows:
+            stage.rows += 1
+            if not keep(row):
+                continue
+            rowid = row[rowid_index] if 0 <= rowid_index < len(row) else None
+            sent_at = row[sent_at_index] if 0 <= sent_at_index < len(row) else None
+            the_watermark.add_new_day(rowid, sent_at)
+
+        the_watermark.no_new_days()
+
+    if the_watermark.days:
+        print(f"Converting every message of {len(the_watermark.days)} days with new messages")
+
+class CachedRecords:
+    """
+    The rows of the Signal `messages` table from the `--cache`, the same as
+    MessageRecords but the `json` field of each Record is the decoded
+    `signal_json.extract_json_fields` result.
+
+    Attributes:
+    - the_cache: The `parse_cache.ParseCache`, known to match the sources.
+    - the_config: The configuration object.
+    - count: Number of rows read, plus one for the header like MessageRecords.
+
+    Notes:
+    - The row filter and the watermark are part of the query, like with
+      `--db`, so the rows they drop aren't counted for `--timings`.
+    """
+
+    decoded = True
+
+    def __init__(self, the_cache, the_config):
+        self.the_cache = the_cache
+        self.the_config = the_config
+        self.count = 0
+
+    def __iter__(self):
+        the_watermark = getattr(self.the_config, "signal_watermark", None)
+
+        header = parse_cache.MESSAGE_COLUMNS + [SIGNAL_JSON]
+        schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+
+        if the_watermark is not None and the_watermark.days is None:
+            where, params = message_where(self.the_config)
+            scan_new_days(itertools.chain([header], self.the_cache.messages(where, params)), self.the_config)
+
+        where, params = message_where(self.the_config)
+
+        self.count = 1
+        rows = timings.timed("read rows", self.the_cache.messages(where, params))
+
+        for row in rows:
+            self.count += 1
+            record = schema.record(row)
+            if the_watermark is None or the_watermark.keep(record.rowid, record.sent_at):
+                yield record
+
+def cache_sources(filename, the_config):
+    """
+    Get the files the `--cache` is built from.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+
+    Returns:
+    dict: The absolute path of each source, by `parse_cache.SOURCE_*` name.
+    """
+
+    db_path = getattr(the_config, "signal_db", "")
+
+    return {
+        parse_cache.SOURCE_MESSAGES: os.path.abspath(db_path or filename),
+        parse_cache.SOURCE_ATTACHMENTS: os.path.abspath(attachments.source_path(the_config)),
+    }
+
+def build_parse_cache(filename, the_config, the_cache, sources):
+    """
+    Read and decode every message and attachment row into the `--cache`.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+    the_cache (ParseCache): The cache to build.
+    sources (dict): The files it's built from, see `cache_sources`.
+
+    Notes:
+    - Every "incoming" and "outgoing" message is kept, whatever the `-b`
+      date, `--conversations` or `--incremental` watermark, so those can
+      change without building the cache again.
+    """
+
+    with timings.stage("build_cache") as stage:
+        the_cache.begin()
+
+        rows = read_messages(filename, the_config, filtered=False)
+        header = next(rows, None)
+
+        if header is not None:
+            schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+            keep = row_filter.RowFilter([SIGNAL_INCOMING, SIGNAL_OUTGOING]).compile(
+                schema, SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID)
+
+            for row in rows:
+                if not keep(row):
+                    continue
+                record = schema.record(row)
+                with timings.stage("parse_json") as json_stage:
+                    json_stage.rows += 1
+                    json_fields = signal_json.extract_json_fields(record.json, not record.sourceServiceId)
+                the_cache.add_message(record, json_fields)
+
+        attachments.cache_attachments(the_cache, the_config)
+
+        the_cache.finish(sources)
+        stage.rows += the_cache.message_count + the_cache.attachment_count
+
+def message_records(filename, the_config, count_skipped=True):
+    """
+    Get the message rows to parse, from the `--cache` if it's on.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object, `signal_cache` is the
+                         ParseCache or None.
+    count_skipped (bool): See MessageRecords.
+
+    Returns:
+    MessageRecords or CachedRecords: The rows, the cache is built first if it
+                                     doesn't match the source files.
+    """
+
+    the_cache = getattr(the_config, "signal_cache", None)
+    if the_cache is None:
+        return MessageRecords(filename, the_config, count_skipped)
+
+    if not the_cache.fresh:
+        sources = cache_sources(filename, the_config)
+        if the_cache.is_fresh(sources):
+            print(f"Reading the parsed messages from {the_cache.path}")
+        else:
+            print(f"Building {the_cache.path}")
+            build_parse_cache(filename, the_config, the_cache, sources)
+
+    return CachedRecords(the_cache, the_config)
+
+def all_message_records(filename, the_config):
+    """
+    Read every "incoming" and "outgoing" message row, whatever the `-b` date,
+    `--conversations` or `--incremental` watermark, from the `--cache` if
+    it's been checked.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+
+    Returns:
+    generator: The rows as Records.
+    """
+
+    the_cache = getattr(the_config, "signal_cache", None)
+    if the_cache is not None and the_cache.fresh:
+        header = parse_cache.MESSAGE_COLUMNS + [SIGNAL_JSON]
+        schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+        for row in the_cache.messages(*message_where(the_config, filtered=False)):
+            yield schema.record(row)
+        return
+
+    rows = read_messages(filename, the_config, filtered=False)
+    header = next(rows, None)
+    if header is None:
+        return
+
+    schema = row_schema.compile_header(header, SignalFields, "SignalRow")
+    keep = row_filter.RowFilter([SIGNAL_INCOMING, SIGNAL_OUTGOING]).compile(
+        schema, SIGNAL_TYPE, SIGNAL_SENT_AT, SIGNAL_CONVERSATION_ID, count=False)
+
+    for row in rows:
+        if keep(row):
+            yield schema.record(row)
+
+def quoted_times(filename, the_config):
+    """
+    Find the `sent_at` of every message quoted by a reply whose quote has no
+    text of its own, in all of the message rows.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+
+    Returns:
+    set: The `sent_at` values, in milliseconds.
+
+    Notes:
+    - Only the rows with a `quote` in their JSON are decoded.
+    """
+
+    wanted = set()
+
+    with timings.stage("quoted_times") as stage:
+        for record in all_message_records(filename, the_config):
+            stage.rows += 1
+
+            json_fields = record.json
+            if isinstance(json_fields, str):
+                if signal_json.QUOTE_KEY not in json_fields:
+                    continue
+                json_fields = signal_json.extract_json_fields(json_fields)
+
+            quote = json_fields[1] if json_fields else None
+            if quote and not quote[1]:
+                sent_at = message_index.to_sent_at(quote[0])
+                if sent_at is not None:
+                    wanted.add(sent_at)
+
+    return wanted
+
+def quoted_messages(filename, the_config, wanted, the_resolver):
+    """
+    Parse the messages sent at the given times from all of the message rows,
+    so a reply can get the text of a message this run doesn't convert.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+    wanted (set): The `sent_at` values, in milliseconds.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+
+    Returns:
+    MessageIndex: Every message sent at one of those times, so a quote is
+                  found the same way as when every message is loaded.
+    """
+
+    index = message_index.MessageIndex()
+    if not wanted:
+        return index
+
+    with timings.stage("quoted_messages") as stage:
+        for record in all_message_records(filename, the_config):
+            if message_index.to_sent_at(record.sent_at) not in wanted:
+                continue
+            the_message = signal_message.SignalMessage()
+            if parse_row(record, the_message, the_resolver):
+                index.add(the_message)
+                stage.rows += 1
+
+    return index
+
+def link_other_quotes(filename, the_config, messages, the_resolver):
+    """
+    Give the replies whose original wasn't loaded by this run the text of
+    the original, like a run that loads every message would.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+    messages (list): The parsed messages, already linked.
+    the_resolver (IdentityResolver): Used to find the people and groups.
+
+    Notes:
+    - Only needed when `-b`, `--conversations` or `--incremental` leave
+      messages out, it reads the rows once more.
+    """
+
+    replies = message_index.unlinked_quotes(messages)
+    if not replies:
+        return
+
+    wanted = {message_index.to_sent_at(the_message.quote.id) for the_message in replies}
+    index = quoted_messages(filename, the_config, wanted, the_resolver)
+    message_index.link_quotes(replies, the_resolver, index)
+
+def load_messages(filename, messages, reactions, the_config, compact=False):
     """
     Load the Signal messages from the CSV file and parse into Message objects.
 
@@ -478,46 +1063,505 @@ def load_messages(filename, messages, reactions, the_config):
     messages (list): The list where the parsed Message objects will be stored.
     reactions (array): Not used in this function.
     the_config (Config): The configuration object containing settings and metadata.
+    compact (bool): Store CompactMessage objects instead, for messages that
+                    aren't given to `message_md` right away.
 
     Returns:
     int: The number of messages parsed from the CSV file.
+
+    Notes:
+    - In `--incremental` mode, `the_config.signal_watermark` holds the last
+      row converted by a previous run and older rows are skipped before a
+      Message is created for them.
+    - With `--workers N`, `the_config.signal_workers` is N and the `json`
+      column is decoded by a pool of N processes, or of the ones left over
+      from reading a big CSV file, see `split_workers`.
     """
 
-    field_map = []
+    the_watermark = getattr(the_config, "signal_watermark", None)
+    workers = split_workers(filename, the_config)[1]
 
-    with open(filename, 'r') as csv_file:
-        reader = csv.reader(csv_file)
+    with timings.stage("load_messages") as stage:
+        records = message_records(filename, the_config)
 
-        count = 0
-        for row in reader:
-            if count == 0:
-                parse_header(row, field_map)
-                # [['rowid', 0], ['id', 1], ['json', 2], ['sent_at', 5], ['conversationId', 7], ['source', 9], ['hasAttachments', 10], ['type', 15], ['body', 16]]
-            else:
-                the_message = signal_message.SignalMessage()
-                if parse_row(row, the_message, field_map):
-                    messages.append(the_message)
-            count += 1
+        # the conversations have been parsed by now so the people are complete
+        the_resolver = resolver.IdentityResolver(the_config)
 
-    # Load the metadata from attachments export
-    attachments.parse_attachments_file(messages, the_config)
+        parsed = parse_records(records, workers, the_resolver)
+        if compact:
+            parsed = map(signal_message.CompactMessage, parsed)
 
-    return count
+        messages.extend(parsed)
+        if not records.count:
+            return 0
+
+        # Load the metadata from attachments export. When converting only the new
+        # messages, or some of them, the attachments of the others are expected
+        # to be missing.
+        warn_missing = the_watermark is None and not get_row_filter(the_config).narrowed()
+        attachments.parse_attachments_file(messages, the_config, warn_missing=warn_missing)
+
+        message_index.link_messages(messages, the_resolver)
+        if the_watermark is not None or get_row_filter(the_config).narrowed():
+            link_other_quotes(filename, the_config, messages, the_resolver)
+
+        stage.rows += records.count - 1
+
+        return records.count
+
+def day_window(the_message, window_days):
+    """
+    Get the `--stream` window a message belongs to.
+
+    Parameters:
+    the_message (CompactMessage): A parsed message.
+    window_days (int): Number of days in a window.
+
+    Returns:
+    int: The window number, windows start on the local day of the message so
+         a day's messages are always in the same window.
+    """
+
+    local = timestamps.local_time(int(the_message.sent_at/1000))
+    day = date(local.tm_year, local.tm_mon, local.tm_mday).toordinal()
+
+    return day // window_days
+
+def window_of_record(record, window_days):
+    """
+    Get the `--stream` window of a row without parsing it, same as
+    `day_window` of the Message it becomes.
+    """
+
+    local = timestamps.local_time(int(int(record.sent_at) / 1000))
+    day = date(local.tm_year, local.tm_mon, local.tm_mday).toordinal()
+
+    return day // window_days
+
+def stream_windows(filename, the_config, window_days=1, lag_days=2):
+    """
+    Parse the messages lazily and hand them out a window of days at a time,
+    with their attachments, so only a few windows are ever held in memory.
+
+    Parameters:
+    filename (str): The path to the CSV file containing the messages.
+    the_config (Config): The configuration object.
+    window_days (int): Number of days in a window.
+    lag_days (int): How many days past the end of a window to wait for late
+                    rows before handing the window out.
+
+    Returns:
+    generator: Lists of Message objects, one per window, oldest first.
+
+    Notes:
+    - Rows come in `rowid` order, which is roughly but not exactly the order
+      they were sent in. A window is handed out once a row `lag_days` past its
+      end is seen.
+    - A row that still arrives after its window was handed out would leave the
+      Markdown for that day incomplete, so those windows are read again at the
+      end and handed out once more with all of their messages.
+    - The attachments are indexed by message id once and joined to each
+      window, so memory grows with the number of attachments, not messages.
+    - The open windows hold CompactMessages, each window is turned into
+      Message objects when it's handed out.
+    - Quotes and reactions are linked within a window. So a reply to a
+      message from another window gets the same text as when every message
+      is loaded, the messages quoted by replies without text are found in
+      all the rows before the first window, see `quoted_times`.
+    """
+
+    the_watermark = getattr(the_config, "signal_watermark", None)
+    workers = split_workers(filename, the_config)[1]
+    warn_missing = the_watermark is None and not get_row_filter(the_config).narrowed()
+
+    # first, so the attachments come from the `--cache` once it's checked
+    records = message_records(filename, the_config)
+
+    the_resolver = resolver.IdentityResolver(the_config)
+    attachments_index = attachments.index_attachments(the_config)
+    matched_ids = set()
+
+    quoted_index = quoted_messages(filename, the_config, quoted_times(filename, the_config), the_resolver)
 
-# main
+    def finish(messages):
+        attachments.join_attachments(messages, attachments_index, matched_ids, the_config)
+        message_index.link_messages(messages, the_resolver)
+        message_index.link_quotes(message_index.unlinked_quotes(messages), the_resolver, quoted_index)
+        return [the_message.to_message() for the_message in messages]
 
-the_messages = []
-the_reactions = [] 
+    open_windows = {}
+    next_window = None
+    late_windows = set()
+    newest_day = None
 
-the_config = config.Config()
+    for the_message in map(signal_message.CompactMessage, parse_records(records, workers, the_resolver)):
+        window = day_window(the_message, window_days)
 
-if message_md.setup(the_config, markdown.YAML_SERVICE_SIGNAL):
+        if next_window is not None and window < next_window:
+            late_windows.add(window)
+            continue
 
-    # load the conversation ID for each person
+        open_windows.setdefault(window, []).append(the_message)
+
+        day = day_window(the_message, 1)
+        if newest_day is None or day > newest_day:
+            newest_day = day
+
+        # hand out the windows that ended more than `lag_days` ago
+        while open_windows:
+            oldest = min(open_windows)
+            if (oldest + 1) * window_days + lag_days > newest_day:
+                break
+            next_window = oldest + 1
+            yield finish(open_windows.pop(oldest))
+
+    for window in sorted(open_windows):
+        yield finish(open_windows.pop(window))
+
+    if late_windows:
+        logging.warning(f"{len(late_windows)} windows had messages arriving after they were written, writing them again")
+
+        # read the rows again, keeping only the late windows, without moving
+        # the `--incremental` watermark or its count a second time
+        skipped = the_watermark.skipped if the_watermark else 0
+
+        all_records = message_records(filename, the_config, count_skipped=False)
+        late_records = (
+            record for record in all_records
+            if window_of_record(record, window_days) in late_windows
+        )
+        late_workers = 0 if all_records.decoded else workers
+        for the_message in map(signal_message.CompactMessage, parse_records(late_records, late_workers, the_resolver)):
+            open_windows.setdefault(day_window(the_message, window_days), []).append(the_message)
+
+        if the_watermark:
+            the_watermark.skipped = skipped
+
+        for window in sorted(open_windows):
+            yield finish(open_windows.pop(window))
+
+    attachments.report_unmatched_attachments(attachments_index, matched_ids, warn_missing)
+
+def stream_markdown(the_config, window_days=1, lag_days=2):
+    """
+    Write the Markdown a window of days at a time with `--stream`, instead of
+    loading every message first.
+
+    Parameters:
+    the_config (Config): The configuration object.
+    window_days (int): Number of days in each window.
+    lag_days (int): Days to wait for late rows, see `stream_windows`.
+
+    Returns:
+    int: The number of messages written.
+
+    Notes:
+    - `message_md.get_markdown` is called once per window. It passes the
+      messages filename to the load function, so the windows are started on
+      the first call and the next window is read before the current one is
+      written, to know if it's the last.
+    """
+
+    windows = None
+    current = None
+    done = False
+    total = 0
+
+    def load_window(filename, messages, reactions, the_config):
+        nonlocal windows, current, done
+
+        with timings.stage("load_messages") as stage:
+            if windows is None:
+                windows = stream_windows(filename, the_config, window_days, lag_days)
+                current = next(windows, None)
+
+            if current is not None:
+                messages.extend(current)
+                stage.rows += len(current)
+
+            current = next(windows, None)
+            done = current is None
+
+        return len(messages)
+
+    while not done:
+        the_messages = []
+        with timings.stage("get_markdown") as stage:
+            message_md.get_markdown(the_config, load_window, the_messages, [])
+            stage.rows += len(the_messages)
+        total += len(the_messages)
+
+    return total
+
+# the Config of a `--markdown-workers` process, set up by `init_markdown_worker`
+worker_config = None
+
+def init_markdown_worker(argv, db_path, timezone_name):
+    """
+    Set up a `--markdown-workers` process the same way `main` sets up this
+    one: run `message_md.setup` on the same command line and load the
+    conversations so the people are complete.
+
+    Parameters:
+    argv (list): The command line given to `message_md.setup`.
+    db_path (str): The `--db` path, empty for the CSV exports.
+    timezone_name (str): The `--timezone`, empty for the local one.
+    """
+
+    global worker_config
+
+    if timezone_name:
+        timestamps.set_timezone(timezone_name)
+
+    sys.argv = list(argv)
+
+    the_config = config.Config()
+    if not message_md.setup(the_config, markdown.YAML_SERVICE_SIGNAL):
+        raise RuntimeError("message_md.setup failed in a --markdown-workers process")
+
+    the_config.signal_db = db_path
     conversations.parse_conversations_file(the_config)
-    
     the_config.reversed = False
 
-    # needs to be after setup so the command line parameters override the
-    # values defined in the settings file
-    message_md.get_markdown(the_config, load_messages, the_messages, the_reactions)
\ No newline at end of file
+    worker_config = the_config
+
+def render_partition(messages):
+    """
+    Write the Markdown of one partition in a `--markdown-workers` process.
+
+    Parameters:
+    messages (list): The CompactMessages of one person or group.
+
+    Returns:
+    int: The number of messages written.
+    """
+
+    def load_partition(filename, the_messages, reactions, the_config):
+        the_messages.extend(the_message.to_message() for the_message in messages)
+        return len(messages)
+
+    message_md.get_markdown(worker_config, load_partition, [], [])
+
+    return len(messages)
+
+def partition_key(the_message, my_slug):
+    """
+    Get the person or group whose Markdown a message is written to.
+
+    Parameters:
+    the_message (Message): A parsed message.
+    my_slug (str): The slug of the user (me).
+
+    Returns:
+    str: "groups/" and the group's slug for a group message, otherwise the
+         slug of the other person in the conversation.
+    """
+
+    if the_message.group_slug:
+        return "groups/" + the_message.group_slug
+
+    if the_message.from_slug and the_message.from_slug != my_slug:
+        return the_message.from_slug
+
+    if the_message.to_slugs:
+        return the_message.to_slugs[0]
+
+    return my_slug
+
+def partition_messages(messages, my_slug):
+    """
+    Split the messages by person or group, see `partition_key`.
+
+    Returns:
+    dict: Lists of Messages, in their original order, keyed by partition.
+    """
+
+    partitions = {}
+
+    for the_message in messages:
+        partitions.setdefault(partition_key(the_message, my_slug), []).append(the_message)
+
+    return partitions
+
+def partitioned_markdown(the_config, workers, argv, db_path, timezone_name):
+    """
+    Write the Markdown with `--markdown-workers`, each person's or group's
+    messages in a worker process.
+
+    Parameters:
+    the_config (Config): The configuration object.
+    workers (int): Number of processes including this one.
+    argv (list): The command line given to `message_md.setup`.
+    db_path (str): The `--db` path, empty for the CSV exports.
+    timezone_name (str): The `--timezone`, empty for the local one.
+
+    Returns:
+    dict: The number of messages written, keyed by partition, sorted by key.
+
+    Notes:
+    - `message_md.get_markdown` passes the messages filename to the load
+      function, so the messages are loaded and split up in there. The biggest
+      partition is kept for this process and the rest are sent to the workers
+      biggest first, so the longest one starts right away.
+    - Everything a conversation writes is under its own person or group
+      folder, so the partitions never write the same file.
+    - The messages are loaded as CompactMessages and only the partition
+      being written is turned into Message objects, here or in the worker.
+    """
+
+    futures = {}
+    counts = {}
+
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers - 1, initializer=init_markdown_worker,
+            initargs=(argv, db_path, timezone_name)) as executor:
+
+        def load_and_partition(filename, messages, reactions, the_config):
+            count = load_messages(filename, messages, reactions, the_config, compact=True)
+
+            partitions = partition_messages(messages, the_config.me.slug)
+            ordered = sorted(partitions.items(), key=lambda item: (-len(item[1]), item[0]))
+            if not ordered:
+                messages.clear()
+                return count
+
+            key, partition = ordered[0]
+            messages[:] = [the_message.to_message() for the_message in partition]
+            counts[key] = len(messages)
+
+            for key, partition in ordered[1:]:
+                futures[key] = executor.submit(render_partition, partition)
+
+            return count
+
+        with timings.stage("get_markdown") as stage:
+            message_md.get_markdown(the_config, load_and_partition, [], [])
+
+            with timings.stage("markdown workers"):
+                for key, future in futures.items():
+                    counts[key] = future.result()
+
+            stage.rows += sum(counts.values())
+
+    return dict(sorted(counts.items()))
+
+def parse_arguments(argv):
+    """
+    Pull the command line options that belong to this tool out of `argv` so
+    the remaining ones can be handed to `message_md.setup`.
+
+    Parameters:
+    argv (list): The command line, e.g. `sys.argv`.
+
+    Returns:
+    tuple: The parsed options and the command line without them.
+    """
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--db", default="", help="Read from a decrypted Signal db.sqlite instead of the CSV exports")
+    parser.add_argument("--incremental", action="store_true", help="Only convert messages added since the last --incremental run")
+    parser.add_argument("--workers", type=int, default=0, help="Read and decode the messages in this many worker processes in all")
+    parser.add_argument("--timezone", default="", help="Time zone for message times, e.g. America/Toronto, instead of the local one")
+    parser.add_argument("--timings", action="store_true", help="Report the time spent in each stage and the rows dropped")
+    parser.add_argument("--stream", action="store_true", help="Write the Markdown a window of days at a time instead of loading every message first")
+    parser.add_argument("--window-days", type=int, default=1, help="Number of days in each --stream window")
+    parser.add_argument("--lag-days", type=int, default=2, help="Days to wait for late rows before writing a --stream window")
+    parser.add_argument("--cache", action="store_true", help="Keep the parsed exports in a cache in the source folder and read them from it while they don't change")
+    parser.add_argument("--conversations", default="", help="Only convert these people or groups, comma separated slugs or conversation IDs")
+    parser.add_argument("--markdown-workers", type=int, default=0, help="Write each person's or group's Markdown in this many processes")
+
+    args, remaining = parser.parse_known_args(argv[1:])
+
+    return args, argv[:1] + remaining
+
+def main():
+
+    the_messages = []
+    the_reactions = [] 
+
+    signal_args, sys.argv = parse_arguments(sys.argv)
+
+    # the command line `message_md.setup` is given, kept for the
+    # `--markdown-workers` processes which run it again
+    argv = list(sys.argv)
+
+    # `message_md.setup` reads `-b` for its own date check but doesn't give
+    # it back, so the row filter reads it from the command line too
+    begin = row_filter.begin_from_argv(argv)
+
+    if signal_args.timezone:
+        timestamps.set_timezone(signal_args.timezone)
+
+    if signal_args.timings:
+        timings.enable()
+
+    the_config = config.Config()
+
+    if message_md.setup(the_config, markdown.YAML_SERVICE_SIGNAL):
+
+        print(f"JSON decoder: {signal_json.JSON_BACKEND}")
+
+        the_config.signal_db = signal_args.db
+        the_config.signal_workers = signal_args.workers
+
+        the_config.signal_cache = None
+        if signal_args.cache:
+            the_config.signal_cache = parse_cache.ParseCache(the_config.source_folder)
+
+        the_config.signal_watermark = None
+        if signal_args.incremental:
+            the_config.signal_watermark = watermark.Watermark(the_config.source_folder)
+            the_config.signal_watermark.load()
+
+        # load the conversation ID for each person
+        conversations.parse_conversations_file(the_config)
+
+        if signal_args.stream and signal_args.markdown_workers > 1:
+            logging.error("--markdown-workers can't be used with --stream, each window is written in this process")
+            return
+
+        conversation_ids = None
+        if signal_args.conversations:
+            if signal_args.incremental:
+                logging.error("--conversations can't be used with --incremental, the other conversations would be skipped by the next run")
+                return
+            conversation_ids = get_conversation_ids(the_config, signal_args.conversations)
+
+        the_config.signal_row_filter = row_filter.RowFilter(
+            [SIGNAL_INCOMING, SIGNAL_OUTGOING],
+            row_filter.begin_timestamp(begin) if begin else None,
+            conversation_ids)
+        
+        the_config.reversed = False
+
+        # needs to be after setup so the command line parameters override the
+        # values defined in the settings file
+        if signal_args.stream:
+            stream_markdown(the_config, max(signal_args.window_days, 1), max(signal_args.lag_days, 0))
+        elif signal_args.markdown_workers > 1:
+            counts = partitioned_markdown(
+                the_config, signal_args.markdown_workers, argv,
+                signal_args.db, signal_args.timezone)
+            print(f"Wrote {sum(counts.values())} messages for {len(counts)} people and groups")
+        else:
+            with timings.stage("get_markdown") as stage:
+                message_md.get_markdown(the_config, load_messages, the_messages, the_reactions)
+                stage.rows += len(the_messages)
+
+        # only move the watermark once the Markdown has been written
+        if the_config.signal_watermark:
+            the_config.signal_watermark.save()
+            print(f"Skipped {the_config.signal_watermark.skipped} rows converted by a previous run")
+
+        if the_config.signal_cache:
+            the_config.signal_cache.close()
+
+        if signal_args.timings:
+            print()
+            timings.current.print_table()
+            print(f"Timings saved to {timings.current.save(the_config.output_folder)}")
+
+# the guard keeps `--workers` and `--markdown-workers` processes, which import
+# this module on Windows, from running the conversion again
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,7 @@ import os
 import re
 import sys
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
@@ -29,6 +30,8 @@ import config
 import markdown
 import message_md
 
+from download_watcher import DownloadWatcher
+
 try:
     from pywinauto import Application, Desktop
     from pywinauto.keyboard import send_keys
@@ -210,6 +213,9 @@ class AutomationSettings:
     me: str = ""
     menu_key_delay_seconds: float = 0.6
     force_reprocess: bool = False
+    media_index_file: str = ""
+    dedupe_media: bool = True
+    link_index_file: str = ""
 
 
 @dataclass
@@ -222,9 +228,29 @@ class MediaRecord:
     saved_path: str
     markdown_target: str
     timestamp: str = ""
+    content_hash: str = ""
 
 
 class AutomationState:
+    """Resume state: completed slugs, failures and saved downloads.
+
+    The state lives in two files. signal_ui_state.json is a snapshot in the
+    same format older versions wrote, so an existing one loads as is, and
+    signal_ui_state.journal.jsonl holds one JSON line per change since that
+    snapshot. save() only appends the pending lines, so saving after every
+    download costs the size of that download rather than of the whole state.
+    Every COMPACT_EVERY lines, and at the end of a run, the journal is folded
+    into a new snapshot.
+
+    The journal starts with a header line carrying the snapshot generation it
+    applies to. A snapshot written by compaction has the next generation, so
+    if the run stops between replacing the snapshot and emptying the journal,
+    the stale journal is ignored instead of being applied twice, and load()
+    starts it again for the new snapshot.
+    """
+
+    COMPACT_EVERY = 500
+
     def __init__(self, path: Path):
         self.path = path
         self.data: dict[str, Any] = {
@@ -233,16 +259,100 @@ class AutomationState:
             "downloads": [],
             "updated_at": None,
         }
+        self.generation = 0
+        self.pending: list[dict[str, Any]] = []
+        self.journal_lines = 0
+        self._completed: set[str] = set()
+        self._downloads_by_slug: dict[str, list[dict[str, Any]]] = {}
+
+    @property
+    def journal_path(self) -> Path:
+        return self.path.with_name(self.path.stem + ".journal.jsonl")
+
+    def _resolve_path(self) -> None:
+        if self.path.exists() and self.path.is_dir():
+            self.path = self.path / "signal_ui_state.json"
+
+    def _reindex(self) -> None:
+        self._completed = set(self.data.setdefault("completed", []))
+        self._downloads_by_slug = {}
+        for record in self.data.setdefault("downloads", []):
+            self._downloads_by_slug.setdefault(record.get("slug"), []).append(record)
+        self.data.setdefault("failed", [])
 
     def load(self) -> None:
+        self._resolve_path()
         if self.path.exists():
             self.data = json.loads(self.path.read_text(encoding="utf-8"))
+            self.generation = int(self.data.pop("generation", 0) or 0)
+        self._reindex()
 
-    def save(self) -> None:
-        self.data["updated_at"] = datetime.now().isoformat(timespec="seconds")
-        if self.path.exists() and self.path.is_dir():
-            self.path = self.path / "signal_ui_state.json"
+        if not self.journal_path.exists():
+            return
 
+        with self.journal_path.open("r", encoding="utf-8") as journal:
+            lines = journal.read().splitlines()
+        if not lines:
+            return
+
+        try:
+            header = json.loads(lines[0])
+        except ValueError:
+            header = {}
+        if header.get("op") != "begin" or header.get("generation") != self.generation:
+            logging.info("Ignoring state journal %s; it was already compacted", self.journal_path)
+            # Start it again for this snapshot, or the changes save() appends
+            # after the stale header would be ignored by the next load too.
+            self._rewrite_journal([])
+            return
+
+        applied = lines[1:]
+        for index, line in enumerate(applied):
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # A run stopped in the middle of an append; the rest is lost.
+                logging.warning("Ignoring a partial line at the end of %s", self.journal_path)
+                applied = applied[:index]
+                # Drop it so the next append doesn't continue the broken line.
+                self._rewrite_journal(applied)
+                break
+            self._apply(entry)
+        self.journal_lines = len(applied)
+
+    def _rewrite_journal(self, lines: list[str]) -> None:
+        """Replace the journal with a header for the current snapshot and lines."""
+        lines = [json.dumps({"op": "begin", "generation": self.generation}), *lines]
+        tmp_path = self.journal_path.with_name(self.journal_path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as journal:
+            journal.write("\n".join(lines) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _apply(self, entry: dict[str, Any]) -> None:
+        op = entry.get("op")
+        if op == "completed":
+            slug = entry["slug"]
+            if slug not in self._completed:
+                self._completed.add(slug)
+                self.data["completed"].append(slug)
+        elif op == "failed":
+            self.data["failed"].append({"slug": entry["slug"], "error": entry["error"]})
+        elif op == "download":
+            record = entry["record"]
+            self.data["downloads"].append(record)
+            self._downloads_by_slug.setdefault(record.get("slug"), []).append(record)
+        if entry.get("at"):
+            self.data["updated_at"] = entry["at"]
+
+    def _record(self, entry: dict[str, Any]) -> None:
+        entry["at"] = datetime.now().isoformat(timespec="seconds")
+        self._apply(entry)
+        self.pending.append(entry)
+
+    def _ensure_parent(self) -> None:
+        self._resolve_path()
         parent = self.path.parent
         if parent.exists() and not parent.is_dir():
             raise RuntimeError(f"State file parent is not a directory: {parent}")
@@ -252,18 +362,423 @@ class AutomationState:
         except FileExistsError as exc:
             raise RuntimeError(f"Could not create state directory: {parent}") from exc
 
-        self.path.write_text(json.dumps(self.data, indent=2, ensure_ascii=False), encoding="utf-8")
+    def save(self) -> None:
+        self._ensure_parent()
+        if not self.path.exists() and not self.journal_path.exists():
+            # First save: start from a snapshot so the journal has a base.
+            self.compact()
+            return
+        if not self.pending:
+            return
+
+        lines = [json.dumps(entry, ensure_ascii=False) for entry in self.pending]
+        if not self.journal_path.exists() or self.journal_path.stat().st_size == 0:
+            lines.insert(0, json.dumps({"op": "begin", "generation": self.generation}))
+        payload = ("\n".join(lines) + "\n").encode("utf-8")
+
+        # One write on an O_APPEND descriptor, so a line is never interleaved
+        # with or split by another append.
+        fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+
+        self.journal_lines += len(self.pending)
+        self.pending = []
+        if self.journal_lines >= self.COMPACT_EVERY:
+            self.compact()
+
+    def compact(self) -> None:
+        """Write everything to a new snapshot and start an empty journal."""
+        self._ensure_parent()
+        self.generation += 1
+        self.data["updated_at"] = datetime.now().isoformat(timespec="seconds")
+
+        snapshot = dict(self.data)
+        snapshot["generation"] = self.generation
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with tmp_path.open("w", encoding="utf-8") as fh:
+            fh.write(json.dumps(snapshot, indent=2, ensure_ascii=False))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.path)
+
+        with self.journal_path.open("w", encoding="utf-8") as journal:
+            journal.write(json.dumps({"op": "begin", "generation": self.generation}) + "\n")
+        self.journal_lines = 0
+        self.pending = []
+
+    def is_completed(self, slug: str) -> bool:
+        return slug in self._completed
+
+    def completed_count(self) -> int:
+        return len(self._completed)
+
+    def downloads_for(self, slug: str) -> list[dict[str, Any]]:
+        return self._downloads_by_slug.get(slug, [])
 
     def mark_completed(self, slug: str) -> None:
-        completed = self.data.setdefault("completed", [])
-        if slug not in completed:
-            completed.append(slug)
+        if slug not in self._completed:
+            self._record({"op": "completed", "slug": slug})
 
     def mark_failed(self, slug: str, error: str) -> None:
-        self.data.setdefault("failed", []).append({"slug": slug, "error": error})
+        self._record({"op": "failed", "slug": slug, "error": error})
 
     def add_download(self, record: MediaRecord) -> None:
-        self.data.setdefault("downloads", []).append(dataclasses.asdict(record))
+        self._record({"op": "download", "record": dataclasses.asdict(record)})
+
+
+class MediaStore:
+    """Content-addressed index of the saved media, keyed by file_content_hash.
+
+    The first file saved with a given digest is the canonical copy. When the
+    same forwarded image or meme is saved again for another conversation, the
+    new file is replaced by a hardlink to the canonical copy, so every
+    conversation keeps its own media/<name> link target but the bytes are only
+    stored once. The index is persisted next to the state file so duplicates
+    are found with one lookup on later runs too.
+
+    Two files can only be the same if they have the same size, so a file
+    whose size is new to the index is recorded as unhashed and never read.
+    The full hash of it is only computed once another file of that size
+    shows up.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        self.entries: dict[str, dict[str, Any]] = {}
+        self.unhashed: dict[str, dict[str, Any]] = {}
+        self.hashed_sizes: dict[int, int] = {}
+        self.unhashed_by_size: dict[int, set[str]] = {}
+        self.dirty = False
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception as exc:
+            logging.warning("Ignoring unreadable media index %s: %s", self.path, exc)
+            return
+        if payload.get("version") != self.VERSION:
+            return
+        for digest, entry in payload.get("entries", {}).items():
+            self._put_entry(digest, entry)
+        for stored, entry in payload.get("unhashed", {}).items():
+            self._put_unhashed(stored, entry)
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"version": self.VERSION, "entries": self.entries, "unhashed": self.unhashed}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def _stored_path(self, path: Path) -> str:
+        # Relative to the output root so the index survives moving the vault.
+        try:
+            return Path(os.path.relpath(path, self.root)).as_posix()
+        except ValueError:
+            return str(path)
+
+    def _resolve(self, stored: str) -> Path:
+        path = Path(stored)
+        return path if path.is_absolute() else self.root / path
+
+    def _put_entry(self, digest: str, entry: dict[str, Any]) -> None:
+        self._pop_entry(digest)
+        self.entries[digest] = entry
+        self.hashed_sizes[entry.get("size")] = self.hashed_sizes.get(entry.get("size"), 0) + 1
+
+    def _pop_entry(self, digest: str) -> None:
+        entry = self.entries.pop(digest, None)
+        if entry is None:
+            return
+        size = entry.get("size")
+        self.hashed_sizes[size] -= 1
+        if not self.hashed_sizes[size]:
+            del self.hashed_sizes[size]
+
+    def _put_unhashed(self, stored: str, entry: dict[str, Any]) -> None:
+        self._pop_unhashed(stored)
+        self.unhashed[stored] = entry
+        self.unhashed_by_size.setdefault(entry.get("size"), set()).add(stored)
+
+    def _pop_unhashed(self, stored: str) -> dict[str, Any] | None:
+        entry = self.unhashed.pop(stored, None)
+        if entry is None:
+            return None
+        paths = self.unhashed_by_size[entry.get("size")]
+        paths.discard(stored)
+        if not paths:
+            del self.unhashed_by_size[entry.get("size")]
+        return entry
+
+    def _hash_unhashed(self, size: int) -> None:
+        # Another file of this size arrived: the unhashed ones need a digest now.
+        for stored in sorted(self.unhashed_by_size.get(size, ())):
+            entry = self._pop_unhashed(stored)
+            self.dirty = True
+            path = self._resolve(stored)
+            try:
+                stat = path.stat()
+                if stat.st_size != entry.get("size") or stat.st_mtime_ns != entry.get("mtime_ns"):
+                    continue
+                digest = file_content_hash(path)
+            except OSError:
+                continue
+            if digest not in self.entries:
+                self._put_entry(digest, dict(entry, path=stored))
+
+    def lookup(self, digest: str) -> Path | None:
+        """Return the canonical copy for digest if it is still on disk unchanged."""
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        path = self._resolve(entry["path"])
+        try:
+            stat = path.stat()
+        except OSError:
+            stat = None
+        if stat is None or stat.st_size != entry.get("size") or stat.st_mtime_ns != entry.get("mtime_ns"):
+            # Deleted or edited since it was indexed; the next copy takes over.
+            self._pop_entry(digest)
+            self.dirty = True
+            return None
+        return path
+
+    def add(self, path: Path, digest: str) -> None:
+        stat = path.stat()
+        self._pop_unhashed(self._stored_path(path))
+        self._put_entry(digest, {
+            "path": self._stored_path(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        })
+        self.dirty = True
+
+    def add_unhashed(self, path: Path) -> None:
+        stat = path.stat()
+        self._put_unhashed(self._stored_path(path), {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+        self.dirty = True
+
+    def deduplicate(self, path: Path, fingerprint: "MediaFingerprint") -> Path | None:
+        """Hardlink path to the canonical copy of its content, or make it canonical.
+
+        Returns the canonical path when path was linked to it, None when path
+        is now the canonical copy. If hardlinks are not supported (another
+        volume, FAT/exFAT) the duplicate is kept as a regular file. The full
+        hash is only computed when the index has another file of the same size.
+        """
+        if fingerprint.size not in self.hashed_sizes and fingerprint.size not in self.unhashed_by_size:
+            self.add_unhashed(path)
+            return None
+
+        self._hash_unhashed(fingerprint.size)
+        digest = fingerprint.full_hash()
+        canonical = self.lookup(digest)
+        if canonical is None:
+            self.add(path, digest)
+            return None
+
+        try:
+            if os.path.samefile(canonical, path):
+                return canonical
+        except OSError:
+            pass
+
+        tmp_path = path.with_name(path.name + ".link-tmp")
+        try:
+            if tmp_path.exists():
+                tmp_path.unlink()
+            os.link(canonical, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logging.info("Could not hardlink %s to %s, keeping the copy: %s", path, canonical, exc)
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            return None
+        return canonical
+
+
+class LinkIndex:
+    """Persisted index of the wikilinks in the Markdown output tree.
+
+    For every .md file under the downloads root the index keeps its size,
+    mtime and the WIKILINK_RE targets it contains with their offsets in the
+    text. refresh() only re-reads the files whose size or mtime changed, so
+    finding the few files that mention untitled_001.jpg no longer means
+    reading every file of the slug. Targets are also indexed by their stem,
+    matching the fallback lookup in replace_media_links.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: Path, root: Path):
+        self.path = path
+        self.root = root
+        self.files: dict[str, dict[str, Any]] = {}
+        self.by_target: dict[str, set[str]] = {}
+        self.by_stem: dict[str, set[str]] = {}
+        self.by_folder: dict[str, set[str]] = {}
+        self.dirty = False
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            payload = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception as exc:
+            logging.warning("Ignoring unreadable link index %s: %s", self.path, exc)
+            return
+        if payload.get("version") != self.VERSION:
+            return
+        for stored, entry in payload.get("files", {}).items():
+            self._put(stored, entry)
+
+    def save(self) -> None:
+        if not self.dirty:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"version": self.VERSION, "files": self.files}
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def _stored_path(self, path: str | Path) -> str:
+        try:
+            return Path(os.path.relpath(path, self.root)).as_posix()
+        except ValueError:
+            return Path(path).as_posix()
+
+    def _resolve(self, stored: str) -> Path:
+        path = Path(stored)
+        return path if path.is_absolute() else self.root / path
+
+    def _put(self, stored: str, entry: dict[str, Any]) -> None:
+        self._drop(stored)
+        self.files[stored] = entry
+        self.by_folder.setdefault(stored.rpartition("/")[0], set()).add(stored)
+        for target in entry.get("links", {}):
+            self.by_target.setdefault(target, set()).add(stored)
+            self.by_stem.setdefault(Path(target).stem, set()).add(stored)
+
+    def _drop(self, stored: str) -> None:
+        entry = self.files.pop(stored, None)
+        if entry is None:
+            return
+        folder = stored.rpartition("/")[0]
+        self.by_folder[folder].discard(stored)
+        if not self.by_folder[folder]:
+            del self.by_folder[folder]
+        for target in entry.get("links", {}):
+            for table, key in ((self.by_target, target), (self.by_stem, Path(target).stem)):
+                paths = table.get(key)
+                if paths is not None:
+                    paths.discard(stored)
+                    if not paths:
+                        del table[key]
+
+    @staticmethod
+    def scan_links(path: Path) -> dict[str, list[int]]:
+        data = path.read_bytes()
+        if b"[[" not in data:
+            return {}
+        # Offsets are into the text as rewrite_markdown_file sees it.
+        text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+        links: dict[str, list[int]] = {}
+        for match in WIKILINK_RE.finditer(text):
+            links.setdefault(match.group(2).strip(), []).append(match.start())
+        return links
+
+    def update(self, path: Path, stat: os.stat_result | None = None) -> None:
+        """(Re)index one file, e.g. right after it was rewritten."""
+        if stat is None:
+            stat = path.stat()
+        try:
+            links = self.scan_links(path)
+        except (OSError, UnicodeDecodeError) as exc:
+            logging.warning("Could not index links in %s: %s", path, exc)
+            links = {}
+        self._put(self._stored_path(path), {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "links": links})
+        self.dirty = True
+
+    def refresh(self, root: Path) -> int:
+        """Bring the entries under root up to date; returns the files re-read."""
+        prefix = self._stored_path(root)
+        prefix = "" if prefix == "." else prefix + "/"
+        seen: set[str] = set()
+        rescanned = 0
+
+        # scandir rather than os.walk: on Windows the stat comes with the
+        # directory listing, and the stored names are built without relpath.
+        pending: list[tuple[str, str]] = [(str(root), prefix)]
+        while pending:
+            folder, stored_folder = pending.pop()
+            try:
+                entries = list(os.scandir(folder))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append((entry.path, stored_folder + entry.name + "/"))
+                    continue
+                if not os.path.normcase(entry.name).endswith(".md"):
+                    continue
+                stored = stored_folder + entry.name
+                seen.add(stored)
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                known = self.files.get(stored)
+                if known is not None and known.get("size") == stat.st_size and known.get("mtime_ns") == stat.st_mtime_ns:
+                    continue
+                self.update(Path(entry.path), stat)
+                rescanned += 1
+
+        # Drop the files that are gone, looking only at the folders under root.
+        stale = [
+            stored
+            for folder, names in self.by_folder.items()
+            if (folder + "/").startswith(prefix)
+            for stored in names
+            if stored not in seen
+        ]
+        for stored in stale:
+            self._drop(stored)
+            self.dirty = True
+
+        return rescanned
+
+    def files_referencing(self, keys: Iterable[str], root: Path | None = None) -> list[Path]:
+        """Files with a wikilink whose target, or its stem, is one of keys."""
+        prefix = ""
+        if root is not None:
+            prefix = self._stored_path(root)
+            prefix = "" if prefix == "." else prefix + "/"
+        found: set[str] = set()
+        for key in keys:
+            found.update(self.by_target.get(key, ()))
+            found.update(self.by_stem.get(key, ()))
+        return [self._resolve(stored) for stored in sorted(found) if stored.startswith(prefix)]
+
+    def references(self, target: str) -> list[tuple[Path, list[int]]]:
+        """The files linking to target and the offsets of those links."""
+        return [
+            (self._resolve(stored), self.files[stored]["links"][target])
+            for stored in sorted(self.by_target.get(target, ()))
+        ]
 
 
 def _is_default_arg(args: argparse.Namespace, name: str) -> bool:
@@ -279,6 +794,8 @@ def _is_default_arg(args: argparse.Namespace, name: str) -> bool:
         "downloads_root": "",
         "state_file": "",
         "log_file": "",
+        "media_index_file": "",
+        "link_index_file": "",
         "save_shortcut": "ctrl+shift+s",
         "next_item_shortcut": "pagedown",
         "targets": "",
@@ -411,6 +928,8 @@ def apply_json_config(args: argparse.Namespace) -> argparse.Namespace:
     _set_if_default(args, "downloads_root", ui.get("downloads_root") or ui.get("downloads-root"))
     _set_if_default(args, "state_file", ui.get("state_file") or ui.get("state-file"))
     _set_if_default(args, "log_file", ui.get("log_file") or ui.get("log-file"))
+    _set_if_default(args, "media_index_file", ui.get("media_index_file") or ui.get("media-index-file"))
+    _set_if_default(args, "link_index_file", ui.get("link_index_file") or ui.get("link-index-file"))
     _set_if_default(args, "save_shortcut", ui.get("save_shortcut") or ui.get("save-shortcut"))
     _set_if_default(args, "next_item_shortcut", ui.get("next_item_shortcut") or ui.get("next-item-shortcut"))
     _set_if_default(args, "targets", ui.get("targets"))
@@ -759,12 +1278,6 @@ def ensure_media_folder(output_root: Path, target_or_slug: Any, create: bool = F
     return media_dir
 
 
-def snapshot_files(folder: Path) -> set[Path]:
-    if not folder.exists():
-        return set()
-    return {path for path in folder.iterdir() if path.is_file()}
-
-
 def file_content_hash(path: Path) -> str:
     h = hashlib.sha256()
     with path.open("rb") as fh:
@@ -773,27 +1286,101 @@ def file_content_hash(path: Path) -> str:
     return h.hexdigest()
 
 
-def wait_for_new_file(folder: Path, before: set[Path], timeout: float, poll_interval: float) -> Path:
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        current = snapshot_files(folder)
-        created = sorted(current - before, key=lambda path: path.stat().st_mtime, reverse=True)
-        if created:
-            return created[0]
-        time.sleep(poll_interval)
-    raise TimeoutError(f"No new file appeared in {folder} within {timeout} seconds")
+SAMPLE_BLOCK_SIZE = 65536
 
 
-def unique_path(path: Path) -> Path:
-    if not path.exists():
-        return path
+@dataclass
+class MediaFingerprint:
+    """Size and sampled digest of a saved file, with the full hash on demand.
+
+    The sample is the SHA-256 of the size and a block at the head, middle and
+    tail of the file. A file no bigger than three blocks is read whole, and
+    then the sample is its file_content_hash.
+    """
 
-    for index in range(2, 10000):
-        candidate = path.with_name(f"{path.stem}_{index:03d}{path.suffix}")
-        if not candidate.exists():
-            return candidate
+    path: Path
+    size: int
+    sample: str
+    full: str = ""
 
-    raise FileExistsError(f"Could not find an unused filename for {path}")
+    def full_hash(self) -> str:
+        if not self.full:
+            self.full = file_content_hash(self.path)
+        return self.full
+
+
+def media_fingerprint(path: Path) -> MediaFingerprint:
+    with path.open("rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size <= 3 * SAMPLE_BLOCK_SIZE:
+            digest = hashlib.sha256(fh.read()).hexdigest()
+            return MediaFingerprint(path, size, digest, digest)
+        h = hashlib.sha256(str(size).encode("ascii"))
+        for offset in (0, (size - SAMPLE_BLOCK_SIZE) // 2, size - SAMPLE_BLOCK_SIZE):
+            fh.seek(offset)
+            h.update(fh.read(SAMPLE_BLOCK_SIZE))
+    return MediaFingerprint(path, size, h.hexdigest())
+
+
+def same_media(previous: MediaFingerprint, current: MediaFingerprint) -> bool:
+    # Cheapest check first; the full hashes are only read when size and
+    # samples agree, i.e. almost only for the real end-of-media duplicate.
+    if previous.size != current.size or previous.sample != current.sample:
+        return False
+    return previous.full_hash() == current.full_hash()
+
+
+@dataclass
+class MediaCheck:
+    fingerprint: MediaFingerprint | None
+    duplicate: bool = False
+    canonical: Path | None = None
+
+
+class MediaChecker:
+    """Compares each saved media file with the one saved before it, off the UI thread.
+
+    submit() returns right after the save so the UI loop can move to the
+    previous media item while the file is fingerprinted. One worker thread
+    runs the checks in save order, and it is the only thing that touches
+    the MediaStore until close().
+    """
+
+    def __init__(self, media_store: MediaStore | None = None):
+        self.media_store = media_store
+        self.previous: MediaFingerprint | None = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def submit(self, path: Path) -> Future[MediaCheck]:
+        return self.executor.submit(self._check, path)
+
+    def _check(self, path: Path) -> MediaCheck:
+        try:
+            fingerprint = media_fingerprint(path)
+        except Exception:
+            self.previous = None
+            return MediaCheck(None)
+
+        try:
+            duplicate = self.previous is not None and same_media(self.previous, fingerprint)
+        except Exception:
+            duplicate = False
+        if duplicate:
+            return MediaCheck(fingerprint, duplicate=True)
+        self.previous = fingerprint
+
+        # The same forwarded media saved for another conversation becomes a
+        # hardlink to the first copy instead of a second copy on disk.
+        canonical = None
+        if self.media_store is not None:
+            try:
+                canonical = self.media_store.deduplicate(path, fingerprint)
+            except Exception as exc:
+                logging.warning("Media deduplication failed for %s: %s", path, exc)
+        return MediaCheck(fingerprint, canonical=canonical)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
 
 
 def build_preserved_download_name(desired_name: str, original_name: str) -> str:
@@ -823,12 +1410,18 @@ def render_media_link(record: MediaRecord) -> str:
     return f"![[{target}|{media_wikilink_width(record.saved_filename)}]]"
 
 
-def replace_media_links(text: str, records: Iterable[MediaRecord]) -> str:
+def build_media_link_table(records: Iterable[MediaRecord]) -> dict[str, MediaRecord]:
     records_by_key: dict[str, MediaRecord] = {}
     for record in records:
         records_by_key[record.source_label] = record
         records_by_key[record.saved_filename] = record
         records_by_key[Path(record.saved_filename).stem] = record
+    return records_by_key
+
+
+def replace_media_links(text: str, records: Iterable[MediaRecord], records_by_key: dict[str, MediaRecord] | None = None) -> str:
+    if records_by_key is None:
+        records_by_key = build_media_link_table(records)
 
     def replace_match(match: re.Match[str]) -> str:
         bang = match.group(1)
@@ -864,23 +1457,149 @@ def markdown_root_candidates(output_root: Path, slug: str, target: Any | None =
     return unique
 
 
-def update_markdown_files(output_root: Path, slug: str, records: list[MediaRecord], target: Any | None = None) -> list[Path]:
-    slug_root = next((candidate for candidate in markdown_root_candidates(output_root, slug, target) if candidate.exists()), None)
-    if slug_root is None:
+def markdown_slug_root(output_root: Path, slug: str, target: Any | None = None) -> Path | None:
+    return next((candidate for candidate in markdown_root_candidates(output_root, slug, target) if candidate.exists()), None)
+
+
+def write_text_atomic(path: Path, text: str) -> None:
+    # Not *.md, so a concurrent scan never picks up the half-written file.
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with tmp_path.open("w", encoding="utf-8") as fh:
+        fh.write(text)
+    os.replace(tmp_path, path)
+
+
+def rewrite_markdown_file(path: Path, tables: list[dict[str, MediaRecord]]) -> bool:
+    data = path.read_bytes()
+    # Almost every file has no wikilink at all; skip those before decoding.
+    if b"[[" not in data:
+        return False
+
+    # Same newline handling as Path.read_text.
+    original = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+    updated = original
+    for records_by_key in tables:
+        updated = replace_media_links(updated, (), records_by_key)
+    if updated == original:
+        return False
+
+    write_text_atomic(path, updated)
+    return True
+
+
+def rewrite_markdown_roots(root_tables: dict[Path, list[tuple[int, dict[str, MediaRecord]]]], workers: int | None = None, link_index: LinkIndex | None = None) -> list[Path]:
+    """Rewrite the media links of every Markdown file under the given roots.
+
+    root_tables maps a slug root to its (order, lookup table) pairs. Each
+    tree is walked once; a file gets the tables of every root it is under,
+    applied in order, the same as rewriting one slug after another. Files are
+    read, rewritten and written by a thread pool. With a link_index only the
+    files linking to one of the records are read.
+    """
+    tables_by_dir: dict[str, list[tuple[int, dict[str, MediaRecord]]]] = {}
+    roots_by_dir: dict[str, Path] = {}
+    for root, tables in root_tables.items():
+        key = os.path.normcase(os.path.abspath(root))
+        tables_by_dir.setdefault(key, []).extend(tables)
+        roots_by_dir.setdefault(key, root)
+
+    # Roots inside another root are covered by walking the outer one.
+    tops = [
+        key for key in tables_by_dir
+        if not any(other != key and key.startswith(other.rstrip(os.sep) + os.sep) for other in tables_by_dir)
+    ]
+
+    if link_index is not None:
+        return rewrite_indexed_markdown(link_index, tables_by_dir, roots_by_dir, tops, workers)
+
+    jobs: list[tuple[Path, list[dict[str, MediaRecord]]]] = []
+    for top in sorted(tops):
+        inherited: dict[str, list[tuple[int, dict[str, MediaRecord]]]] = {}
+        for dirpath, dirnames, filenames in os.walk(roots_by_dir[top]):
+            key = os.path.normcase(os.path.abspath(dirpath))
+            tables = inherited.get(os.path.dirname(key), []) + tables_by_dir.get(key, [])
+            inherited[key] = tables
+            ordered = [table for _, table in sorted(tables, key=lambda item: item[0])]
+            for name in filenames:
+                if os.path.normcase(name).endswith(".md"):
+                    jobs.append((Path(dirpath) / name, ordered))
+
+    return run_markdown_jobs(jobs, workers)
+
+
+def run_markdown_jobs(jobs: list[tuple[Path, list[dict[str, MediaRecord]]]], workers: int | None = None) -> list[Path]:
+    if not jobs:
         return []
 
-    changed: list[Path] = []
-    markdown_files = sorted(slug_root.rglob("*.md"))
-    for markdown_file in markdown_files:
-        original = markdown_file.read_text(encoding="utf-8")
-        updated = replace_media_links(original, records)
-        if updated != original:
-            markdown_file.write_text(updated, encoding="utf-8")
-            changed.append(markdown_file)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lambda job: rewrite_markdown_file(*job), jobs))
+
+    return sorted(path for (path, _), changed in zip(jobs, results) if changed)
 
+
+def rewrite_indexed_markdown(
+    link_index: LinkIndex,
+    tables_by_dir: dict[str, list[tuple[int, dict[str, MediaRecord]]]],
+    roots_by_dir: dict[str, Path],
+    tops: list[str],
+    workers: int | None = None,
+) -> list[Path]:
+    """rewrite_markdown_roots for the files the link index says need it.
+
+    A file that links to none of the keys of any table is left as it is by
+    all of them, so only the referencing files are read. Those still get
+    every table of every root they are under, in order.
+    """
+    for top in tops:
+        link_index.refresh(roots_by_dir[top])
+
+    candidates: set[Path] = set()
+    for root_key, tables in tables_by_dir.items():
+        for _, table in tables:
+            candidates.update(link_index.files_referencing(table, roots_by_dir[root_key]))
+
+    jobs: list[tuple[Path, list[dict[str, MediaRecord]]]] = []
+    for path in sorted(candidates):
+        # The tables of every root above the file, found by walking up.
+        tables: list[tuple[int, dict[str, MediaRecord]]] = []
+        folder = os.path.normcase(os.path.abspath(path))
+        while True:
+            parent = os.path.dirname(folder)
+            if parent == folder:
+                break
+            folder = parent
+            tables.extend(tables_by_dir.get(folder, ()))
+        jobs.append((path, [table for _, table in sorted(tables, key=lambda item: item[0])]))
+
+    changed = run_markdown_jobs(jobs, workers)
+    for path in changed:
+        link_index.update(path)
     return changed
 
 
+def update_markdown_files(output_root: Path, slug: str, records: list[MediaRecord], target: Any | None = None, link_index: LinkIndex | None = None) -> list[Path]:
+    slug_root = markdown_slug_root(output_root, slug, target)
+    if slug_root is None:
+        return []
+
+    return rewrite_markdown_roots({slug_root: [(0, build_media_link_table(records))]}, link_index=link_index)
+
+
+def update_manifest_markdown(output_root: Path, records: Iterable[MediaRecord], workers: int | None = None, link_index: LinkIndex | None = None) -> list[Path]:
+    """Rewrite the links for every slug in the manifest in one pass."""
+    grouped: dict[str, list[MediaRecord]] = {}
+    for record in records:
+        grouped.setdefault(record.slug, []).append(record)
+
+    root_tables: dict[Path, list[tuple[int, dict[str, MediaRecord]]]] = {}
+    for order, (slug, slug_records) in enumerate(grouped.items()):
+        slug_root = markdown_slug_root(output_root, slug)
+        if slug_root is not None:
+            root_tables.setdefault(slug_root, []).append((order, build_media_link_table(slug_records)))
+
+    return rewrite_markdown_roots(root_tables, workers, link_index)
+
+
 def flatten_people(the_config: config.Config) -> list[Any]:
     targets: list[Any] = []
     for item in getattr(the_config, "people", []):
@@ -896,6 +1615,24 @@ class SignalUiDriver:
         self.app = None
         self.window = None
         self._seen_message_keys: set[tuple[int, int, int, int]] = set()
+        self._download_watcher: DownloadWatcher | None = None
+
+    def download_watcher(self, folder: Path) -> DownloadWatcher:
+        # One watcher at a time: a conversation saves everything into its own
+        # media folder, so the index is rebuilt only when the folder changes.
+        if self._download_watcher is not None and self._download_watcher.folder == folder:
+            return self._download_watcher
+        self.close_download_watcher()
+        watcher = DownloadWatcher(folder, self.settings.poll_interval_seconds)
+        watcher.start()
+        logging.info("Watching %s for downloads (%s)", folder, watcher.backend)
+        self._download_watcher = watcher
+        return watcher
+
+    def close_download_watcher(self) -> None:
+        if self._download_watcher is not None:
+            self._download_watcher.close()
+            self._download_watcher = None
 
     def launch(self) -> None:
         signal_exe = self.settings.signal_exe or self.discover_signal_exe()
@@ -1537,7 +2274,8 @@ class SignalUiDriver:
         # Save dialog. Returns the renamed saved file path.
         destination_dir = destination_dir.resolve()
         destination_dir.mkdir(parents=True, exist_ok=True)
-        before = snapshot_files(destination_dir)
+        watcher = self.download_watcher(destination_dir)
+        mark = watcher.mark()
 
         # Start from a clean slate: close any Save dialogs left open by a prior
         # failed attempt so we never drive a stale/background dialog and never
@@ -1555,12 +2293,7 @@ class SignalUiDriver:
         except RuntimeError as exc:
             raise TimeoutError(str(exc)) from exc
 
-        created = wait_for_new_file(
-            destination_dir,
-            before,
-            self.settings.attachment_wait_seconds,
-            self.settings.poll_interval_seconds,
-        )
+        created = watcher.wait_for_new_file(mark, self.settings.attachment_wait_seconds)
         target = destination_dir / build_preserved_download_name(desired_name, created.name)
         # Preserve the REAL extension from the file Signal actually wrote (e.g.
         # .jpg/.jpeg/.mp4/.mov) if the original name was not available.
@@ -1568,8 +2301,10 @@ class SignalUiDriver:
             target = target.with_suffix(created.suffix)
         if same_filesystem_path(created, target):
             return created
-        target = unique_path(target)
+        target = watcher.unique_path(target)
         created.rename(target)
+        watcher.remove(created)
+        watcher.add(target)
         return target
 
     def _open_media_item_menu(self) -> bool:
@@ -1952,7 +2687,7 @@ class SignalUiDriver:
         # selection); typing "<folder>\" turns "IMG_0081.jpg" into
         # "<folder>\IMG_0081.jpg". This preserves the ORIGINAL name + extension
         # (important for videos vs images) without having to read the field, then
-        # Enter saves it. wait_for_new_file + rename handle the final name.
+        # Enter saves it. The download watcher + rename handle the final name.
         folder_prefix = str(destination_dir)
         if not folder_prefix.endswith("\\"):
             folder_prefix += "\\"
@@ -2280,7 +3015,8 @@ class SignalUiDriver:
 
     def save_current_attachment(self, destination_dir: Path, desired_name: str) -> Path:
         destination_dir.mkdir(parents=True, exist_ok=True)
-        before = snapshot_files(destination_dir)
+        watcher = self.download_watcher(destination_dir)
+        mark = watcher.mark()
 
         if not self._trigger_download_from_message_context():
             raise TimeoutError("Could not open Save from media view")
@@ -2291,11 +3027,15 @@ class SignalUiDriver:
         except RuntimeError as exc:
             raise TimeoutError(str(exc)) from exc
 
-        created = wait_for_new_file(destination_dir, before, self.settings.attachment_wait_seconds, self.settings.poll_interval_seconds)
+        created = watcher.wait_for_new_file(mark, self.settings.attachment_wait_seconds)
         target = destination_dir / desired_name
-        if target.exists():
-            target.unlink()
-        created.rename(target)
+        if same_filesystem_path(created, target):
+            return created
+        # Replace in one step: deleting target first would report it as gone
+        # and then as a new download once created is renamed onto it.
+        os.replace(created, target)
+        watcher.remove(created)
+        watcher.add(target)
         return target
 
     def go_to_next_media(self) -> None:
@@ -2398,6 +3138,9 @@ def build_arg_parser() -> argparse.ArgumentParser:
     parser.add_argument("--targets", default="", help="Comma-separated slug list to limit the run")
     parser.add_argument("--force-reprocess", action="store_true", help="Process matching conversations even when their slug is already marked completed in the state file")
     parser.add_argument("--manifest-only", action="store_true", help="Only update markdown from the saved manifest")
+    parser.add_argument("--media-index-file", default="", help="Content hash index used to hardlink media saved more than once")
+    parser.add_argument("--no-media-dedupe", action="store_true", help="Keep every saved media file as its own copy instead of hardlinking duplicates")
+    parser.add_argument("--link-index-file", default="", help="Index of the wikilinks in the markdown files, used to only rewrite the files that link to new media")
     parser.add_argument("--traceback", action="store_true", help="Show full traceback on errors")
 
     return parser
@@ -2493,6 +3236,9 @@ def resolve_paths(args: argparse.Namespace, the_config: config.Config) -> Automa
     if not log_file.suffix:
         log_file = log_file / "signal_ui_failures.log"
 
+    media_index_file = Path(args.media_index_file) if args.media_index_file else state_file.with_name("signal_media_index.json")
+    link_index_file = Path(args.link_index_file) if args.link_index_file else state_file.with_name("signal_link_index.json")
+
     return AutomationSettings(
         signal_exe=args.signal_exe,
         window_title=args.window_title,
@@ -2520,6 +3266,9 @@ def resolve_paths(args: argparse.Namespace, the_config: config.Config) -> Automa
         mouse_move_duration_seconds=args.mouse_move_duration_seconds,
         me=args.me,
         force_reprocess=args.force_reprocess,
+        media_index_file=str(media_index_file),
+        dedupe_media=not args.no_media_dedupe,
+        link_index_file=str(link_index_file),
     )
 
 
@@ -2535,13 +3284,36 @@ def iter_targets(the_config: config.Config, wanted_targets: set[str] | None = No
     return result
 
 
-def process_target(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, target: Any, activate_target: bool = True) -> list[MediaRecord]:
+def load_media_store(settings: AutomationSettings) -> MediaStore | None:
+    if not settings.dedupe_media or not settings.media_index_file:
+        return None
+    store = MediaStore(Path(settings.media_index_file), Path(settings.downloads_root))
+    store.load()
+    return store
+
+
+def load_link_index(path: Path, root: Path) -> LinkIndex:
+    link_index = LinkIndex(path, root)
+    link_index.load()
+    return link_index
+
+
+def save_link_index(link_index: LinkIndex | None) -> None:
+    if link_index is None:
+        return
+    try:
+        link_index.save()
+    except Exception as exc:
+        logging.warning("Could not save link index %s: %s", link_index.path, exc)
+
+
+def process_target(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, target: Any, activate_target: bool = True, media_store: MediaStore | None = None, link_index: LinkIndex | None = None) -> list[MediaRecord]:
     slug = getattr(target, "slug", "unknown") or "unknown"
     aliases = build_target_aliases(target)
     label = aliases[0]
     logging.info("Processing %s (%s)", label, slug)
 
-    existing_records = [record for record in state.data.get("downloads", []) if record.get("slug") == slug]
+    existing_records = state.downloads_for(slug)
     resume_from = len(existing_records)
 
     if settings.dry_run:
@@ -2578,62 +3350,70 @@ def process_target(driver: SignalUiDriver, settings: AutomationSettings, state:
     driver.enter_media_tab_and_open_first()
 
     records: list[MediaRecord] = []
-    last_hash: str | None = None
+    checker = MediaChecker(media_store)
     index = 0
-    while index < settings.max_attachments_per_conversation:
-        index += 1
-        desired_name = f"untitled_{index:03d}.jpg"
+    try:
+        while index < settings.max_attachments_per_conversation:
+            index += 1
+            desired_name = f"untitled_{index:03d}.jpg"
 
-        saved_path = None
-        for attempt in range(1, 4):
-            try:
-                logging.info("Saving %s media item %d attempt %d", slug, index, attempt)
-                saved_path = driver.save_media_preview_item(media_dir, desired_name)
-                break
-            except TimeoutError as exc:
-                logging.warning("Save attempt %d failed for %s item %d: %s", attempt, slug, index, exc)
-                if attempt < 3:
-                    time.sleep(0.5)
-                    continue
-                logging.info("No Save dialog for %s item %d; assuming end of media", slug, index)
-                break
+            saved_path = None
+            for attempt in range(1, 4):
+                try:
+                    logging.info("Saving %s media item %d attempt %d", slug, index, attempt)
+                    saved_path = driver.save_media_preview_item(media_dir, desired_name)
+                    break
+                except TimeoutError as exc:
+                    logging.warning("Save attempt %d failed for %s item %d: %s", attempt, slug, index, exc)
+                    if attempt < 3:
+                        time.sleep(0.5)
+                        continue
+                    logging.info("No Save dialog for %s item %d; assuming end of media", slug, index)
+                    break
 
-        if saved_path is None:
-            break
+            if saved_path is None:
+                break
 
-        # End-of-media detection: if Left arrow no longer moves, Ctrl+S re-saves
-        # the same item. A byte-identical file means we have already captured it.
-        try:
-            current_hash = file_content_hash(saved_path)
-        except Exception:
-            current_hash = None
-        if current_hash is not None and current_hash == last_hash:
-            logging.info("Duplicate media item detected for %s; reached end of media", slug)
+            # End-of-media detection: if Left arrow no longer moves, Ctrl+S re-saves
+            # the same item. The checker compares it with the previous file in the
+            # background (size, then sampled digest, then full hash) while Left
+            # arrow moves to the previous (older) media item for the next save.
+            pending = checker.submit(saved_path)
             try:
-                saved_path.unlink()
+                driver.previous_media_item()
+                moved = True
             except Exception:
-                pass
-            break
-        last_hash = current_hash
-
-        record = MediaRecord(
-            slug=slug,
-            label=label,
-            media_kind="image",
-            source_label=source_label_from_saved_name(slug, saved_path.name),
-            saved_filename=saved_path.name,
-            saved_path=str(saved_path),
-            markdown_target=f"media/{saved_path.name}",
-        )
-        records.append(record)
-        state.add_download(record)
-        state.save()
+                moved = False
 
-        # Move to the previous (older) media item for the next save.
-        try:
-            driver.previous_media_item()
-        except Exception:
-            break
+            check = pending.result()
+            if check.duplicate:
+                logging.info("Duplicate media item detected for %s; reached end of media", slug)
+                try:
+                    saved_path.unlink()
+                except Exception:
+                    pass
+                break
+            if check.canonical is not None:
+                logging.info("%s is a duplicate of %s; hardlinked", saved_path, check.canonical)
+
+            record = MediaRecord(
+                slug=slug,
+                label=label,
+                media_kind="image",
+                source_label=source_label_from_saved_name(slug, saved_path.name),
+                saved_filename=saved_path.name,
+                saved_path=str(saved_path),
+                markdown_target=f"media/{saved_path.name}",
+                content_hash=check.fingerprint.full if check.fingerprint is not None else "",
+            )
+            records.append(record)
+            state.add_download(record)
+            state.save()
+
+            if not moved:
+                break
+    finally:
+        checker.close()
 
     # Leave the media preview cleanly before moving to the next conversation.
     try:
@@ -2650,17 +3430,25 @@ def process_target(driver: SignalUiDriver, settings: AutomationSettings, state:
         driver.close_open_panels()
     except Exception:
         pass
+    driver.close_download_watcher()
 
-    changed = update_markdown_files(Path(settings.downloads_root), slug, records, target)
+    changed = update_markdown_files(Path(settings.downloads_root), slug, records, target, link_index)
     if changed:
         logging.info("Updated %d markdown files for %s", len(changed), slug)
+    save_link_index(link_index)
+
+    if media_store is not None:
+        try:
+            media_store.save()
+        except Exception as exc:
+            logging.warning("Could not save media index %s: %s", media_store.path, exc)
 
     state.mark_completed(slug)
     state.save()
     return records
 
 
-def process_signal_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any]) -> int:
+def process_signal_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any], media_store: MediaStore | None = None, link_index: LinkIndex | None = None) -> int:
     labels = driver.get_visible_conversation_labels(settings.max_conversations)
     if not labels:
         logging.warning("No visible Signal conversations found")
@@ -2678,12 +3466,12 @@ def process_signal_first(driver: SignalUiDriver, settings: AutomationSettings, s
             continue
 
         slug = getattr(target, "slug", "unknown") or "unknown"
-        if slug in set(state.data.get("completed", [])) and not settings.force_reprocess:
+        if state.is_completed(slug) and not settings.force_reprocess:
             logging.info("Skipping completed target %s", slug)
             continue
 
         try:
-            process_target(driver, settings, state, target)
+            process_target(driver, settings, state, target, media_store=media_store, link_index=link_index)
             processed += 1
         except Exception as exc:
             logging.exception("Failed processing %s from conversation '%s'", slug, label)
@@ -2695,7 +3483,7 @@ def process_signal_first(driver: SignalUiDriver, settings: AutomationSettings, s
     return processed
 
 
-def process_shortcut_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any]) -> int:
+def process_shortcut_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any], media_store: MediaStore | None = None, link_index: LinkIndex | None = None) -> int:
     if not targets:
         logging.warning("No configured targets to process in shortcut-first mode")
         return 0
@@ -2793,11 +3581,11 @@ def process_shortcut_first(driver: SignalUiDriver, settings: AutomationSettings,
                 slug = getattr(target, "slug", "unknown") or "unknown"
                 logging.info("Slot %d header '%s' matched person %s", idx, title, slug)
 
-            if slug in set(state.data.get("completed", [])) and not settings.force_reprocess:
+            if state.is_completed(slug) and not settings.force_reprocess:
                 logging.info("Skipping completed target %s before opening media; use a fresh --state-file or remove it from completed to reprocess", slug)
                 continue
 
-            process_target(driver, settings, state, target, activate_target=False)
+            process_target(driver, settings, state, target, activate_target=False, media_store=media_store, link_index=link_index)
             processed += 1
         except Exception as exc:
             logging.exception("Failed processing %s from shortcut slot %d", slug, idx)
@@ -2809,15 +3597,15 @@ def process_shortcut_first(driver: SignalUiDriver, settings: AutomationSettings,
     return processed
 
 
-def process_config_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any]) -> int:
+def process_config_first(driver: SignalUiDriver, settings: AutomationSettings, state: AutomationState, targets: list[Any], media_store: MediaStore | None = None, link_index: LinkIndex | None = None) -> int:
     processed = 0
     for target in targets:
         slug = getattr(target, "slug", "unknown") or "unknown"
-        if slug in set(state.data.get("completed", [])) and not settings.force_reprocess:
+        if state.is_completed(slug) and not settings.force_reprocess:
             logging.info("Skipping completed target %s", slug)
             continue
         try:
-            process_target(driver, settings, state, target)
+            process_target(driver, settings, state, target, media_store=media_store, link_index=link_index)
             processed += 1
         except Exception as exc:
             logging.exception("Failed processing %s", slug)
@@ -2842,12 +3630,11 @@ def main() -> int:
         state = AutomationState(state_path)
         state.load()
         all_records = [MediaRecord(**record) for record in state.data.get("downloads", [])]
-        grouped: dict[str, list[MediaRecord]] = {}
-        for record in all_records:
-            grouped.setdefault(record.slug, []).append(record)
-        for slug, records in grouped.items():
-            update_markdown_files(downloads_root, slug, records)
-        state.save()
+        link_index = load_link_index(Path(args.link_index_file or state_path.with_name("signal_link_index.json")), downloads_root)
+        changed = update_manifest_markdown(downloads_root, all_records, link_index=link_index)
+        logging.info("Updated %d markdown files from the manifest", len(changed))
+        save_link_index(link_index)
+        state.compact()
         return 0
 
     the_config = load_the_config(args)
@@ -2862,7 +3649,7 @@ def main() -> int:
 
     wanted_targets = {slug.strip() for slug in args.targets.split(',') if slug.strip()} or None
     targets = iter_targets(the_config, wanted_targets)
-    completed_count = len(set(state.data.get("completed", [])))
+    completed_count = state.completed_count()
     logging.info(
         "Run settings: scan_order=%s shortcut_slots=%d max_attachments=%d force_reprocess=%s targets_filter=%s matched_targets=%d state_file=%s completed=%d",
         settings.scan_order,
@@ -2886,39 +3673,47 @@ def main() -> int:
 
     if args.manifest_only:
         all_records = [MediaRecord(**record) for record in state.data.get("downloads", [])]
-        grouped: dict[str, list[MediaRecord]] = {}
-        for record in all_records:
-            grouped.setdefault(record.slug, []).append(record)
-        for slug, records in grouped.items():
-            update_markdown_files(Path(settings.downloads_root), slug, records)
-        state.save()
+        link_index = load_link_index(Path(settings.link_index_file), Path(settings.downloads_root))
+        changed = update_manifest_markdown(Path(settings.downloads_root), all_records, link_index=link_index)
+        logging.info("Updated %d markdown files from the manifest", len(changed))
+        save_link_index(link_index)
+        state.compact()
         return 0
 
+    media_store = None if settings.dry_run else load_media_store(settings)
+    link_index = None if settings.dry_run else load_link_index(Path(settings.link_index_file), Path(settings.downloads_root))
+
     if settings.scan_order == "shortcut-first" and not settings.dry_run:
-        processed = process_shortcut_first(driver, settings, state, targets)
+        processed = process_shortcut_first(driver, settings, state, targets, media_store, link_index)
         if processed == 0 and settings.allow_config_fallback:
             logging.warning("Shortcut-first mode did not process any targets; falling back to config-first mode")
-            process_config_first(driver, settings, state, targets)
+            process_config_first(driver, settings, state, targets, media_store, link_index)
         elif processed == 0:
             logging.warning(
                 "Shortcut-first mode processed 0 targets. Not falling back to config-first unless --allow-config-fallback is set."
             )
     elif settings.scan_order == "signal-first" and not settings.dry_run:
-        processed = process_signal_first(driver, settings, state, targets)
+        processed = process_signal_first(driver, settings, state, targets, media_store, link_index)
         if processed == 0 and settings.allow_config_fallback:
             logging.warning("Signal-first mode did not process any targets; falling back to config-first mode")
-            process_config_first(driver, settings, state, targets)
+            process_config_first(driver, settings, state, targets, media_store, link_index)
         elif processed == 0:
             logging.warning(
                 "Signal-first mode processed 0 targets. Not falling back to config-first unless --allow-config-fallback is set."
             )
     else:
-        process_config_first(driver, settings, state, targets)
+        process_config_first(driver, settings, state, targets, media_store, link_index)
 
     try:
         state.save()
+        state.compact()
     except Exception as exc:
         logging.error("Final state save failed: %s", exc)
+    if media_store is not None:
+        try:
+            media_store.save()
+        except Exception as exc:
+            logging.error("Final media index save failed: %s", exc)
     return 0
 
 
@@ -0,0 +1,449 @@
+# -----------------------------------------------------------------------------
+#
+# Generate a made up Signal export so `signal_sqlite_md.py` can be measured
+# at scale without anybody's private messages.
+#
+# Writes the three CSV files that DB Browser for SQLite exports, with the same
+# columns, along with the `people.json` and `groups.json` config that go with
+# them:
+#
+#   <folder>/source/messages.csv
+#   <folder>/source/conversations.csv
+#   <folder>/source/message_attachments.csv
+#   <folder>/config/people.json
+#   <folder>/config/groups.json
+#
+# The same seed always generates the same files. The messages have group
+# chats, reactions, quotes, links with tracking parameters, attachments and
+# a share of rows that aren't "incoming" or "outgoing" messages.
+#
+# Usage:
+#
+#   python3 synthetic_export.py ../../synthetic -n 100000
+#
+# -----------------------------------------------------------------------------
+
+import argparse
+import csv
+import json
+import os
+import random
+import uuid
+
+MESSAGES_FILENAME = "messages.csv"
+CONVERSATIONS_FILENAME = "conversations.csv"
+ATTACHMENTS_FILENAME = "message_attachments.csv"
+PEOPLE_FILENAME = "people.json"
+GROUPS_FILENAME = "groups.json"
+
+SOURCE_FOLDER = "source"
+CONFIG_FOLDER = "config"
+
+MESSAGES_HEADER = [
+    "rowid", "id", "json", "readStatus", "expires_at", "sent_at",
+    "schemaVersion", "conversationId", "received_at", "source",
+    "hasAttachments", "hasFileAttachments", "hasVisualMediaAttachments",
+    "expireTimer", "expirationStartTimestamp", "type", "body", "messageTimer",
+    "isViewOnce", "sourceServiceId",
+]
+
+CONVERSATIONS_HEADER = [
+    "id", "json", "active_at", "type", "members", "name", "profileName",
+    "profileFamilyName", "profileFullName", "e164", "serviceId", "groupId",
+    "profileLastFetchedAt",
+]
+
+# the 57 columns of `message_attachments` as at 2025-06-28
+ATTACHMENTS_HEADER = [
+    "messageId", "conversationId", "sentAt", "attachmentType",
+    "orderInMessage", "editHistoryIndex", "clientUuid", "size", "contentType",
+    "path", "localKey", "plaintextHash", "caption", "fileName", "blurHash",
+    "height", "width", "digest", "key", "iv", "downloadPath", "version",
+    "incrementalMac", "incrementalMacChunkSize", "transitCdnKey",
+    "transitCdnNumber", "transitCdnUploadTimestamp", "backupMediaName",
+    "backupCdnNumber", "isReencryptableToSameDigest", "reencryptionIv",
+    "reencryptionKey", "reencryptionDigest", "thumbnailPath", "thumbnailSize",
+    "thumbnailContentType", "thumbnailLocalKey", "thumbnailVersion",
+    "screenshotPath", "screenshotSize", "screenshotContentType",
+    "screenshotLocalKey", "screenshotVersion", "backupThumbnailPath",
+    "backupThumbnailSize", "backupThumbnailContentType",
+    "backupThumbnailLocalKey", "backupThumbnailVersion",
+    "storyTextAttachmentJson", "localBackupPath", "isCorrupted",
+    "backfillError", "error", "wasTooBig", "isViewOnce", "pending", "flags",
+]
+
+FIRST_NAMES = [
+    "Alice", "Bob", "Carol", "Dave", "Erin", "Frank", "Grace", "Heidi",
+    "Ivan", "Judy", "Mallory", "Niaj", "Olivia", "Peggy", "Rupert", "Sybil",
+    "Trent", "Victor", "Walter", "Marc-André",
+]
+
+LAST_NAMES = [
+    "Smith", "Tremblay", "Nguyen", "Garcia", "Roy", "Singh", "Wilson",
+    "Martin", "Lee", "Brown", "Côté", "Taylor",
+]
+
+WORDS = [
+    "ok", "see", "you", "tonight", "haha", "that's", "great", "where", "are",
+    "we", "meeting", "lol", "thanks", "did", "read", "this", "call", "me",
+]
+
+LINK_HOSTS = [
+    "www.youtube.com/watch", "youtu.be/dQw4w9WgXcQ", "www.instagram.com/p/Cx1",
+    "twitter.com/someone/status/17", "www.nytimes.com/2024/01/01/world/story.html",
+    "open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC", "maps.app.goo.gl/abc",
+]
+
+LINK_QUERIES = ["", "?si=AbCdEf", "?utm_source=share&utm_medium=ios", "?igsh=MWQ1", "?s=20&t=xyz"]
+
+EMOJI = ["👍", "❤️", "😂", "😮", "😢", "🙏"]
+
+CONTENT_TYPES = ["image/jpeg", "image/png", "video/mp4", "audio/aac", "application/pdf"]
+
+# (type, weight) of the rows in `messages.csv`, only the first two become
+# messages
+MESSAGE_TYPES = [
+    ("incoming", 50),
+    ("outgoing", 40),
+    ("call-history", 4),
+    ("group-v2-change", 3),
+    ("timer-notification", 2),
+    ("keychange", 1),
+]
+
+# first `sent_at`, 2020-09-13
+START_SENT_AT = 1600000000000
+
+def new_uuid(rng):
+    """
+    Generate a random UUID from `rng` so it's the same on every run.
+    """
+
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def synthetic_bodies(count, link_share=0.3, links=500, seed=1):
+    """
+    Generate message bodies that look like a real chat history.
+
+    Parameters:
+    - count: Number of bodies.
+    - link_share: Fraction of the bodies with a link in them.
+    - links: Number of distinct links, fewer means more forwarded links.
+    - seed: Seed so the same bodies are generated every time.
+
+    Returns:
+    - List of strings.
+    """
+
+    rng = random.Random(seed)
+
+    pool = []
+    for index in range(links):
+        url = "https://" + rng.choice(LINK_HOSTS) + str(index) + rng.choice(LINK_QUERIES)
+        pool.append(url + rng.choice(["", "", ".", ")", "!"]))
+
+    bodies = []
+    for _ in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 40)))
+        if rng.random() < link_share:
+            text += " " + rng.choice(pool)
+        bodies.append(text)
+
+    return bodies
+
+def generate_people(rng, count):
+    """
+    Make up the people, the first one is "me".
+
+    Returns:
+    - List of dictionaries with the `people.json` fields plus the Signal
+      `conversationId` and `serviceId` of each person.
+    """
+
+    people = []
+    slugs = set()
+
+    for index in range(count):
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        slug = (first_name + "-" + last_name).lower()
+        if slug in slugs:
+            slug += "-" + str(index)
+        slugs.add(slug)
+
+        people.append({
+            "slug": slug,
+            "first-name": first_name,
+            "last-name": last_name,
+            "mobile": f"+1555{index:07d}",
+            "conversation_id": new_uuid(rng),
+            "service_id": new_uuid(rng),
+        })
+
+    return people
+
+def generate_groups(rng, count, people):
+    """
+    Make up the groups, each with "me" and a few of the other people.
+
+    Returns:
+    - List of dictionaries with the `groups.json` fields.
+    """
+
+    groups = []
+
+    for index in range(count):
+        members = [people[0]] + rng.sample(people[1:], min(len(people) - 1, rng.randint(2, 8)))
+        groups.append({
+            "id": new_uuid(rng),
+            "group_id": new_uuid(rng),
+            "slug": f"group-{index}",
+            "description": f"Group {index}",
+            "people": [member["slug"] for member in members],
+            "members": members,
+        })
+
+    return groups
+
+def write_config(folder, people, groups):
+    """
+    Write `people.json` and `groups.json` in the format `message_md` reads.
+    """
+
+    os.makedirs(folder, exist_ok=True)
+
+    people_json = [
+        {key: value for key, value in the_person.items() if key not in ("conversation_id", "service_id")}
+        for the_person in people
+    ]
+    with open(os.path.join(folder, PEOPLE_FILENAME), "w", encoding="utf-8") as people_file:
+        json.dump(people_json, people_file, indent=2, ensure_ascii=False)
+
+    groups_json = [
+        {key: value for key, value in group.items() if key not in ("group_id", "members")}
+        for group in groups
+    ]
+    with open(os.path.join(folder, GROUPS_FILENAME), "w", encoding="utf-8") as groups_file:
+        json.dump(groups_json, groups_file, indent=2, ensure_ascii=False)
+
+def write_conversations(filename, people, groups):
+    """
+    Write `conversations.csv` with a row for each person and each group.
+    """
+
+    with open(filename, "w", newline="", encoding="utf-8") as conversations_file:
+        writer = csv.writer(conversations_file)
+        writer.writerow(CONVERSATIONS_HEADER)
+
+        for the_person in people:
+            full_name = the_person["first-name"] + " " + the_person["last-name"]
+            data = {
+                "id": the_person["conversation_id"],
+                "e164": the_person["mobile"],
+                "serviceId": the_person["service_id"],
+                "profileName": the_person["first-name"],
+                "profileFamilyName": the_person["last-name"],
+                "profileFullName": full_name,
+                "type": "private",
+            }
+            writer.writerow([
+                the_person["conversation_id"], json.dumps(data, ensure_ascii=False),
+                "", "private", "", "", the_person["first-name"],
+                the_person["last-name"], full_name, the_person["mobile"],
+                the_person["service_id"], "", "",
+            ])
+
+        for group in groups:
+            data = {
+                "id": group["id"],
+                "name": group["description"],
+                "type": "group",
+                "membersV2": [{"aci": member["service_id"]} for member in group["members"]],
+            }
+            writer.writerow([
+                group["id"], json.dumps(data, ensure_ascii=False), "", "group",
+                "", group["description"], "", "", "", "", "",
+                group["group_id"], "",
+            ])
+
+def write_messages(source_folder, rng, count, people, groups, attachment_share=0.1):
+    """
+    Write `messages.csv` and `message_attachments.csv`.
+
+    Parameters:
+    - source_folder: Where the CSV files are written.
+    - rng: The random number generator.
+    - count: Number of rows in `messages.csv`.
+    - people: From `generate_people`.
+    - groups: From `generate_groups`.
+    - attachment_share: Fraction of the messages with attachments.
+
+    Returns:
+    - Tuple of the number of messages and attachment rows written.
+    """
+
+    me = people[0]
+    others = people[1:]
+    bodies = synthetic_bodies(5000, seed=rng.random())
+    types = [type for type, _ in MESSAGE_TYPES]
+    weights = [weight for _, weight in MESSAGE_TYPES]
+
+    # recent messages that can be quoted or reacted to
+    recent = []
+
+    sent_at = START_SENT_AT
+    attachment_count = 0
+
+    messages_path = os.path.join(source_folder, MESSAGES_FILENAME)
+    attachments_path = os.path.join(source_folder, ATTACHMENTS_FILENAME)
+
+    with open(messages_path, "w", newline="", encoding="utf-8") as messages_file, \
+         open(attachments_path, "w", newline="", encoding="utf-8") as attachments_file:
+
+        messages_writer = csv.writer(messages_file)
+        messages_writer.writerow(MESSAGES_HEADER)
+
+        attachments_writer = csv.writer(attachments_file)
+        attachments_writer.writerow(ATTACHMENTS_HEADER)
+
+        for rowid in range(1, count + 1):
+            sent_at += rng.randint(1000, 900000)
+            id = new_uuid(rng)
+            type = rng.choices(types, weights)[0]
+
+            if groups and rng.random() < 0.3:
+                group = rng.choice(groups)
+                conversation_id = group["id"]
+                sender = rng.choice(group["members"][1:]) if type == "incoming" else me
+            else:
+                sender = rng.choice(others)
+                conversation_id = sender["conversation_id"]
+                if type != "incoming":
+                    sender = me
+
+            body = rng.choice(bodies) if rng.random() < 0.9 else ""
+            has_attachments = type in ("incoming", "outgoing") and rng.random() < attachment_share
+
+            data = {
+                "id": id,
+                "conversationId": conversation_id,
+                "type": type,
+                "body": body,
+                "sent_at": sent_at,
+                "timestamp": sent_at,
+                "reactions": [],
+            }
+            if type == "incoming":
+                data["sourceServiceId"] = sender["service_id"]
+
+            if recent and rng.random() < 0.15:
+                target = rng.choice(recent)
+                data["reactions"] = [{
+                    "emoji": rng.choice(EMOJI),
+                    "fromId": rng.choice(people)["conversation_id"],
+                    "targetTimestamp": target[1],
+                    "timestamp": sent_at + rng.randint(1000, 60000),
+                }]
+
+            if recent and rng.random() < 0.08:
+                target = rng.choice(recent)
+                data["quote"] = {
+                    "id": target[1],
+                    "authorAci": target[2],
+                    "text": target[3],
+                    "attachments": [],
+                }
+
+            messages_writer.writerow([
+                rowid, id, json.dumps(data, ensure_ascii=False), 1, "",
+                sent_at, 10, conversation_id, sent_at + rng.randint(0, 5000),
+                sender["mobile"] if type == "incoming" else "",
+                1 if has_attachments else 0, 1 if has_attachments else 0, 0,
+                "", "", type, body, "", 0,
+                sender["service_id"] if type == "incoming" else "",
+            ])
+
+            if type in ("incoming", "outgoing"):
+                recent.append((id, sent_at, sender["service_id"], body))
+                if len(recent) > 200:
+                    recent.pop(0)
+
+            if has_attachments:
+                for order in range(rng.choice([1, 1, 1, 2, 3])):
+                    content_type = rng.choice(CONTENT_TYPES)
+                    row = [""] * len(ATTACHMENTS_HEADER)
+                    row[0:9] = [
+                        id, conversation_id, sent_at, "attachment", order, -1,
+                        new_uuid(rng), rng.randint(1000, 10**7), content_type,
+                    ]
+                    if content_type.startswith(("image/", "video/")):
+                        row[ATTACHMENTS_HEADER.index("height")] = rng.choice([720, 1080, 1920])
+                        row[ATTACHMENTS_HEADER.index("width")] = rng.choice([720, 1080, 1440])
+                    if rng.random() < 0.3:
+                        row[ATTACHMENTS_HEADER.index("fileName")] = f"IMG_{rowid:06d}_{order}.jpg"
+                    attachments_writer.writerow(row)
+                    attachment_count += 1
+
+        # an attachment whose message was deleted, the tool warns about it
+        row = [""] * len(ATTACHMENTS_HEADER)
+        row[0:9] = [new_uuid(rng), "", sent_at, "attachment", 0, -1, "", 1234, "image/png"]
+        attachments_writer.writerow(row)
+        attachment_count += 1
+
+    return count, attachment_count
+
+def generate_export(folder, messages=10000, people=200, groups=20, seed=1):
+    """
+    Generate a complete synthetic export.
+
+    Parameters:
+    - folder: Where to put the `source` and `config` folders.
+    - messages: Number of rows in `messages.csv`.
+    - people: Number of people, including "me".
+    - groups: Number of groups.
+    - seed: Seed so the same export is generated every time.
+
+    Returns:
+    - Dictionary with the `source_folder`, `config_folder`, `me` slug and the
+      number of rows written to each file.
+    """
+
+    rng = random.Random(seed)
+
+    source_folder = os.path.join(folder, SOURCE_FOLDER)
+    config_folder = os.path.join(folder, CONFIG_FOLDER)
+    os.makedirs(source_folder, exist_ok=True)
+
+    the_people = generate_people(rng, max(people, 2))
+    the_groups = generate_groups(rng, groups, the_people)
+
+    write_config(config_folder, the_people, the_groups)
+    write_conversations(os.path.join(source_folder, CONVERSATIONS_FILENAME), the_people, the_groups)
+    message_count, attachment_count = write_messages(source_folder, rng, messages, the_people, the_groups)
+
+    return {
+        "source_folder": source_folder,
+        "config_folder": config_folder,
+        "me": the_people[0]["slug"],
+        "messages": message_count,
+        "conversations": len(the_people) + len(the_groups),
+        "attachments": attachment_count,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Signal export")
+    parser.add_argument("folder", help="Where to write the export")
+    parser.add_argument("-n", "--messages", type=int, default=10000, help="Number of rows in messages.csv")
+    parser.add_argument("--people", type=int, default=200, help="Number of people")
+    parser.add_argument("--groups", type=int, default=20, help="Number of groups")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    args = parser.parse_args()
+
+    result = generate_export(args.folder, args.messages, args.people, args.groups, args.seed)
+
+    print(f"Wrote {result['messages']} messages, {result['conversations']} conversations "
+          f"and {result['attachments']} attachments to {result['source_folder']}")
+    print(f"Config is in {result['config_folder']}, use -m {result['me']}")
+
+if __name__ == "__main__":
+    main()
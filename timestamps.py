@@ -0,0 +1,183 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to converting Signal timestamps to local date and time.
+#
+# Signal stores times as milliseconds since the epoch (`sent_at`, `sentAt`).
+# Asking the OS (or `zoneinfo`) for the local time of every single message
+# is slow, and the answer only changes at a daylight saving (or other UTC
+# offset) transition. So the UTC offset is looked up once per hour-long
+# window and cached, after which converting a timestamp is just arithmetic.
+#
+# By default the local time zone of the machine is used. Pass `--timezone`
+# with an IANA name, e.g. `America/Toronto`, to get the same output on any
+# machine.
+#
+# -----------------------------------------------------------------------------
+
+import time
+from datetime import datetime, timedelta
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError: # Python < 3.9
+    ZoneInfo = None
+
+# offsets change on the hour (or half hour), so a window of an hour never
+# has more than one transition in it
+WINDOW_SECONDS = 3600
+
+EPOCH = datetime(1970, 1, 1)
+
+class TimestampConverter:
+    """
+    Converts seconds since the epoch to local time using a cache of UTC
+    offsets.
+
+    Attributes:
+    - timezone_name: IANA time zone name, empty for the machine's local time.
+    - windows: Dictionary of `(offset, isdst, zone)` for each window of
+      `WINDOW_SECONDS` that doesn't have a transition in it.
+    """
+
+    def __init__(self, timezone_name=""):
+        self.timezone_name = timezone_name
+        self.zone = None
+        self.windows = {}
+
+        if timezone_name:
+            if ZoneInfo is None:
+                raise ValueError("--timezone needs Python 3.9 or later")
+            self.zone = ZoneInfo(timezone_name)
+
+    def lookup(self, seconds):
+        """
+        Ask the OS or `zoneinfo` for the UTC offset at a point in time.
+
+        Parameters:
+        - seconds: Seconds since the epoch.
+
+        Returns:
+        - Tuple of the UTC offset in seconds, the DST flag and the zone's
+          abbreviation, e.g. `(-14400, 1, "EDT")`.
+        """
+
+        if self.zone is None:
+            local = time.localtime(seconds)
+            return (local.tm_gmtoff, local.tm_isdst, local.tm_zone)
+
+        local = datetime.fromtimestamp(seconds, self.zone)
+        offset = int(local.utcoffset().total_seconds())
+        isdst = 1 if local.dst() else 0
+
+        return (offset, isdst, local.tzname())
+
+    def offset(self, seconds):
+        """
+        Get the cached `(offset, isdst, zone)` at a point in time.
+
+        Parameters:
+        - seconds: Seconds since the epoch.
+
+        Returns:
+        - Same as `lookup`.
+        """
+
+        window = seconds // WINDOW_SECONDS
+
+        try:
+            return self.windows[window]
+        except KeyError:
+            pass
+
+        start = window * WINDOW_SECONDS
+        first = self.lookup(start)
+        last = self.lookup(start + WINDOW_SECONDS - 1)
+
+        # the window has a transition in it so don't cache it
+        if first != last:
+            return self.lookup(seconds)
+
+        self.windows[window] = first
+
+        return first
+
+    def local_time(self, seconds):
+        """
+        Convert seconds since the epoch to local time, like `time.localtime`.
+
+        Parameters:
+        - seconds: Whole seconds since the epoch.
+
+        Returns:
+        - The local time as a `time.struct_time`.
+        """
+
+        offset, isdst, zone = self.offset(seconds)
+        utc = time.gmtime(seconds + offset)
+
+        return time.struct_time(tuple(utc[:8]) + (isdst, zone, offset))
+
+    def local_times(self, timestamps):
+        """
+        Convert a column of timestamps in milliseconds to local time.
+
+        Parameters:
+        - timestamps: Iterable of milliseconds since the epoch.
+
+        Returns:
+        - List of `time.struct_time`, one per timestamp.
+        """
+
+        return [self.local_time(int(timestamp) // 1000) for timestamp in timestamps]
+
+    def local_datetime(self, timestamp_ms):
+        """
+        Convert milliseconds since the epoch to a naive local `datetime`, like
+        `datetime.fromtimestamp`.
+
+        Parameters:
+        - timestamp_ms: Milliseconds since the epoch.
+
+        Returns:
+        - The local date and time as a `datetime` without a `tzinfo`.
+        """
+
+        offset = self.offset(timestamp_ms // 1000)[0]
+
+        return EPOCH + timedelta(milliseconds=timestamp_ms + offset * 1000)
+
+# the converter used by the parsers, replaced by `set_timezone`
+converter = TimestampConverter()
+
+def set_timezone(timezone_name):
+    """
+    Use a specific time zone for all conversions instead of the local one.
+
+    Parameters:
+    - timezone_name: IANA time zone name, e.g. `America/Toronto`. Empty for
+      the machine's local time zone.
+    """
+
+    global converter
+    converter = TimestampConverter(timezone_name)
+
+def local_time(seconds):
+    """
+    Convert seconds since the epoch to a local `time.struct_time`.
+    """
+
+    return converter.local_time(seconds)
+
+def local_times(timestamps):
+    """
+    Convert a column of timestamps in milliseconds to local `time.struct_time`.
+    """
+
+    return converter.local_times(timestamps)
+
+def local_datetime(timestamp_ms):
+    """
+    Convert milliseconds since the epoch to a naive local `datetime`.
+    """
+
+    return converter.local_datetime(timestamp_ms)
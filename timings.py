@@ -0,0 +1,325 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to the `--timings` report of `signal_sqlite_md.py`.
+#
+# Each stage of a run (reading the conversations, reading and parsing the
+# messages, decoding their JSON, joining the attachments and writing the
+# Markdown) records its wall time, CPU time and the number of rows it handled.
+# Stages started inside another one are nested under it, so the "self" time of
+# `get_markdown` is the time spent writing Markdown rather than loading the
+# messages.
+#
+# Counters keep track of rows that are dropped along the way: rows skipped
+# because of their type, their date or their conversation, decoded rows whose
+# JSON was broken and attachments without a matching message.
+#
+# Recording is off unless `--timings` is passed, in which case the report is
+# written as JSON to the output folder and printed as a table at the end.
+#
+# -----------------------------------------------------------------------------
+
+import collections
+import json
+import os
+import time
+
+TIMINGS_FILENAME = "signal_sqlite_md_timings.json"
+
+COUNTER_SKIPPED_BY_TYPE = "rows skipped by type"
+# only the rows `signal_json.needs_decoding` picked are decoded, so a broken
+# `json` column without reactions or a quote isn't counted
+COUNTER_JSON_ERRORS = "decoded rows with JSON errors"
+COUNTER_ATTACHMENTS_WITHOUT_MESSAGE = "attachments without a message"
+COUNTER_BEFORE_BEGIN = "rows before the begin date"
+COUNTER_OTHER_CONVERSATIONS = "rows of other conversations"
+
+class Stage:
+    """
+    The time spent in one stage of a run.
+
+    Attributes:
+    - name: The name of the stage, e.g. "load_messages".
+    - parent: The name of the stage it runs in, empty for a top level stage.
+    - wall: Wall time in seconds.
+    - cpu: CPU time of this process in seconds.
+    - rows: Number of rows handled.
+    - calls: Number of times the stage was entered.
+    """
+
+    def __init__(self, name, parent=""):
+        self.name = name
+        self.parent = parent
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.rows = 0
+        self.calls = 0
+
+class StageTimer:
+    """
+    Context manager that adds the time spent in a `with` block to a Stage.
+    """
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.timings.active.append(self.stage.name)
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self.stage
+
+    def __exit__(self, *exc_info):
+        self.stage.wall += time.perf_counter() - self.wall
+        self.stage.cpu += time.process_time() - self.cpu
+        self.stage.calls += 1
+        self.timings.active.pop()
+        return False
+
+class NullTimer:
+    """
+    Context manager used when timings are off, hands out a scratch Stage so
+    the code being timed doesn't have to check.
+    """
+
+    def __init__(self):
+        self.stage = Stage("")
+
+    def __enter__(self):
+        return self.stage
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class Timings:
+    """
+    The stages and counters of a run.
+
+    Attributes:
+    - enabled: Only record anything when True.
+    - stages: Dictionary of Stage objects by name, in the order they started.
+    - counters: Counter of the dropped rows, see the `COUNTER_*` names.
+    - skipped_types: Counter of the rows skipped by type, by type.
+    - active: Names of the stages currently running, innermost last.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = collections.Counter()
+        self.skipped_types = collections.Counter()
+        self.active = []
+
+    def get_stage(self, name):
+        """
+        Get a stage by name, creating it under the running stage if it's new.
+        """
+
+        try:
+            return self.stages[name]
+        except KeyError:
+            parent = self.active[-1] if self.active else ""
+            the_stage = self.stages[name] = Stage(name, parent)
+            return the_stage
+
+    def stage(self, name):
+        """
+        Time a block of code as a stage.
+
+        Parameters:
+        - name: The name of the stage. Entering the same stage again adds to
+          its time, e.g. when it runs once per row.
+
+        Returns:
+        - Context manager giving the Stage, so `rows` can be added to it.
+        """
+
+        if not self.enabled:
+            return NULL_TIMER
+
+        return StageTimer(self, self.get_stage(name))
+
+    def timed(self, name, rows):
+        """
+        Time reading each item of `rows` as a stage.
+
+        Parameters:
+        - name: The name of the stage.
+        - rows: Iterable, e.g. a `csv.reader`.
+
+        Returns:
+        - Generator yielding the same items, or `rows` itself when timings
+          are off.
+        """
+
+        if not self.enabled:
+            return rows
+
+        return self._timed(self.get_stage(name), iter(rows))
+
+    def _timed(self, the_stage, rows):
+        the_stage.calls += 1
+        while True:
+            wall = time.perf_counter()
+            cpu = time.process_time()
+            try:
+                row = next(rows)
+            except StopIteration:
+                return
+            finally:
+                the_stage.wall += time.perf_counter() - wall
+                the_stage.cpu += time.process_time() - cpu
+            the_stage.rows += 1
+            yield row
+
+    def count(self, name, amount=1):
+        """
+        Add to one of the `COUNTER_*` counters.
+        """
+
+        self.counters[name] += amount
+
+    def skip_type(self, type):
+        """
+        Count a row skipped because of its type.
+        """
+
+        self.skipped_types[type] += 1
+        self.counters[COUNTER_SKIPPED_BY_TYPE] += 1
+
+    def self_wall(self, the_stage):
+        """
+        Get the wall time of a stage minus the stages nested in it.
+        """
+
+        nested = sum(
+            other.wall for other in self.stages.values() if other.parent == the_stage.name)
+
+        return max(the_stage.wall - nested, 0.0)
+
+    def report(self):
+        """
+        Get the stages and counters as a dictionary that can be saved as JSON.
+        """
+
+        return {
+            "stages": [
+                {
+                    "name": the_stage.name,
+                    "parent": the_stage.parent,
+                    "wall_seconds": round(the_stage.wall, 6),
+                    "self_wall_seconds": round(self.self_wall(the_stage), 6),
+                    "cpu_seconds": round(the_stage.cpu, 6),
+                    "rows": the_stage.rows,
+                    "calls": the_stage.calls,
+                }
+                for the_stage in self.stages.values()
+            ],
+            "counters": {
+                COUNTER_SKIPPED_BY_TYPE: dict(self.skipped_types),
+                COUNTER_JSON_ERRORS: self.counters[COUNTER_JSON_ERRORS],
+                COUNTER_ATTACHMENTS_WITHOUT_MESSAGE: self.counters[COUNTER_ATTACHMENTS_WITHOUT_MESSAGE],
+                COUNTER_BEFORE_BEGIN: self.counters[COUNTER_BEFORE_BEGIN],
+                COUNTER_OTHER_CONVERSATIONS: self.counters[COUNTER_OTHER_CONVERSATIONS],
+            },
+        }
+
+    def save(self, folder):
+        """
+        Write the report to `TIMINGS_FILENAME` in `folder`.
+
+        Returns:
+        - The path of the report.
+        """
+
+        path = os.path.join(folder, TIMINGS_FILENAME)
+
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(self.report(), report_file, indent=2, ensure_ascii=False)
+
+        return path
+
+    def depth(self, the_stage):
+        """
+        Get how many stages `the_stage` is nested in.
+        """
+
+        depth = 0
+        while the_stage.parent in self.stages:
+            the_stage = self.stages[the_stage.parent]
+            depth += 1
+
+        return depth
+
+    def children(self, parent):
+        """
+        Get the stages nested directly in `parent`, empty for the top level.
+        """
+
+        return [the_stage for the_stage in self.stages.values() if the_stage.parent == parent]
+
+    def print_table(self):
+        """
+        Print the stages, nested stages under their parent, and the counters.
+        """
+
+        print(f"{'stage':<26} {'wall s':>9} {'self s':>9} {'cpu s':>9} {'rows':>10}")
+
+        def print_stages(parent):
+            for the_stage in self.children(parent):
+                name = "  " * self.depth(the_stage) + the_stage.name
+                print(f"{name:<26} {the_stage.wall:>9.3f} {self.self_wall(the_stage):>9.3f} "
+                      f"{the_stage.cpu:>9.3f} {the_stage.rows:>10}")
+                print_stages(the_stage.name)
+
+        print_stages("")
+
+        print()
+        print(f"{COUNTER_SKIPPED_BY_TYPE}: {self.counters[COUNTER_SKIPPED_BY_TYPE]}")
+        for type, count in self.skipped_types.most_common():
+            print(f"  {type or '(empty)'}: {count}")
+        print(f"{COUNTER_JSON_ERRORS}: {self.counters[COUNTER_JSON_ERRORS]}")
+        print(f"{COUNTER_ATTACHMENTS_WITHOUT_MESSAGE}: {self.counters[COUNTER_ATTACHMENTS_WITHOUT_MESSAGE]}")
+        print(f"{COUNTER_BEFORE_BEGIN}: {self.counters[COUNTER_BEFORE_BEGIN]}")
+        print(f"{COUNTER_OTHER_CONVERSATIONS}: {self.counters[COUNTER_OTHER_CONVERSATIONS]}")
+
+# the timings of this run, replaced by `enable`
+current = Timings()
+
+def enable():
+    """
+    Start recording the timings and counters.
+    """
+
+    global current
+    current = Timings(enabled=True)
+
+def stage(name):
+    """
+    Time a block of code as a stage of `current`, see `Timings.stage`.
+    """
+
+    return current.stage(name)
+
+def timed(name, rows):
+    """
+    Time reading each item of `rows` as a stage of `current`.
+    """
+
+    return current.timed(name, rows)
+
+def count(name, amount=1):
+    """
+    Add to one of the `COUNTER_*` counters of `current`.
+    """
+
+    current.count(name, amount)
+
+def skip_type(type):
+    """
+    Count a row of `current` skipped because of its type.
+    """
+
+    current.skip_type(type)
@@ -0,0 +1,205 @@
+# -----------------------------------------------------------------------------
+#
+# Code related to the `--incremental` mode of `signal_sqlite_md.py`.
+#
+# The highest `rowid` and `sent_at` converted so far are kept in a small JSON
+# state file in the source folder. On the next run, rows at or below that
+# watermark are skipped before any Message is built, so only the messages
+# added since the last export are converted.
+#
+# `message_md` writes one file per person per day, so a day can't be written
+# with only its new messages: the earlier ones would be lost. The rows are
+# first scanned for the local days that have new rows, and every row of those
+# days is converted again, old or new.
+#
+# -----------------------------------------------------------------------------
+
+import os
+import json
+import logging
+from datetime import date
+
+import timestamps
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+STATE_FILENAME = "signal_sqlite_md_state.json"
+
+STATE_ROW_ID = "rowid"
+STATE_SENT_AT = "sent_at"
+
+def to_int(value):
+    """
+    Convert a `rowid` or `sent_at` column value to an int, None if it's not a
+    number.
+    """
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def local_day(sent_at):
+    """
+    Get the local day of a `sent_at` in milliseconds as a `date` ordinal, the
+    day `message_md` writes the message in.
+    """
+
+    local = timestamps.local_time(int(sent_at / 1000))
+    return date(local.tm_year, local.tm_mon, local.tm_mday).toordinal()
+
+class Watermark:
+    """
+    The last `rowid` and `sent_at` converted from a source folder.
+
+    Attributes:
+    - path: The JSON state file.
+    - rowid: Highest `rowid` converted by previous runs.
+    - sent_at: Highest `sent_at` converted by previous runs.
+    - next_rowid: Highest `rowid` seen by this run.
+    - next_sent_at: Highest `sent_at` seen by this run.
+    - skipped: Number of rows skipped by this run.
+    - days: Set of the local days, as `date` ordinals, that have new rows,
+      None until `add_new_day` or `no_new_days` is called.
+    - since: Earliest `sent_at` of those days, in milliseconds, minus a day
+      of margin for the time zone, None if there are none.
+    """
+
+    def __init__(self, source_folder):
+        self.path = os.path.join(source_folder, STATE_FILENAME)
+        self.rowid = 0
+        self.sent_at = 0
+        self.next_rowid = 0
+        self.next_sent_at = 0
+        self.skipped = 0
+        self.days = None
+        self.since = None
+
+    def load(self):
+        """
+        Load the watermark from the state file, if there is one.
+        """
+
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, encoding="utf-8") as state_file:
+                data = json.load(state_file)
+            self.rowid = int(data.get(STATE_ROW_ID, 0))
+            self.sent_at = int(data.get(STATE_SENT_AT, 0))
+        except Exception as e:
+            logging.error(f"Could not read {self.path}, converting everything: {e}")
+            self.rowid = 0
+            self.sent_at = 0
+
+        self.next_rowid = self.rowid
+        self.next_sent_at = self.sent_at
+
+    def save(self):
+        """
+        Save the highest `rowid` and `sent_at` seen by this run to the state
+        file. Call it only after the Markdown has been written.
+        """
+
+        data = {
+            STATE_ROW_ID: self.next_rowid,
+            STATE_SENT_AT: self.next_sent_at,
+        }
+
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as state_file:
+            json.dump(data, state_file, indent=2)
+        os.replace(temp_path, self.path)
+
+    def is_empty(self):
+        """
+        Check if nothing was converted before, so every row is new.
+        """
+
+        return not self.rowid and not self.sent_at
+
+    def is_new(self, rowid, sent_at):
+        """
+        Check if a row wasn't converted by a previous run.
+
+        Parameters:
+        - rowid: The row's `rowid` column value.
+        - sent_at: The row's `sent_at` column value.
+
+        Returns:
+        - True if the row is newer than the watermark.
+
+        Notes:
+        - The `rowid` is used when the export has it since it only ever goes
+          up, otherwise fall back to `sent_at`.
+        """
+
+        rowid = to_int(rowid)
+
+        if rowid is not None:
+            return rowid > self.rowid
+
+        sent_at = to_int(sent_at)
+        if sent_at is not None:
+            return sent_at > self.sent_at
+
+        return True
+
+    def add_new_day(self, rowid, sent_at):
+        """
+        Remember the local day of a row if it's new, while scanning the rows
+        before they're converted.
+        """
+
+        if self.days is None:
+            self.days = set()
+
+        sent_at = to_int(sent_at)
+        if sent_at is None or not self.is_new(rowid, sent_at):
+            return
+
+        self.days.add(local_day(sent_at))
+
+        since = sent_at - sent_at % MS_PER_DAY - MS_PER_DAY
+        if self.since is None or since < self.since:
+            self.since = since
+
+    def no_new_days(self):
+        """
+        Mark the scan done without any day, when every row is new anyway.
+        """
+
+        if self.days is None:
+            self.days = set()
+
+    def keep(self, rowid, sent_at):
+        """
+        Check if a row has to be converted and move the watermark for this
+        run forward.
+
+        Parameters:
+        - rowid: The row's `rowid` column value.
+        - sent_at: The row's `sent_at` column value.
+
+        Returns:
+        - True if the row is newer than the watermark, or is on a local day
+          that has a new row, False to skip it.
+        """
+
+        rowid_value = to_int(rowid)
+        sent_at_value = to_int(sent_at)
+
+        if rowid_value is not None and rowid_value > self.next_rowid:
+            self.next_rowid = rowid_value
+        if sent_at_value is not None and sent_at_value > self.next_sent_at:
+            self.next_sent_at = sent_at_value
+
+        if self.is_new(rowid, sent_at):
+            return True
+
+        if self.days and sent_at_value is not None and local_day(sent_at_value) in self.days:
+            return True
+
+        self.skipped += 1
+        return False